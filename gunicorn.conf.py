@@ -0,0 +1,10 @@
+import os
+
+# Load the app (models, index, question store) once in the master before forking,
+# so workers share the read-only pages instead of each holding a private copy
+preload_app = True
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("GUNICORN_WORKERS", "4"))
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
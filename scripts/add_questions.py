@@ -0,0 +1,51 @@
+import sys
+import os
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import argparse
+import pandas as pd
+from src.config import Config
+from src.embedding import load_embedding_model
+from src.artifacts import load_artifact_set
+from src.index_updates import add_questions, compact_index
+
+
+def add_questions_from_file(input_path, emb_model_name_or_path=None, compact=False):
+    """
+    Add questions from a TSV file to the persisted index and question store.
+
+    Args:
+        input_path: TSV file with 'qid' and 'question' columns. If None, no questions are added.
+        emb_model_name_or_path: Name or path of the embedding model
+        compact: Merge the delta index into the main index afterwards
+    """
+    emb_model_name_or_path = emb_model_name_or_path or Config.EMBEDDING_MODEL
+
+    questions = []
+    if input_path is not None:
+        new_df = pd.read_csv(input_path, sep='\t', dtype=object, quoting=3).dropna(subset=['qid', 'question'])
+        print(f"Read {len(new_df)} questions from {input_path}")
+        questions = list(zip(new_df['qid'], new_df['question']))
+
+    # Loaded like at server startup, which recovers from an add that stopped halfway
+    artifacts = load_artifact_set()
+    try:
+        if questions:
+            artifacts, _ = add_questions(questions, load_embedding_model(emb_model_name_or_path), artifacts)
+
+        if compact:
+            compact_index(artifacts)
+    finally:
+        artifacts.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add new questions to the search index without a full rebuild.")
+    parser.add_argument("input_path", nargs='?', help="TSV file with 'qid' and 'question' columns")
+    parser.add_argument("--compact", action="store_true", help="Merge the delta index into the main index")
+    args = parser.parse_args()
+
+    if not args.input_path and not args.compact:
+        parser.error("Provide an input file, --compact, or both")
+    add_questions_from_file(args.input_path, compact=args.compact)
@@ -0,0 +1,396 @@
+import sys
+import os
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import argparse
+import json
+import platform
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import faiss
+import torch
+from src.config import Config
+from src.artifacts import write_manifest
+from src.embedding import generate_embeddings, load_embedding_model
+from src.faiss_index_search import build_faiss_index, load_tiered_index, INDEX_TYPES
+from src.reranker import load_reranker
+from src.question_matcher import search_similar_questions_batch
+from src.question_store import QuestionStore
+from src.utils import clean_question_text
+
+# Vocabulary of the synthetic corpus and of the stand-in models' tokenizer
+WORDS = (
+    "what is how do i can why are the a an to of in for on with best way learn make get become good bad "
+    "python java code data science machine learning money online job interview career life love friend "
+    "weight lose gain food health exercise sleep book movie music game phone laptop buy sell start "
+    "business stock market invest country india usa english language speak write improve skill"
+).split()
+
+
+def create_stand_in_models(model_dir, hidden_size=64, num_layers=2, seed=42):
+    """
+    Create small randomly initialized local models with the same interfaces as the real ones.
+
+    Latencies measured with them say nothing about absolute model cost, but they
+    exercise every stage of the pipeline offline and expose regressions in the
+    code around the models.
+
+    Args:
+        model_dir: Directory to write the models to
+        hidden_size: Hidden size of both models
+        num_layers: Number of transformer layers of both models
+        seed: Random seed for the weights
+
+    Returns:
+        Tuple of (embedding model path, reranker path)
+    """
+    from transformers import BertConfig, BertModel, BertForSequenceClassification, BertTokenizer
+    from sentence_transformers import SentenceTransformer, models
+
+    torch.manual_seed(seed)
+    os.makedirs(model_dir, exist_ok=True)
+    vocab_path = os.path.join(model_dir, 'vocab.txt')
+    with open(vocab_path, 'w') as f:
+        f.write('\n'.join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "?"] + list(WORDS)))
+    tokenizer = BertTokenizer(vocab_path)
+
+    bert_config = BertConfig(vocab_size=tokenizer.vocab_size, hidden_size=hidden_size,
+                             num_hidden_layers=num_layers, num_attention_heads=max(hidden_size // 32, 1),
+                             intermediate_size=hidden_size * 2, max_position_embeddings=128)
+
+    encoder_path = os.path.join(model_dir, 'encoder')
+    BertModel(bert_config).save_pretrained(encoder_path)
+    tokenizer.save_pretrained(encoder_path)
+    embedding_path = os.path.join(model_dir, 'embedding')
+    transformer = models.Transformer(encoder_path)
+    SentenceTransformer(modules=[transformer, models.Pooling(hidden_size), models.Normalize()]).save(embedding_path)
+
+    reranker_path = os.path.join(model_dir, 'reranker')
+    bert_config.num_labels = 1
+    BertForSequenceClassification(bert_config).save_pretrained(reranker_path)
+    tokenizer.save_pretrained(reranker_path)
+
+    return embedding_path, reranker_path
+
+
+def make_synthetic_questions(count, rng):
+    """Generate random questions of 3 to 15 words from WORDS"""
+    lengths = rng.integers(3, 16, size=count)
+    return [' '.join(rng.choice(WORDS, size=length)) + '?' for length in lengths]
+
+
+def make_queries(corpus, count, repeat_share, exact_share, rng):
+    """
+    Generate benchmark queries.
+
+    Args:
+        corpus: List of corpus questions
+        count: Number of queries
+        repeat_share: Share of queries repeating an earlier query (exercises the caches)
+        exact_share: Share of queries copied from the corpus with different case (exercises exact matching)
+        rng: numpy random Generator
+
+    Returns:
+        List of query texts
+    """
+    queries = []
+    for text in make_synthetic_questions(count, rng):
+        draw = rng.random()
+        if queries and draw < repeat_share:
+            text = queries[rng.integers(len(queries))]
+        elif draw < repeat_share + exact_share:
+            text = corpus[rng.integers(len(corpus))].upper()
+        queries.append(text)
+    return queries
+
+
+def build_artifacts(work_dir, corpus_size, index_type, hidden_size, rng):
+    """
+    Create stand-in models, a synthetic corpus and its index, and point Config at them.
+
+    Returns:
+        List of corpus questions
+    """
+    embedding_path, reranker_path = create_stand_in_models(os.path.join(work_dir, 'models'), hidden_size)
+
+    Config.EMBEDDING_MODEL = embedding_path
+    Config.RERANKER_MODEL = reranker_path
+    Config.INFERENCE_BACKEND = 'torch'
+    Config.ARTIFACT_MANIFEST_PATH = os.path.join(work_dir, 'manifest.json')
+    Config.QUESTION_STORE_PATH = os.path.join(work_dir, 'question_store')
+    Config.EMBEDDINGS_PATH = os.path.join(work_dir, 'embeddings.npy')
+    Config.FAISS_INDEX_PATH = os.path.join(work_dir, 'index.faiss')
+    Config.DELTA_INDEX_PATH = os.path.join(work_dir, 'delta.faiss')
+    Config.RESPONSE_CACHE_PATH = os.path.join(work_dir, 'response_cache.sqlite')
+    if index_type in ('ivf_pq',):
+        Config.PQ_M = 8
+
+    corpus = list(dict.fromkeys(make_synthetic_questions(corpus_size, rng)))
+    store = QuestionStore.from_dataframe(_questions_frame(corpus))
+    store.save()
+
+    print(f"Embedding {len(corpus)} synthetic questions...")
+    embeddings = generate_embeddings(list(store.texts), embedding_path)
+    index = build_faiss_index(embeddings, index_type)
+    faiss.write_index(index, Config.FAISS_INDEX_PATH)
+    write_manifest(index.ntotal, index.d, index_type)
+    return corpus
+
+
+def _questions_frame(corpus):
+    return pd.DataFrame({'qid': [str(i) for i in range(len(corpus))],
+                         'clean_question': [clean_question_text(q) for q in corpus]})
+
+
+def latency_summary(latencies_s, wall_s, num_queries):
+    """
+    Summarize request latencies.
+
+    Args:
+        latencies_s: List of request latencies in seconds
+        wall_s: Wall-clock time of the whole run in seconds
+        num_queries: Number of queries served (more than requests for batch requests)
+
+    Returns:
+        Dictionary with p50/p95/p99/mean latency in milliseconds and queries per second
+    """
+    latencies_ms = np.asarray(latencies_s) * 1000
+    return {
+        'requests': len(latencies_ms),
+        'queries': num_queries,
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p95_ms': float(np.percentile(latencies_ms, 95)),
+        'p99_ms': float(np.percentile(latencies_ms, 99)),
+        'mean_ms': float(np.mean(latencies_ms)),
+        'qps': num_queries / wall_s
+    }
+
+
+def run_concurrently(fn, items, concurrency):
+    """
+    Call fn on every item from concurrency threads.
+
+    Returns:
+        Tuple of (list of per-call latencies in seconds, wall-clock seconds)
+    """
+    def timed_call(item):
+        start = time.perf_counter()
+        fn(item)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(timed_call, items))
+    return latencies, time.perf_counter() - start
+
+
+def benchmark_function(queries, concurrency_levels):
+    """
+    Benchmark the search pipeline called directly, without caches or request batching.
+
+    Hugging Face fast tokenizers cannot be used from several threads at once, so
+    concurrent calls are serialized and higher concurrency shows queueing delay.
+
+    Returns:
+        List of result dictionaries, one per concurrency level, with the mean time per query in each stage
+    """
+    emb_model = load_embedding_model()
+    reranker = load_reranker()
+    index = load_tiered_index()
+    store = QuestionStore.load()
+
+    results = []
+    for concurrency in concurrency_levels:
+        stage_totals = {}
+        lock = threading.Lock()
+
+        def search(query):
+            timings = {}
+            with lock:
+                search_similar_questions_batch([query], emb_model, index, store, reranker, timings=timings)
+                for stage, seconds in timings.items():
+                    stage_totals[stage] = stage_totals.get(stage, 0.0) + seconds
+
+        search(queries[0])  # warm up
+        stage_totals.clear()
+        latencies, wall = run_concurrently(search, queries, concurrency)
+        summary = latency_summary(latencies, wall, len(queries))
+        summary['concurrency'] = concurrency
+        summary['stages_ms'] = {stage: total / len(queries) * 1000 for stage, total in sorted(stage_totals.items())}
+        results.append(summary)
+        _print_summary('function', concurrency, summary)
+    return results
+
+
+def _stage_means_from_metrics(metrics_text, num_queries):
+    # Mean milliseconds per query in each stage, from the search_stage_duration_seconds sums
+    sums = re.findall(r'^search_stage_duration_seconds_sum\{stage="(\w+)"\} (\S+)$', metrics_text, re.MULTILINE)
+    return {stage: float(total) / num_queries * 1000 for stage, total in sums}
+
+
+def benchmark_endpoints(queries, concurrency_levels, batch_size):
+    """
+    Benchmark /api/search and /api/search/batch through the Flask app, with caches and request batching as configured.
+
+    A fresh app is created for each run and the shared response cache is emptied, so caches start cold.
+
+    Returns:
+        Dictionary of endpoint -> list of result dictionaries, one per concurrency level
+    """
+    from src.app import create_app
+
+    results = {'/api/search': [], '/api/search/batch': []}
+    for concurrency in concurrency_levels:
+        app = create_app()
+        if app.response_cache is not None:
+            app.response_cache.clear()
+        clients = threading.local()
+
+        def client():
+            if not hasattr(clients, 'client'):
+                clients.client = app.test_client()
+            return clients.client
+
+        def search(query):
+            response = client().post('/api/search', json={'query': query})
+            if response.status_code != 200:
+                raise RuntimeError(f"/api/search returned {response.status_code}: {response.get_data(as_text=True)}")
+
+        latencies, wall = run_concurrently(search, queries, concurrency)
+        summary = latency_summary(latencies, wall, len(queries))
+        stats = app.test_client().get('/api/stats').get_json()
+        summary.update({
+            'concurrency': concurrency,
+            'stages_ms': _stage_means_from_metrics(app.test_client().get('/metrics').get_data(as_text=True),
+                                                   len(queries)),
+            'rerank_paths': stats['rerank']['paths'],
+            'exact_matches': stats['exact_matches'],
+            'mean_batch_size': stats['batching']['mean_batch_size'] if stats['batching'] else None,
+            'embedding_cache_hit_rate': stats['embedding_cache']['hit_rate'] if stats['embedding_cache'] else None,
+            'rerank_cache_hit_rate': stats['rerank_cache']['hit_rate'] if stats['rerank_cache'] else None,
+            'response_cache_hit_rate': stats['response_cache']['hit_rate'] if stats['response_cache'] else None
+        })
+        results['/api/search'].append(summary)
+        _print_summary('/api/search', concurrency, summary)
+
+        app = create_app()
+        clients = threading.local()
+        batches = [queries[i:i + batch_size] for i in range(0, len(queries), batch_size)]
+
+        def search_batch(batch):
+            response = client().post('/api/search/batch', json={'queries': batch, 'stream': False})
+            if response.status_code != 200:
+                raise RuntimeError(f"/api/search/batch returned {response.status_code}")
+
+        latencies, wall = run_concurrently(search_batch, batches, concurrency)
+        summary = latency_summary(latencies, wall, len(queries))
+        summary.update({'concurrency': concurrency, 'batch_size': batch_size})
+        results['/api/search/batch'].append(summary)
+        _print_summary('/api/search/batch', concurrency, summary)
+
+    return results
+
+
+def _print_summary(name, concurrency, summary):
+    print(f"{name:<18} c={concurrency:<3} p50 {summary['p50_ms']:8.2f} ms  p95 {summary['p95_ms']:8.2f} ms  "
+          f"p99 {summary['p99_ms']:8.2f} ms  {summary['qps']:8.1f} queries/s")
+    if summary.get('stages_ms'):
+        print(' ' * 25 + '  '.join(f"{stage} {ms:.2f}" for stage, ms in summary['stages_ms'].items()) + "  (ms/query)")
+
+
+def run_benchmark(output_path, corpus_size=20000, num_queries=500, concurrency_levels=(1, 4, 16),
+                  index_type='flat', hidden_size=64, repeat_share=0.2, exact_share=0.1, batch_size=32,
+                  work_dir=None, endpoints=True, seed=42):
+    """
+    Build a synthetic search system with stand-in models and measure search latency.
+
+    Args:
+        output_path: Path of the JSON results file
+        corpus_size: Number of synthetic corpus questions
+        num_queries: Number of queries per run
+        concurrency_levels: Numbers of concurrent clients to measure
+        index_type: FAISS index type
+        hidden_size: Hidden size of the stand-in models
+        repeat_share: Share of queries repeating an earlier query
+        exact_share: Share of queries matching a corpus question
+        batch_size: Queries per /api/search/batch request
+        work_dir: Directory for the models and artifacts. If None, a temporary directory is used.
+        endpoints: Also benchmark the Flask endpoints
+        seed: Random seed for the corpus, queries and models
+
+    Returns:
+        Dictionary with the benchmark settings and results, as written to output_path
+    """
+    rng = np.random.default_rng(seed)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = work_dir or temp_dir
+        corpus = build_artifacts(work_dir, corpus_size, index_type, hidden_size, rng)
+        queries = make_queries(corpus, num_queries, repeat_share, exact_share, rng)
+
+        report = {
+            'settings': {
+                'corpus_size': len(corpus),
+                'num_queries': num_queries,
+                'concurrency_levels': list(concurrency_levels),
+                'index_type': index_type,
+                'hidden_size': hidden_size,
+                'repeat_share': repeat_share,
+                'exact_share': exact_share,
+                'batch_size': batch_size,
+                'seed': seed,
+                'candidates': Config.DEFAULT_CANDIDATES,
+                'results': Config.DEFAULT_RESULTS
+            },
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'torch': torch.__version__,
+                'torch_threads': torch.get_num_threads(),
+                'faiss': faiss.__version__
+            },
+            'function': benchmark_function(queries, concurrency_levels)
+        }
+        if endpoints:
+            report['endpoints'] = benchmark_endpoints(queries, concurrency_levels, batch_size)
+
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output_path}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark search latency offline with stand-in models.")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--corpus-size", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated numbers of concurrent clients")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default='flat')
+    parser.add_argument("--hidden-size", type=int, default=64, help="Hidden size of the stand-in models")
+    parser.add_argument("--repeat-share", type=float, default=0.2, help="Share of repeated queries")
+    parser.add_argument("--exact-share", type=float, default=0.1, help="Share of queries matching a corpus question")
+    parser.add_argument("--batch-size", type=int, default=32, help="Queries per /api/search/batch request")
+    parser.add_argument("--work-dir", help="Keep the generated models and artifacts in this directory")
+    parser.add_argument("--no-endpoints", action="store_true", help="Only benchmark the search function")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    run_benchmark(args.output,
+                  corpus_size=args.corpus_size,
+                  num_queries=args.queries,
+                  concurrency_levels=[int(c) for c in args.concurrency.split(',')],
+                  index_type=args.index_type,
+                  hidden_size=args.hidden_size,
+                  repeat_share=args.repeat_share,
+                  exact_share=args.exact_share,
+                  batch_size=args.batch_size,
+                  work_dir=args.work_dir,
+                  endpoints=not args.no_endpoints,
+                  seed=args.seed)
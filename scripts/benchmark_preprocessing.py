@@ -0,0 +1,145 @@
+import sys
+import os
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import argparse
+import json
+import time
+import numpy as np
+import pandas as pd
+from src.data_processing import load_df, create_unique_questions_df
+from src.utils import clean_question_text, clean_question_texts
+
+# Mixed case, repeated and unusual whitespace, and characters whose lowercase depends on context
+SYNTHETIC_WORDS = ("What How Why IS the a best WAY to learn Python java ΣΟΦΟΣ İstanbul straße money "
+                   "online job career").split()
+SYNTHETIC_SPACES = (' ', ' ', ' ', '  ', '\t', '\n', ' ', ' ', ' \r\n ')
+
+
+def make_synthetic_pairs(num_pairs, seed=42):
+    """
+    Generate question pairs shaped like load_df output, with repeated qids and texts.
+
+    Args:
+        num_pairs: Number of pairs
+        seed: Random seed
+
+    Returns:
+        DataFrame with id_left, id_right, text_left, text_right and label columns
+    """
+    rng = np.random.default_rng(seed)
+    num_questions = max(2, int(num_pairs * 1.5))
+    texts = []
+    for _ in range(num_questions):
+        words = rng.choice(SYNTHETIC_WORDS, size=rng.integers(3, 15))
+        spaces = rng.choice(SYNTHETIC_SPACES, size=len(words))
+        texts.append(' ' * int(rng.integers(0, 2)) + ''.join(w + s for w, s in zip(words, spaces)) + '?')
+
+    # Questions appear in several pairs, as in QQP, and some differ only in case or spacing
+    left = rng.integers(0, num_questions, size=num_pairs)
+    right = rng.integers(0, num_questions, size=num_pairs)
+    variants = rng.random(num_pairs) < 0.1
+    return pd.DataFrame({
+        'id_left': left.astype(str).astype(object),
+        'id_right': right.astype(str).astype(object),
+        'text_left': [texts[i] for i in left],
+        'text_right': [texts[i].upper() if variant else texts[i] for i, variant in zip(right, variants)],
+        'label': variants.astype(int)
+    }).astype({'text_left': object, 'text_right': object})
+
+
+def legacy_create_unique_questions_df(df):
+    """Previous implementation: per-row cleaning and two drop_duplicates passes over copied frames"""
+    left_questions = df[['id_left', 'text_left']].rename(columns={'id_left': 'qid', 'text_left': 'clean_question'})
+    left_questions['clean_question'] = left_questions['clean_question'].apply(clean_question_text)
+    right_questions = df[['id_right', 'text_right']].rename(columns={'id_right': 'qid', 'text_right': 'clean_question'})
+    right_questions['clean_question'] = right_questions['clean_question'].apply(clean_question_text)
+    combined_df = (pd.concat([left_questions, right_questions], ignore_index=True)
+                   .drop_duplicates(subset=['qid'], keep='first'))
+    all_questions_df = combined_df.drop_duplicates(subset=['clean_question'], keep='first').reset_index(drop=True)
+    return all_questions_df, all_questions_df['clean_question'].tolist()
+
+
+def _best_time(fn, repeats):
+    best, result = float('inf'), None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run_benchmark(pairs_df, repeats=3):
+    """
+    Time question cleaning and deduplication before and after vectorization, and check they agree.
+
+    Args:
+        pairs_df: DataFrame of question pairs
+        repeats: Runs per implementation; the fastest is reported
+
+    Returns:
+        Dictionary with timings and rows per second
+    """
+    raw_texts = pd.concat([pairs_df['text_left'], pairs_df['text_right']], ignore_index=True)
+    num_pairs = len(pairs_df)
+
+    clean_before, expected_texts = _best_time(lambda: raw_texts.apply(clean_question_text).tolist(), repeats)
+    clean_after, cleaned_texts = _best_time(lambda: clean_question_texts(raw_texts), repeats)
+    if cleaned_texts != expected_texts:
+        mismatch = next(i for i, (a, b) in enumerate(zip(cleaned_texts, expected_texts)) if a != b)
+        raise AssertionError(f"Cleaned text differs at row {mismatch}: {cleaned_texts[mismatch]!r} "
+                             f"!= {expected_texts[mismatch]!r}")
+
+    # Silence the progress prints of the pipeline while timing it
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        unique_before, (expected_df, expected_list) = _best_time(
+            lambda: legacy_create_unique_questions_df(pairs_df), repeats)
+        unique_after, (questions_df, questions_list) = _best_time(
+            lambda: create_unique_questions_df(pairs_df), repeats)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    pd.testing.assert_frame_equal(questions_df, expected_df)
+    if questions_list != expected_list:
+        raise AssertionError("Lists of texts to embed differ")
+
+    report = {
+        'pairs': num_pairs,
+        'texts': len(raw_texts),
+        'unique_questions': len(questions_df),
+        'clean_seconds_before': clean_before,
+        'clean_seconds_after': clean_after,
+        'clean_texts_per_second_before': len(raw_texts) / clean_before,
+        'clean_texts_per_second_after': len(raw_texts) / clean_after,
+        'unique_seconds_before': unique_before,
+        'unique_seconds_after': unique_after,
+        'pairs_per_second_before': num_pairs / unique_before,
+        'pairs_per_second_after': num_pairs / unique_after
+    }
+
+    print(f"{num_pairs} pairs, {len(raw_texts)} texts, {len(questions_df)} unique questions (outputs identical)")
+    print(f"Cleaning:                   {report['clean_texts_per_second_before']:>12,.0f} -> "
+          f"{report['clean_texts_per_second_after']:>12,.0f} texts/s "
+          f"({clean_before / clean_after:.1f}x)")
+    print(f"create_unique_questions_df: {report['pairs_per_second_before']:>12,.0f} -> "
+          f"{report['pairs_per_second_after']:>12,.0f} pairs/s "
+          f"({unique_before / unique_after:.1f}x)")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark question cleaning and deduplication.")
+    parser.add_argument("--data", help="QQP-format TSV file to use instead of synthetic pairs")
+    parser.add_argument("--pairs", type=int, default=400000, help="Number of synthetic pairs")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    pairs = load_df(args.data) if args.data else make_synthetic_pairs(args.pairs)
+    results = run_benchmark(pairs, args.repeats)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
@@ -3,37 +3,59 @@ import os
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, project_root)
 
+import argparse
+import json
 import numpy as np
+import pandas as pd
 from src.config import Config
-from src.data_processing import load_df, create_unique_questions_df
-from src.embedding import generate_embeddings
-from src.faiss_index_search import build_faiss_index
+from src.artifacts import write_manifest
+from src.data_processing import load_df, create_unique_questions_df, iter_unique_question_chunks
+from src.embedding import generate_embeddings, generate_embeddings_to_file
+from src.faiss_index_search import build_faiss_index, load_faiss_index, INDEX_TYPES, COMPRESSED_INDEX_TYPES
+from src.quantization import compress_embeddings_file, report_compression, EMBEDDING_DTYPES
+from src.question_store import QuestionStore, QuestionStoreWriter
+from src.sharding import build_sharded_index, shard_path
 import faiss
 
 
 def setup_search_system(dataset_input_path=None,
-                        questions_df_output_path=None,
+                        question_store_output_path=None,
                         emb_model_name_or_path=None,
                         embedding_output_path=None,
                         faiss_index_output_path=None,
-                        sample_size=None):
+                        sample_size=None,
+                        index_type=None,
+                        train_sample_size=None,
+                        embeddings_dtype=None,
+                        num_shards=None,
+                        delta_index_output_path=None):
     """
     Set up the search system by processing data, generating embeddings, and building index.
 
     Args:
         dataset_input_path: Path to the dataset
-        questions_df_output_path: Path to save questions DataFrame
+        question_store_output_path: Directory to save the memory-mappable question store
         emb_model_name_or_path: Name or path of the embedding model
         embedding_output_path: Path to save embeddings
         faiss_index_output_path: Path to save FAISS index
         sample_size: Number of samples to use (for testing)
+        index_type: FAISS index type (one of INDEX_TYPES)
+        train_sample_size: Number of embeddings sampled to train IVF indexes
+        embeddings_dtype: Storage dtype of the saved embeddings (float32, float16, int8)
+        num_shards: Split the index into this many shard files for sharded serving
+        delta_index_output_path: Delta index of incremental adds to the previous build, removed by the build.
+            If None, the configured delta index when building the configured index.
     """
     # Use config values as defaults
     dataset_input_path = dataset_input_path or Config.DATA_PATH
-    questions_df_output_path = questions_df_output_path or Config.QUESTIONS_DF_PATH
+    question_store_output_path = question_store_output_path or Config.QUESTION_STORE_PATH
     emb_model_name_or_path = emb_model_name_or_path or Config.EMBEDDING_MODEL
     embedding_output_path = embedding_output_path or Config.EMBEDDINGS_PATH
     faiss_index_output_path = faiss_index_output_path or Config.FAISS_INDEX_PATH
+    index_type = index_type or Config.INDEX_TYPE
+    train_sample_size = train_sample_size or Config.INDEX_TRAIN_SAMPLE_SIZE
+    embeddings_dtype = embeddings_dtype or Config.EMBEDDINGS_DTYPE
+    num_shards = num_shards or Config.NUM_SHARDS or 1
 
     try:
         # Load dataset
@@ -46,7 +68,8 @@ def setup_search_system(dataset_input_path=None,
             unique_questions = questions_df['clean_question'].tolist()
             print(f"Sampled {sample_size} questions for testing")
 
-        questions_df.to_pickle(questions_df_output_path)
+        QuestionStore.from_dataframe(questions_df).save(question_store_output_path)
+        print(f"Question store saved to {question_store_output_path}")
 
         # Generate and save embeddings
         emb_list = generate_embeddings(unique_questions, emb_model_name_or_path)
@@ -56,13 +79,220 @@ def setup_search_system(dataset_input_path=None,
         print(f"Embeddings saved to {embedding_output_path}")
 
         # Build and save index
-        faiss_index = build_faiss_index(emb_list)
-        faiss.write_index(faiss_index, faiss_index_output_path)
-        print(f"FAISS index saved to : {faiss_index_output_path}")
+        faiss_index = _build_and_save_index(emb_list, index_type, train_sample_size, None,
+                                            faiss_index_output_path, num_shards)
+        _compress_and_report(emb_list, faiss_index, index_type, faiss_index_output_path if num_shards == 1 else None,
+                             embedding_output_path, embeddings_dtype)
+        _remove_stale_delta_index(faiss_index_output_path, delta_index_output_path)
+        write_manifest(faiss_index.ntotal, faiss_index.d, index_type, num_shards)
     except Exception as e:
         print(f"Error in setup_search_system: {e}")
         raise
 
 
+def _build_and_save_index(emb_list, index_type, train_sample_size, chunk_size, faiss_index_output_path, num_shards):
+    if num_shards == 1:
+        faiss_index = build_faiss_index(emb_list, index_type, train_sample_size, chunk_size)
+        faiss.write_index(faiss_index, f"{faiss_index_output_path}.tmp")
+        os.replace(f"{faiss_index_output_path}.tmp", faiss_index_output_path)
+        print(f"FAISS index saved to : {faiss_index_output_path}")
+        return faiss_index
+
+    build_sharded_index(emb_list, num_shards, index_type, train_sample_size, chunk_size, faiss_index_output_path)
+    # Memory-mapped shards searched together in this process, for the manifest and the recall report
+    faiss_index = faiss.IndexShards(emb_list.shape[1], True, True)
+    for shard_id in range(num_shards):
+        faiss_index.add_shard(load_faiss_index(shard_path(faiss_index_output_path, shard_id)))
+    return faiss_index
+
+
+def _compress_and_report(emb_list, faiss_index, index_type, faiss_index_output_path,
+                         embedding_output_path, embeddings_dtype):
+    # emb_list keeps reading the float32 data even after the file is replaced,
+    # so recall of the compressed artifacts is measured against full precision
+    compress_embeddings_file(embedding_output_path, embeddings_dtype)
+    if index_type in COMPRESSED_INDEX_TYPES or embeddings_dtype != 'float32':
+        report_compression(emb_list, faiss_index, faiss_index_output_path, embedding_output_path)
+
+
+def _remove_stale_delta_index(faiss_index_output_path, delta_index_output_path):
+    # Questions added incrementally to the previous build are not part of the new one. Without an
+    # explicit delta path only the configured delta is removed, and only when the build replaces
+    # the configured index it extends.
+    if delta_index_output_path is None:
+        if os.path.abspath(faiss_index_output_path) != os.path.abspath(Config.FAISS_INDEX_PATH):
+            return
+        delta_index_output_path = Config.DELTA_INDEX_PATH
+    if os.path.exists(delta_index_output_path):
+        os.remove(delta_index_output_path)
+        print(f"Removed delta index {delta_index_output_path} of the previous build")
+
+
+def convert_questions_pickle(questions_df_path=None, question_store_output_path=None):
+    """
+    Convert a questions DataFrame pickle of an older build to the question store.
+
+    The server no longer reads pickles; the index of the old build stays valid.
+
+    Args:
+        questions_df_path: Path of the pickled DataFrame. If None, uses default from config.
+        question_store_output_path: Directory to save the question store. If None, uses default from config.
+    """
+    questions_df_path = questions_df_path or Config.QUESTIONS_DF_PATH
+    question_store_output_path = question_store_output_path or Config.QUESTION_STORE_PATH
+
+    question_store = QuestionStore.from_dataframe(pd.read_pickle(questions_df_path))
+    question_store.save(question_store_output_path)
+    print(f"Converted {len(question_store)} questions from {questions_df_path} to {question_store_output_path}")
+
+
+def _read_checkpoint(checkpoint_path, build_settings):
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('settings') != build_settings:
+        print("Build settings changed since the last checkpoint, starting from scratch")
+        return None
+    return checkpoint
+
+
+def _write_checkpoint(checkpoint_path, checkpoint):
+    with open(f"{checkpoint_path}.tmp", 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(f"{checkpoint_path}.tmp", checkpoint_path)
+
+
+def setup_search_system_streaming(dataset_input_path=None,
+                                  question_store_output_path=None,
+                                  emb_model_name_or_path=None,
+                                  embedding_output_path=None,
+                                  faiss_index_output_path=None,
+                                  index_type=None,
+                                  train_sample_size=None,
+                                  chunk_size=None,
+                                  checkpoint_path=None,
+                                  num_workers=None,
+                                  threads_per_worker=None,
+                                  embeddings_dtype=None,
+                                  num_shards=None,
+                                  delta_index_output_path=None):
+    """
+    Set up the search system with bounded memory, resuming an interrupted run.
+
+    The dataset is streamed and deduplicated chunk by chunk into the question store,
+    embeddings are written into a preallocated memory-mapped .npy file, and vectors
+    are added to the index in chunks. Progress is recorded in a checkpoint file after
+    each stage and each embedded chunk, so rerunning after a crash continues from the
+    last completed chunk.
+
+    Args:
+        dataset_input_path: Path to the dataset
+        question_store_output_path: Directory to save the question store
+        emb_model_name_or_path: Name or path of the embedding model
+        embedding_output_path: Path to save embeddings
+        faiss_index_output_path: Path to save FAISS index
+        index_type: FAISS index type (one of INDEX_TYPES)
+        train_sample_size: Number of embeddings sampled to train IVF indexes
+        chunk_size: Number of rows processed per step
+        checkpoint_path: Path of the checkpoint file
+        num_workers: Number of embedding processes
+        threads_per_worker: Torch threads per embedding process
+        embeddings_dtype: Storage dtype of the saved embeddings (float32, float16, int8)
+        num_shards: Split the index into this many shard files for sharded serving
+        delta_index_output_path: Delta index of incremental adds to the previous build, removed by the build.
+            If None, the configured delta index when building the configured index.
+    """
+    # Use config values as defaults
+    dataset_input_path = dataset_input_path or Config.DATA_PATH
+    question_store_output_path = question_store_output_path or Config.QUESTION_STORE_PATH
+    emb_model_name_or_path = emb_model_name_or_path or Config.EMBEDDING_MODEL
+    embedding_output_path = embedding_output_path or Config.EMBEDDINGS_PATH
+    faiss_index_output_path = faiss_index_output_path or Config.FAISS_INDEX_PATH
+    index_type = index_type or Config.INDEX_TYPE
+    train_sample_size = train_sample_size or Config.INDEX_TRAIN_SAMPLE_SIZE
+    num_shards = num_shards or Config.NUM_SHARDS or 1
+    chunk_size = chunk_size or Config.BUILD_CHUNK_SIZE
+    checkpoint_path = checkpoint_path or Config.BUILD_CHECKPOINT_PATH
+    embeddings_dtype = embeddings_dtype or Config.EMBEDDINGS_DTYPE
+
+    # A checkpoint is only reused by a build with the same inputs
+    build_settings = {
+        'dataset': os.path.abspath(dataset_input_path),
+        'model': emb_model_name_or_path,
+        'chunk_size': chunk_size
+    }
+
+    try:
+        checkpoint = _read_checkpoint(checkpoint_path, build_settings) or {'settings': build_settings}
+
+        # Stage 1: stream, clean and deduplicate questions into the question store
+        if not checkpoint.get('questions_done'):
+            writer = QuestionStoreWriter(question_store_output_path)
+            for questions in iter_unique_question_chunks(dataset_input_path, chunk_size):
+                writer.append(questions['qid'].tolist(), questions['clean_question'].tolist())
+                print(f"Collected {writer.num_rows} unique questions")
+            writer.close()
+            checkpoint.update({'questions_done': True, 'num_questions': writer.num_rows, 'embedded_rows': 0})
+            _write_checkpoint(checkpoint_path, checkpoint)
+            print(f"Question store saved to {question_store_output_path}")
+        else:
+            print(f"Resuming: question store with {checkpoint['num_questions']} questions already built")
+
+        question_store = QuestionStore.load(question_store_output_path, mmap=True)
+
+        # Stage 2: embed into a memory-mapped file, checkpointing after every chunk
+        def record_progress(rows_done):
+            checkpoint['embedded_rows'] = rows_done
+            _write_checkpoint(checkpoint_path, checkpoint)
+
+        emb_list = generate_embeddings_to_file(question_store.texts,
+                                               embedding_output_path,
+                                               emb_model_name_or_path,
+                                               start_row=checkpoint['embedded_rows'],
+                                               chunk_size=chunk_size,
+                                               on_chunk_done=record_progress,
+                                               num_workers=num_workers,
+                                               threads_per_worker=threads_per_worker)
+        print(f"Embeddings saved to {embedding_output_path}")
+
+        # Stage 3: train on a sample and add vectors in chunks
+        faiss_index = _build_and_save_index(emb_list, index_type, train_sample_size, chunk_size,
+                                            faiss_index_output_path, num_shards)
+        _remove_stale_delta_index(faiss_index_output_path, delta_index_output_path)
+        write_manifest(faiss_index.ntotal, faiss_index.d, index_type, num_shards)
+        os.remove(checkpoint_path)
+
+        # Compress only once the checkpoint is gone: a resumed build reads the embeddings as float32
+        _compress_and_report(emb_list, faiss_index, index_type, faiss_index_output_path if num_shards == 1 else None,
+                             embedding_output_path, embeddings_dtype)
+    except Exception as e:
+        print(f"Error in setup_search_system_streaming: {e}")
+        raise
+
+
 if __name__ == "__main__":
-    setup_search_system()
+    parser = argparse.ArgumentParser(description="Build the question store, embeddings and FAISS index.")
+    parser.add_argument("--sample-size", type=int,
+                        help="Build in memory from a random sample of questions (for testing)")
+    parser.add_argument("--index-type", choices=INDEX_TYPES)
+    parser.add_argument("--embeddings-dtype", choices=EMBEDDING_DTYPES,
+                        help="Storage dtype of the saved embeddings file")
+    parser.add_argument("--workers", type=int, help="Number of embedding processes (streaming build)")
+    parser.add_argument("--threads-per-worker", type=int, help="Torch threads per embedding process")
+    parser.add_argument("--shards", type=int, help="Split the index into this many shard files")
+    parser.add_argument("--convert-pickle", action="store_true",
+                        help=f"Only convert {Config.QUESTIONS_DF_PATH} of an older build to the question store")
+    args = parser.parse_args()
+
+    if args.convert_pickle:
+        convert_questions_pickle()
+    elif args.sample_size:
+        setup_search_system(sample_size=args.sample_size, index_type=args.index_type,
+                            embeddings_dtype=args.embeddings_dtype, num_shards=args.shards)
+    else:
+        setup_search_system_streaming(index_type=args.index_type,
+                                      embeddings_dtype=args.embeddings_dtype,
+                                      num_shards=args.shards,
+                                      num_workers=args.workers,
+                                      threads_per_worker=args.threads_per_worker)
@@ -0,0 +1,276 @@
+import sys
+import os
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import argparse
+import itertools
+import json
+import time
+import numpy as np
+import faiss
+from src.config import Config
+from src.data_processing import load_df
+from src.embedding import load_embedding_model
+from src.artifacts import load_index
+from src.sharding import ShardedIndex
+from src.reranker import load_reranker
+from src.question_matcher import search_similar_questions_batch
+from src.question_store import QuestionStore
+from src.utils import clean_question_text
+
+# Reranking modes: no cross-encoder, cross-encoder on every candidate, or the adaptive cascade
+RERANK_MODES = ('none', 'full', 'adaptive')
+
+# Thresholds of the adaptive mode when none are configured: (skip gap, distance margin)
+DEFAULT_ADAPTIVE_THRESHOLDS = (0.25, 0.5)
+
+
+def build_ground_truth(pairs_df, question_store, num_queries=None, seed=42):
+    """
+    Turn labelled duplicate pairs into retrieval queries with known relevant questions.
+
+    Every question with at least one duplicate in the question store becomes a
+    query; its relevant results are the question ids of its duplicates.
+
+    Args:
+        pairs_df: DataFrame from load_df with text_left, text_right and label columns
+        question_store: QuestionStore the index was built from
+        num_queries: Maximum number of queries, sampled at random. If None, uses all.
+        seed: Random seed for the sample
+
+    Returns:
+        List of (query text, query row in the store, set of relevant question ids) tuples
+    """
+    positives = pairs_df[pairs_df['label'] == 1]
+    duplicates = {}
+    for text_left, text_right in zip(positives['text_left'], positives['text_right']):
+        row_left = question_store.find_exact(clean_question_text(text_left))
+        row_right = question_store.find_exact(clean_question_text(text_right))
+        # Both questions must be in the corpus, and pairs that clean to the same text are not retrievable
+        if row_left is None or row_right is None or row_left == row_right:
+            continue
+        duplicates.setdefault(row_left, set()).add(row_right)
+        duplicates.setdefault(row_right, set()).add(row_left)
+
+    query_rows = sorted(duplicates)
+    if num_queries and len(query_rows) > num_queries:
+        rng = np.random.default_rng(seed)
+        query_rows = sorted(rng.choice(query_rows, size=num_queries, replace=False).tolist())
+
+    return [(question_store.texts[row], row, set(question_store.qids.take(sorted(duplicates[row]))))
+            for row in query_rows]
+
+
+def ranking_metrics(ranked_qids, relevant_qids, k):
+    """
+    Compute recall@k and reciprocal rank for one query.
+
+    Args:
+        ranked_qids: Returned question ids in rank order
+        relevant_qids: Set of relevant question ids
+        k: Cut-off
+
+    Returns:
+        Tuple of (recall@k, reciprocal rank of the first relevant result within k, or 0)
+    """
+    top = ranked_qids[:k]
+    recall = len(relevant_qids.intersection(top)) / len(relevant_qids)
+    reciprocal_rank = next((1 / (rank + 1) for rank, qid in enumerate(top) if qid in relevant_qids), 0.0)
+    return recall, reciprocal_rank
+
+
+def index_parameter_name(index):
+    """Name of the search-time parameter of the main index: 'nprobe', 'ef_search' or None"""
+    if isinstance(index.main, ShardedIndex):
+        return {'ivf': 'nprobe', 'hnsw': 'ef_search'}.get(index.main.kind)
+    if faiss.try_extract_index_ivf(index.main) is not None:
+        return 'nprobe'
+    if isinstance(index.main, faiss.IndexHNSW):
+        return 'ef_search'
+    return None
+
+
+def evaluate_configuration(queries, components, k_candidates, k_finals, rerank_mode, index_parameter,
+                           adaptive_thresholds=DEFAULT_ADAPTIVE_THRESHOLDS):
+    """
+    Run every query through the pipeline with one configuration.
+
+    The pipeline runs once with the largest k_final; smaller k_final values are
+    prefixes of the same ranking. The query's own row is dropped from its FAISS
+    candidates before reranking, so each query still gets k_candidates others
+    and its own rank-1 hit does not sway the adaptive thresholds.
+
+    Args:
+        queries: List of (query text, query row, relevant question ids) tuples
+        components: Tuple of (embedding model, index, question store, reranker)
+        k_candidates: Number of FAISS candidates
+        k_finals: List of result counts to score
+        rerank_mode: One of RERANK_MODES
+        index_parameter: Tuple of (parameter name, value) for the index, or (None, None)
+        adaptive_thresholds: Tuple of (skip gap, distance margin) used by the adaptive mode
+
+    Returns:
+        List of result dictionaries, one per k_final
+    """
+    emb_model, index, question_store, reranker = components
+    search_options = {}
+    if index_parameter[0]:
+        search_options[index_parameter[0]] = index_parameter[1]
+
+    thresholds = adaptive_thresholds if rerank_mode == 'adaptive' else (None, None)
+
+    def search(query_text, query_row):
+        return search_similar_questions_batch(
+            [query_text], emb_model, index, question_store, reranker,
+            k_candidates=k_candidates, k_final=max(k_finals), exact_match=False,
+            rerank=rerank_mode != 'none', rerank_thresholds=thresholds, exclude_rows=[query_row],
+            return_rerank_info=True, **search_options)[0]
+
+    search(*queries[0][:2])  # warm up
+
+    latencies, rankings, reranked = [], [], []
+    for query_text, query_row, _ in queries:
+        start = time.perf_counter()
+        results, plan = search(query_text, query_row)
+        latencies.append((time.perf_counter() - start) * 1000)
+        rankings.append([result['question_id'] for result in results])
+        reranked.append(plan['reranked'])
+
+    rows = []
+    for k_final in k_finals:
+        metrics = [ranking_metrics(ranking, relevant, k_final)
+                   for ranking, (_, _, relevant) in zip(rankings, queries)]
+        rows.append({
+            'index_parameter': index_parameter[0],
+            'index_parameter_value': index_parameter[1],
+            'k_candidates': k_candidates,
+            'k_final': k_final,
+            'rerank': rerank_mode,
+            'rerank_thresholds': list(thresholds) if rerank_mode == 'adaptive' else None,
+            'recall_at_k': float(np.mean([recall for recall, _ in metrics])),
+            'mrr': float(np.mean([reciprocal_rank for _, reciprocal_rank in metrics])),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'mean_ms': float(np.mean(latencies)),
+            'mean_reranked': float(np.mean(reranked))
+        })
+    return rows
+
+
+def run_sweep(k_candidates_values, k_final_values, index_parameter_values, rerank_modes,
+              num_queries=500, dataset_path=None, output_path=None, min_recall=None, seed=42,
+              adaptive_thresholds=None):
+    """
+    Measure recall@k, MRR and latency for every combination of search settings.
+
+    Args:
+        k_candidates_values: List of FAISS candidate counts
+        k_final_values: List of result counts
+        index_parameter_values: List of nprobe (IVF) or ef_search (HNSW) values; ignored for flat indexes
+        rerank_modes: List of RERANK_MODES to compare
+        num_queries: Number of evaluation queries
+        dataset_path: Labelled question pairs. If None, uses default from config.
+        output_path: Path of the JSON results file, or None
+        min_recall: Optional recall@k quality bar used to pick the cheapest configuration
+        seed: Random seed for the query sample
+        adaptive_thresholds: Tuple of (skip gap, distance margin) of the adaptive mode. Missing values
+            use the configured thresholds, or DEFAULT_ADAPTIVE_THRESHOLDS where those are not set.
+
+    Returns:
+        List of result dictionaries, one per configuration and k_final
+    """
+    configured = (Config.RERANK_SKIP_GAP, Config.RERANK_DISTANCE_MARGIN)
+    adaptive_thresholds = tuple(
+        next(value for value in candidates if value is not None)
+        for candidates in zip(adaptive_thresholds or (None, None), configured, DEFAULT_ADAPTIVE_THRESHOLDS))
+    question_store = QuestionStore.load()
+    index = load_index()
+    emb_model = load_embedding_model()
+    reranker = load_reranker() if set(rerank_modes) - {'none'} else None
+    components = (emb_model, index, question_store, reranker)
+
+    queries = build_ground_truth(load_df(dataset_path), question_store, num_queries, seed)
+    if not queries:
+        raise ValueError("No duplicate pairs with both questions in the question store")
+    print(f"Evaluating {len(queries)} queries with labelled duplicates in the corpus")
+
+    parameter_name = index_parameter_name(index)
+    index_parameters = [(parameter_name, value) for value in index_parameter_values] if parameter_name \
+        else [(None, None)]
+
+    rows = []
+    for index_parameter, k_candidates, rerank_mode in itertools.product(index_parameters, k_candidates_values,
+                                                                          rerank_modes):
+        print(f"Running {index_parameter[0] or 'flat'}={index_parameter[1]}, "
+              f"k_candidates={k_candidates}, rerank={rerank_mode}...")
+        rows.extend(evaluate_configuration(queries, components, k_candidates, k_final_values,
+                                           rerank_mode, index_parameter, adaptive_thresholds))
+
+    print_table(rows)
+
+    best = None
+    if min_recall is not None:
+        passing = [row for row in rows if row['recall_at_k'] >= min_recall]
+        best = min(passing, key=lambda row: row['p50_ms']) if passing else None
+        if best:
+            print(f"\nCheapest configuration with recall@k >= {min_recall}: "
+                  f"{_describe(best)} (p50 {best['p50_ms']:.1f} ms)")
+        else:
+            print(f"\nNo configuration reaches recall@k >= {min_recall}")
+
+    if output_path:
+        with open(output_path, 'w') as f:
+            json.dump({'num_queries': len(queries), 'index_type': type(index.main).__name__,
+                       'min_recall': min_recall, 'best': best, 'results': rows}, f, indent=2)
+        print(f"Results written to {output_path}")
+    return rows
+
+
+def _describe(row):
+    parameter = f"{row['index_parameter']}={row['index_parameter_value']}, " if row['index_parameter'] else ''
+    return f"{parameter}k_candidates={row['k_candidates']}, k_final={row['k_final']}, rerank={row['rerank']}"
+
+
+def print_table(rows):
+    """Print results as a fixed-width table"""
+    header = f"{'index param':<14}{'k_cand':>7}{'rerank':>10}{'k':>5}{'recall@k':>10}{'MRR':>8}" \
+             f"{'p50 ms':>9}{'p95 ms':>9}{'reranked':>10}"
+    print('\n' + header)
+    print('-' * len(header))
+    for row in rows:
+        parameter = f"{row['index_parameter']}={row['index_parameter_value']}" if row['index_parameter'] else '-'
+        print(f"{parameter:<14}{row['k_candidates']:>7}{row['rerank']:>10}{row['k_final']:>5}"
+              f"{row['recall_at_k']:>10.4f}{row['mrr']:>8.4f}{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}"
+              f"{row['mean_reranked']:>10.1f}")
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',')]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep search settings against QQP duplicate labels.")
+    parser.add_argument("--k-candidates", type=_int_list, default=[10, 25, 50, 100])
+    parser.add_argument("--k-final", type=_int_list, default=[1, 5, 10])
+    parser.add_argument("--index-params", type=_int_list, default=[4, 16, 64],
+                        help="nprobe values for IVF indexes or ef_search values for HNSW indexes")
+    parser.add_argument("--rerank", default=','.join(RERANK_MODES),
+                        help=f"Comma-separated reranking modes from: {', '.join(RERANK_MODES)}")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--min-recall", type=float, help="Report the cheapest configuration above this recall@k")
+    parser.add_argument("--skip-gap", type=float,
+                        help="Skip gap of the adaptive mode (default: RERANK_SKIP_GAP, or 0.25 if not set)")
+    parser.add_argument("--distance-margin", type=float,
+                        help="Distance margin of the adaptive mode (default: RERANK_DISTANCE_MARGIN, or 0.5 if not set)")
+    parser.add_argument("--output", default="retrieval_sweep.json")
+    args = parser.parse_args()
+
+    modes = args.rerank.split(',')
+    unknown = set(modes) - set(RERANK_MODES)
+    if unknown:
+        parser.error(f"Unknown reranking modes: {', '.join(sorted(unknown))}")
+
+    run_sweep(args.k_candidates, args.k_final, args.index_params, modes,
+              num_queries=args.queries, output_path=args.output, min_recall=args.min_recall,
+              adaptive_thresholds=(args.skip_gap, args.distance_margin))
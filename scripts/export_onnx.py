@@ -0,0 +1,174 @@
+import sys
+import os
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import argparse
+import time
+import numpy as np
+from sentence_transformers import SentenceTransformer, CrossEncoder
+from src.config import Config
+from src.embedding import load_embedding_model, embed_single_question
+from src.reranker import load_reranker
+from src.question_store import QuestionStore
+
+SAMPLE_QUESTIONS = [
+    "how do i learn python?",
+    "what is machine learning?",
+    "how can i make money online?",
+    "what is the best way to learn a new language?",
+    "why is the sky blue?",
+    "how do i lose weight fast?",
+    "what are the benefits of meditation?",
+    "how does the stock market work?",
+]
+
+
+def export_onnx_model(model_cls, source, output_dir, quantization=None):
+    """
+    Export a sentence-transformers model to ONNX, optionally with int8 dynamic quantization.
+
+    Args:
+        model_cls: SentenceTransformer or CrossEncoder
+        source: Name or path of the PyTorch model
+        output_dir: Directory to save the exported model
+        quantization: Quantization config ('arm64', 'avx2', 'avx512', 'avx512_vnni'), or None
+
+    Returns:
+        Path of the ONNX file relative to output_dir, to use as Config.EMBEDDING_ONNX_FILE_NAME
+        or Config.RERANKER_ONNX_FILE_NAME
+    """
+    from sentence_transformers.backend import export_dynamic_quantized_onnx_model
+
+    print(f"Exporting {source} to {output_dir}...")
+    model_cls(source, backend='onnx').save(output_dir)
+    if not quantization:
+        return os.path.join('onnx', 'model.onnx')
+
+    print(f"Quantizing with '{quantization}' config...")
+    # Quantize from the saved export, so the quantized file lands next to model.onnx
+    export_dynamic_quantized_onnx_model(model_cls(output_dir, backend='onnx'), quantization, output_dir)
+    onnx_dir = os.path.join(output_dir, 'onnx')
+    quantized = [name for name in os.listdir(onnx_dir) if name.endswith(f"int8_{quantization}.onnx")]
+    if not quantized:
+        raise FileNotFoundError(f"No '{quantization}' quantized model was written to {onnx_dir}")
+    return os.path.join('onnx', quantized[0])
+
+
+def _load_pair(loader, torch_source, onnx_dir, file_name):
+    return loader(torch_source, backend='torch'), loader(onnx_dir, backend='onnx', onnx_file_name=file_name)
+
+
+def check_embedding_parity(torch_model, onnx_model, texts, tolerance):
+    """
+    Compare embeddings of the two backends.
+
+    Returns:
+        Tuple of (passed, minimum cosine similarity between matching embeddings)
+    """
+    torch_emb = torch_model.encode(texts, normalize_embeddings=True)
+    onnx_emb = onnx_model.encode(texts, normalize_embeddings=True)
+    min_cosine = float(np.min(np.sum(torch_emb * onnx_emb, axis=1)))
+    return min_cosine >= 1 - tolerance, min_cosine
+
+
+def check_rerank_parity(torch_model, onnx_model, queries, candidates, min_top_overlap):
+    """
+    Compare reranking orderings of the two backends.
+
+    Returns:
+        Tuple of (passed, share of queries with the same top result, mean top-10 overlap)
+    """
+    same_top, overlaps = [], []
+    for query in queries:
+        pairs = [(query, candidate) for candidate in candidates]
+        torch_order = np.argsort(-torch_model.predict(pairs))
+        onnx_order = np.argsort(-onnx_model.predict(pairs))
+        same_top.append(torch_order[0] == onnx_order[0])
+        overlaps.append(len(set(torch_order[:10]) & set(onnx_order[:10])) / min(10, len(candidates)))
+    mean_overlap = float(np.mean(overlaps))
+    return mean_overlap >= min_top_overlap, float(np.mean(same_top)), mean_overlap
+
+
+def measure_latency(fn, repeats):
+    """Return the median latency of fn in milliseconds"""
+    fn()  # warm up
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def compare_backends(emb_source, reranker_source, emb_onnx_dir, reranker_onnx_dir, emb_file_name,
+                     reranker_file_name, tolerance=0.01, min_top_overlap=0.9, repeats=20):
+    """
+    Check that the ONNX models match the PyTorch models and compare their latency.
+
+    Args:
+        emb_source: Name or path of the PyTorch embedding model
+        reranker_source: Name or path of the PyTorch reranker
+        emb_onnx_dir: Directory of the exported embedding model
+        reranker_onnx_dir: Directory of the exported reranker
+        emb_file_name: ONNX file inside the embedding export directory
+        reranker_file_name: ONNX file inside the reranker export directory
+        tolerance: Maximum allowed 1 - cosine similarity between embeddings
+        min_top_overlap: Minimum mean overlap of the top 10 reranked candidates
+        repeats: Number of timed calls per measurement
+
+    Returns:
+        True if both parity checks pass
+    """
+    if QuestionStore.exists():
+        store = QuestionStore.load()
+        rng = np.random.default_rng(42)
+        texts = store.texts.take(rng.choice(len(store), size=min(200, len(store)), replace=False))
+    else:
+        texts = SAMPLE_QUESTIONS * 25
+    queries, candidates = texts[:10], texts[:Config.DEFAULT_CANDIDATES]
+
+    torch_emb, onnx_emb = _load_pair(load_embedding_model, emb_source, emb_onnx_dir, emb_file_name)
+    emb_ok, min_cosine = check_embedding_parity(torch_emb, onnx_emb, texts, tolerance)
+    print(f"Embedding parity: {'PASS' if emb_ok else 'FAIL'} (min cosine similarity {min_cosine:.5f})")
+
+    torch_rr, onnx_rr = _load_pair(load_reranker, reranker_source, reranker_onnx_dir,
+                                  reranker_file_name)
+    rr_ok, same_top, overlap = check_rerank_parity(torch_rr, onnx_rr, queries, candidates, min_top_overlap)
+    print(f"Rerank parity: {'PASS' if rr_ok else 'FAIL'} "
+          f"(same top result {same_top:.0%}, mean top-10 overlap {overlap:.0%})")
+
+    pairs = [(queries[0], candidate) for candidate in candidates]
+    print(f"\n{'stage':<28}{'torch ms':>10}{'onnx ms':>10}{'speedup':>10}")
+    for stage, torch_fn, onnx_fn in [
+        ("embed_single_question", lambda: embed_single_question(torch_emb, queries[0]),
+         lambda: embed_single_question(onnx_emb, queries[0])),
+        (f"rerank {len(pairs)} pairs", lambda: torch_rr.predict(pairs), lambda: onnx_rr.predict(pairs)),
+    ]:
+        torch_ms, onnx_ms = measure_latency(torch_fn, repeats), measure_latency(onnx_fn, repeats)
+        print(f"{stage:<28}{torch_ms:>10.2f}{onnx_ms:>10.2f}{torch_ms / onnx_ms:>9.2f}x")
+
+    return emb_ok and rr_ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the embedder and reranker to ONNX and check parity.")
+    parser.add_argument("--embedding-model", default=Config.EMBEDDING_MODEL)
+    parser.add_argument("--reranker-model", default=Config.RERANKER_MODEL)
+    parser.add_argument("--embedding-output", default=Config.EMBEDDING_ONNX_PATH)
+    parser.add_argument("--reranker-output", default=Config.RERANKER_ONNX_PATH)
+    parser.add_argument("--quantize", choices=['arm64', 'avx2', 'avx512', 'avx512_vnni'],
+                        help="Also export an int8 dynamically quantized model")
+    parser.add_argument("--tolerance", type=float, default=0.01,
+                        help="Maximum allowed 1 - cosine similarity between backends")
+    args = parser.parse_args()
+
+    emb_file_name = export_onnx_model(SentenceTransformer, args.embedding_model, args.embedding_output,
+                                      args.quantize)
+    reranker_file_name = export_onnx_model(CrossEncoder, args.reranker_model, args.reranker_output, args.quantize)
+    print(f"\nSet Config.INFERENCE_BACKEND = 'onnx', Config.EMBEDDING_ONNX_FILE_NAME = '{emb_file_name}' and "
+          f"Config.RERANKER_ONNX_FILE_NAME = '{reranker_file_name}' to serve these models\n")
+
+    passed = compare_backends(args.embedding_model, args.reranker_model, args.embedding_output,
+                              args.reranker_output, emb_file_name, reranker_file_name, args.tolerance)
+    sys.exit(0 if passed else 1)
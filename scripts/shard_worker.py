@@ -0,0 +1,22 @@
+import sys
+import os
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import argparse
+from src.config import Config
+from src.sharding import serve_shard, shard_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve one index shard to the search router over TCP.")
+    parser.add_argument("--shard", type=int, required=True, help="Shard number, from 0")
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--host", default="0.0.0.0", help="Interface to listen on")
+    parser.add_argument("--index-path", help=f"Unsharded index path the shard files are named after "
+                                             f"(default: {Config.FAISS_INDEX_PATH})")
+    parser.add_argument("--threads", type=int, help="FAISS threads for this worker")
+    parser.add_argument("--parent-pid", type=int, help="Exit when this process is gone (set for local workers)")
+    args = parser.parse_args()
+
+    serve_shard(shard_path(args.index_path, args.shard), args.host, args.port, args.threads, args.parent_pid)
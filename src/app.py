@@ -1,11 +1,26 @@
-from flask import Flask, request, jsonify, render_template
-import pandas as pd
+from flask import Flask, Response, g, request, jsonify, render_template, stream_with_context
+import json
 import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
 from .config import Config
-from .embedding import load_embedding_model
-from .faiss_index_search import load_faiss_index
-from .reranker import load_reranker
-from .question_matcher import search_similar_questions
+from .embedding import load_embedding_model, create_embedding_cache
+from .reranker import load_reranker, RerankCostModel, create_rerank_cache
+from .question_matcher import search_similar_questions_batch, iter_similar_questions_batches
+from .batching import SearchBatcher
+from .artifacts import (ArtifactWatcher, artifact_version_stamp, assemble_artifact_set, load_artifact_set,
+                        load_index, load_question_store, read_artifact_version)
+from .index_updates import add_questions, compact_index
+from .sharding import ShardedIndex
+from .metrics import MetricsRegistry, timed
+from .utils import search_options_error
+from .response_cache import create_response_cache, search_response_key
+
+# Components loaded at startup, each reported separately by /api/health
+COMPONENTS = ('embedding_model', 'reranker', 'question_store', 'faiss_index')
 
 
 def create_app(config_object=Config):
@@ -15,14 +30,147 @@ def create_app(config_object=Config):
     app = Flask(__name__, template_folder=template_dir)
     app.config.from_object(config_object)
 
-    # Store models in app instance (avoiding globals)
+    # Store models in app instance (avoiding globals). The index and question store
+    # live together in app.artifacts so they are always replaced in one step
     app.embedding_model = None
-    app.faiss_index = None
-    app.questions_df = None
     app.reranker = None
-
-    # Load models immediately
-    load_models(app)
+    app.artifacts = None
+    app.load_timings = {}
+    app.components = {name: {'ready': False, 'error': None} for name in COMPONENTS}
+
+    # Popular queries skip the encoder; bulk jobs bypass the cache so they do not evict hot entries
+    app.embedding_cache = create_embedding_cache(app.config.get('EMBEDDING_CACHE_MAX_BYTES'),
+                                                 app.config.get('EMBEDDING_CACHE_TTL_SECONDS'))
+
+    # Repeated (query, candidate) pairs skip the cross-encoder until the reranker or corpus changes;
+    # load_models sets the version once the artifacts are loaded
+    app.rerank_cache = create_rerank_cache(app.config.get('RERANK_CACHE_MAX_BYTES'),
+                                           app.config.get('RERANK_CACHE_TTL_SECONDS'),
+                                           artifact_version(app))
+
+    # Whole /api/search responses, shared with the other worker processes on this host. Keys carry
+    # artifact_version(app), so a reload or index update stops serving responses of the old corpus
+    app.response_cache = create_response_cache(app.config.get('RESPONSE_CACHE_PATH'),
+                                               app.config.get('RESPONSE_CACHE_MAX_BYTES'),
+                                               app.config.get('RESPONSE_CACHE_TTL_SECONDS'))
+
+    # Serializes index updates and artifact reloads; searches keep reading the previous objects until the swap
+    app.admin_lock = threading.Lock()
+
+    # Load models in the background so liveness checks pass while a cold pod starts,
+    # or before returning (required when gunicorn preloads the app before forking)
+    if app.config.get('BACKGROUND_LOADING'):
+        threading.Thread(target=load_models, args=(app,), name='model-loader', daemon=True).start()
+    else:
+        load_models(app)
+
+    # Measured reranker cost per pair turns latency budgets into candidate counts
+    app.rerank_cost_model = RerankCostModel()
+    app.rerank_paths = Counter()
+    app.exact_matches = 0
+    rerank_paths_lock = threading.Lock()
+
+    # Prometheus metrics, exposed at /metrics
+    app.metrics = MetricsRegistry()
+    request_latency = app.metrics.histogram('http_request_duration_seconds', 'Request latency by endpoint',
+                                            ('endpoint',))
+    request_count = app.metrics.counter('http_requests_total', 'Requests by endpoint and status code',
+                                        ('endpoint', 'status'))
+    stage_latency = app.metrics.histogram('search_stage_duration_seconds',
+                                          'Time spent per search stage, per pipeline batch', ('stage',))
+    search_batch_size = app.metrics.histogram('search_batch_queries', 'Queries per pipeline batch',
+                                              buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+    searches = app.metrics.counter('searches_total', 'Searched queries by reranking path', ('path',))
+    exact_match_count = app.metrics.counter('exact_matches_total', 'Queries answered by the exact-match index')
+    candidates_reranked = app.metrics.counter('candidates_reranked_total', 'Candidates scored by the reranker')
+    app.metrics.callback('cache_lookups_total', 'Cache lookups by cache and result', 'counter',
+                         lambda: _cache_lookups(app), ('cache', 'result'))
+    app.metrics.callback('model_load_seconds', 'Time taken to load each component at startup', 'gauge',
+                         lambda: {(component,): seconds for component, seconds in app.load_timings.items()},
+                         ('component',))
+
+    # Poll the build manifest and hot-swap new artifacts, from the process that serves requests
+    app.artifact_watcher = None
+    if app.config.get('ARTIFACT_WATCH_INTERVAL_SECONDS'):
+        app.artifact_watcher = ArtifactWatcher(lambda: app.artifacts.version if app.artifacts else None,
+                                               lambda: reload_artifacts(app),
+                                               app.config['ARTIFACT_WATCH_INTERVAL_SECONDS'])
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+        if app.artifact_watcher is not None:
+            app.artifact_watcher.ensure_started()
+
+    @app.after_request
+    def record_request(response):
+        # Streamed responses are measured up to the first byte
+        endpoint = request.endpoint or 'unmatched'
+        request_latency.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+        request_count.inc(endpoint=endpoint, status=response.status_code)
+        return response
+
+    # Tokenizers of the models cannot be used from several threads at once; searches
+    # from the batcher, unbatched requests and bulk chunks take turns on the models
+    app.inference_lock = threading.Lock()
+
+    def search_batch(query_texts, **options):
+        timings = {}
+        # One reference for the whole batch: a reload swaps app.artifacts, never this set
+        artifacts = app.artifacts
+        with artifacts.use(), app.inference_lock:
+            outputs = search_similar_questions_batch(
+                query_texts,
+                app.embedding_model,
+                artifacts.index,
+                artifacts.question_store,
+                app.reranker,
+                embedding_cache=app.embedding_cache,
+                rerank_cost_model=app.rerank_cost_model,
+                rerank_cache=app.rerank_cache,
+                return_rerank_info=True,
+                timings=timings,
+                **options
+            )
+        for stage, seconds in timings.items():
+            stage_latency.observe(seconds, stage=stage)
+        search_batch_size.observe(len(query_texts))
+        return outputs
+
+    # Concurrent requests share one encode, index search and rerank call
+    app.search_batcher = None
+    if app.config.get('SEARCH_BATCHING_ENABLED'):
+        app.search_batcher = SearchBatcher(search_batch,
+                                           max_batch_size=app.config.get('SEARCH_BATCH_MAX_SIZE'),
+                                           max_wait_ms=app.config.get('SEARCH_BATCH_MAX_WAIT_MS'))
+
+    def run_search(query, **options):
+        """Run one search; returns (results, reranking plan, whether the response came from the shared cache)"""
+        cache_key = None
+        if app.response_cache is not None:
+            cache_key = search_response_key(query, artifact_version(app), **options)
+            cached = app.response_cache.get(cache_key)
+            if cached is not None:
+                with rerank_paths_lock:
+                    app.rerank_paths['cached'] += 1
+                searches.inc(path='cached')
+                return cached['results'], cached['rerank'], True
+
+        if app.search_batcher is not None:
+            results, plan = app.search_batcher.submit(query, **options)
+        else:
+            results, plan = search_batch([query], **options)[0]
+        with rerank_paths_lock:
+            app.rerank_paths[plan['path']] += 1
+            app.exact_matches += plan['exact_match']
+        searches.inc(path=plan['path'])
+        candidates_reranked.inc(plan['reranked'])
+        if plan['exact_match']:
+            exact_match_count.inc()
+        # Responses cut short by a latency budget are not stored, so a cached response is always complete
+        if cache_key is not None and plan['path'] != 'budget':
+            app.response_cache.put(cache_key, {'results': results, 'rerank': plan})
+        return results, plan, False
 
     @app.route('/')
     def index():
@@ -39,21 +187,88 @@ def create_app(config_object=Config):
                 return jsonify({'error': 'No query provided'}), 400
 
             query = data['query']
+            if not isinstance(query, str):
+                return jsonify({'error': 'Query must be a string'}), 400
+
+            options_error = search_options_error(data)
+            if options_error:
+                return jsonify({'error': options_error}), 400
 
             # Check if models are loaded
-            if not all([app.embedding_model, app.faiss_index, app.questions_df, app.reranker]):
+            if not models_loaded(app):
                 return jsonify({'error': 'Models not loaded. Please try again later.'}), 503
 
             # Find similar questions
-            results = search_similar_questions(
-                query,
-                app.embedding_model,
-                app.faiss_index,
-                app.questions_df,
-                app.reranker
-            )
+            results, plan, cached = run_search(query, k_candidates=data.get('k_candidates'),
+                                               k_final=data.get('k_final'), nprobe=data.get('nprobe'),
+                                               ef_search=data.get('ef_search'),
+                                               latency_budget_ms=data.get('latency_budget_ms'),
+                                               fill_exact=data.get('fill_exact'))
+
+            return jsonify({'results': results, 'rerank': plan, 'cached': cached})
+
+        except TimeoutError as e:
+            print(f"API error: {str(e)}")
+            return jsonify({'error': str(e)}), 504
+
+        except Exception as e:
+            print(f"API error: {str(e)}")
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/api/search/batch', methods=['POST'])
+    def api_search_batch():
+        """API endpoint for searching similar questions for many queries at once"""
+        try:
+            data = request.get_json()
+            if not data or not isinstance(data.get('queries'), list):
+                return jsonify({'error': 'No queries provided'}), 400
+
+            queries = data['queries']
+            if not all(isinstance(query, str) for query in queries):
+                return jsonify({'error': 'Queries must be strings'}), 400
 
-            return jsonify({'results': results})
+            options_error = search_options_error(data)
+            if options_error:
+                return jsonify({'error': options_error}), 400
+
+            if len(queries) > app.config['BULK_MAX_QUERIES']:
+                return jsonify({'error': f"At most {app.config['BULK_MAX_QUERIES']} queries per request"}), 413
+
+            if not models_loaded(app):
+                return jsonify({'error': 'Models not loaded. Please try again later.'}), 503
+
+            artifacts = app.artifacts
+            batches = _using(artifacts, _locked_iter(iter_similar_questions_batches(
+                queries,
+                app.embedding_model,
+                artifacts.index,
+                artifacts.question_store,
+                app.reranker,
+                k_candidates=data.get('k_candidates'),
+                k_final=data.get('k_final'),
+                nprobe=data.get('nprobe'),
+                ef_search=data.get('ef_search'),
+                chunk_size=app.config['BULK_LOCKED_CHUNK_SIZE']
+            ), app.inference_lock))
+
+            stream = data.get('stream', len(queries) > app.config['BULK_STREAM_THRESHOLD'])
+            if not stream:
+                results = [query_results for _, chunk in batches for query_results in chunk]
+                return jsonify({'results': results})
+
+            def generate_ndjson():
+                # One line per query, flushed after each chunk has been reranked
+                for offset, chunk in batches:
+                    lines = []
+                    for i, query_results in enumerate(chunk):
+                        lines.append(json.dumps({
+                            'index': offset + i,
+                            'query': queries[offset + i],
+                            'results': query_results
+                        }))
+                    yield '\n'.join(lines) + '\n'
+
+            return Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
 
         except Exception as e:
             print(f"API error: {str(e)}")
@@ -70,21 +285,14 @@ def create_app(config_object=Config):
         if query:
             try:
                 # Check if models are loaded
-                if (app.embedding_model is None or app.faiss_index is None or app.questions_df is None
-                        or app.reranker is None):
+                if not models_loaded(app):
                     print("Models not fully loaded")  # Debug print
                     return render_template('error.html',
                                            error="Search system is initializing. Please try again later.")
 
                 # Find similar questions
                 print("Searching for similar questions...")  # Debug print
-                results = search_similar_questions(
-                    query,
-                    app.embedding_model,
-                    app.faiss_index,
-                    app.questions_df,
-                    app.reranker
-                )
+                results, _, _ = run_search(query)
                 print(f"Found {len(results)} results")
                 # Add more debugging
                 print(f"First result: {results[0] if results else 'No results'}")
@@ -99,54 +307,284 @@ def create_app(config_object=Config):
     @app.route('/api/health')
     def health_check():
         """Health check endpoint for monitoring"""
-        models_loaded = all([
-            app.embedding_model,
-            app.faiss_index,
-            app.questions_df,
-            app.reranker
-        ])
+        return jsonify({
+            "status": "ready" if models_loaded(app) else "initializing",
+            "live": True,
+            "version": Config.VERSION,
+            "components": component_status(app),
+            "artifacts": app.artifacts.describe() if app.artifacts is not None else None
+        })
 
+    @app.route('/api/health/live')
+    def liveness_check():
+        """Liveness probe: the process serves requests, even while models are loading"""
+        return jsonify({"status": "alive"})
+
+    @app.route('/api/health/ready')
+    def readiness_check():
+        """Readiness probe: 503 until every component is loaded"""
+        ready = models_loaded(app)
         return jsonify({
-            "status": "ready" if models_loaded else "initializing",
-            "version": Config.VERSION
+            "status": "ready" if ready else "initializing",
+            "components": component_status(app)
+        }), 200 if ready else 503
+
+    def require_admin(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            token = app.config.get('ADMIN_TOKEN')
+            if not token:
+                return jsonify({'error': 'Admin endpoints are disabled. Set ADMIN_TOKEN to enable them.'}), 403
+            if request.headers.get('X-Admin-Token') != token:
+                return jsonify({'error': 'Invalid admin token'}), 401
+            return view(*args, **kwargs)
+        return wrapper
+
+    @app.route('/api/admin/questions', methods=['POST'])
+    @require_admin
+    def admin_add_questions():
+        """Add new questions to the live index without a rebuild"""
+        try:
+            data = request.get_json()
+            questions = data.get('questions') if data else None
+            if not isinstance(questions, list) or not all(isinstance(q, dict) and 'qid' in q and 'question' in q
+                                                          for q in questions):
+                return jsonify({'error': 'Expected questions as a list of {"qid", "question"} objects'}), 400
+
+            if not models_loaded(app):
+                return jsonify({'error': 'Models not loaded. Please try again later.'}), 503
+
+            with app.admin_lock, app.inference_lock:
+                app.artifacts, added = add_questions([(q['qid'], q['question']) for q in questions],
+                                                     app.embedding_model, app.artifacts)
+                if app.rerank_cache is not None:
+                    app.rerank_cache.set_version(artifact_version(app))
+
+            return jsonify({'added': added, 'skipped': len(questions) - added, 'total': app.artifacts.index.ntotal})
+
+        except Exception as e:
+            print(f"Admin error: {str(e)}")
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/api/admin/compact', methods=['POST'])
+    @require_admin
+    def admin_compact():
+        """Merge the delta index into the main index"""
+        try:
+            if not models_loaded(app):
+                return jsonify({'error': 'Models not loaded. Please try again later.'}), 503
+
+            with app.admin_lock:
+                previous_main = app.artifacts.index.main.ntotal
+                app.artifacts = compact_index(app.artifacts)
+                if app.rerank_cache is not None:
+                    app.rerank_cache.set_version(artifact_version(app))
+
+            return jsonify({'merged': app.artifacts.index.main.ntotal - previous_main,
+                            'total': app.artifacts.index.ntotal})
+
+        except Exception as e:
+            print(f"Admin error: {str(e)}")
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/api/admin/reload', methods=['POST'])
+    @require_admin
+    def admin_reload():
+        """Load the index and question store from disk and swap them in without a restart"""
+        try:
+            if app.embedding_model is None:
+                return jsonify({'error': 'Models not loaded. Please try again later.'}), 503
+
+            previous = app.artifacts.version if app.artifacts is not None else None
+            drained = reload_artifacts(app)
+            return jsonify({'previous_version': previous, 'drained': drained, 'artifacts': app.artifacts.describe()})
+
+        except Exception as e:
+            print(f"Admin error: {str(e)}")
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/metrics')
+    def metrics():
+        """Prometheus metrics in the text exposition format"""
+        return Response(app.metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/api/stats')
+    def stats():
+        """Runtime statistics for tuning"""
+        return jsonify({
+            'batching': app.search_batcher.stats() if app.search_batcher is not None else None,
+            'embedding_cache': app.embedding_cache.stats() if app.embedding_cache is not None else None,
+            'rerank': {**app.rerank_cost_model.stats(), 'paths': dict(app.rerank_paths)},
+            'exact_matches': app.exact_matches,
+            'rerank_cache': app.rerank_cache.stats() if app.rerank_cache is not None else None,
+            'response_cache': app.response_cache.stats() if app.response_cache is not None else None
         })
 
     return app
 
 
-def load_models(app):
-    """Load all models and data"""
-    print("Loading models and data...")
+def models_loaded(app):
+    """Check whether all models and data are loaded"""
+    return all(component is not None for component in [
+        app.embedding_model,
+        app.artifacts,
+        app.reranker
+    ])
 
-    try:
-        # Check if required files exist
-        if not os.path.exists(Config.QUESTIONS_DF_PATH):
-            print(f"Error: Questions DataFrame not found at {Config.QUESTIONS_DF_PATH}")
-            print("Please run build_index_offline.py first")
-            return
 
-        if not os.path.exists(Config.FAISS_INDEX_PATH):
-            print(f"Error: FAISS index not found at {Config.FAISS_INDEX_PATH}")
-            print("Please run build_index_offline.py first")
-            return
+def component_status(app):
+    """Readiness, load time and load error of each startup component"""
+    return {name: {**status, 'load_seconds': app.load_timings.get(name)}
+            for name, status in app.components.items()}
+
+
+def _locked_iter(iterator, lock):
+    # Hold the lock while each item is produced, but not while the caller consumes it
+    while True:
+        with lock:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        # Locks are not fair: give a waiting search the chance to take the lock before the next pass
+        time.sleep(0)
+        yield item
+
 
-        # Load models
-        app.embedding_model = load_embedding_model()
-        print("✓ Embedding model loaded")
+def _using(artifacts, iterator):
+    # Count a streamed bulk response as in flight until its last chunk is produced
+    with artifacts.use():
+        yield from iterator
 
-        app.reranker = load_reranker()
-        print("✓ Reranker loaded")
 
-        app.questions_df = pd.read_pickle(Config.QUESTIONS_DF_PATH)
-        print(f"✓ Questions DataFrame loaded with {len(app.questions_df)} entries")
+def _cache_lookups(app):
+    lookups = {}
+    for name, cache in (('embedding', app.embedding_cache), ('rerank', app.rerank_cache),
+                        ('response', app.response_cache)):
+        if cache is not None:
+            stats = cache.stats()
+            lookups[(name, 'hit')] = stats['hits']
+            lookups[(name, 'miss')] = stats['misses']
+    return lookups
 
-        app.faiss_index = load_faiss_index()
-        print("✓ FAISS index loaded")
 
-        print("All models and data loaded successfully!")
+def artifact_version(app):
+    """Version stamp of the loaded reranker and artifacts, used to invalidate cached scores and responses"""
+    return artifact_version_stamp(app.artifacts)
 
+
+def _load_component(app, name, loader):
+    # Record the load time and outcome of one component; failures leave it unloaded
+    try:
+        with timed(app.load_timings, name):
+            component = loader()
     except Exception as e:
-        print(f"Error loading models: {e}")
+        print(f"Error loading {name}: {e}")
+        app.components[name] = {'ready': False, 'error': str(e)}
+        return None
+    app.components[name] = {'ready': True, 'error': None}
+    return component
+
+
+def load_models(app):
+    """Load all models and data, reading the artifacts while the models load"""
+    print("Loading models and data...")
+    start = time.perf_counter()
+
+    def load_transformers():
+        # transformers initializes weights through process-wide torch patches, so the
+        # two models are constructed one after the other, next to the artifact reads
+        embedding_model = _load_component(app, 'embedding_model', load_embedding_model)
+        if embedding_model is not None:
+            print("✓ Embedding model loaded")
+        reranker = _load_component(app, 'reranker', load_reranker)
+        if reranker is not None:
+            print("✓ Reranker loaded")
+        return embedding_model, reranker
+
+    # Model loading and index reads spend most of their time outside the GIL
+    with ThreadPoolExecutor(max_workers=3, thread_name_prefix='load') as executor:
+        models = executor.submit(load_transformers)
+        question_store = executor.submit(_load_component, app, 'question_store', load_question_store)
+        faiss_index = executor.submit(_load_component, app, 'faiss_index', load_index)
+        app.embedding_model, app.reranker = models.result()
+        question_store, faiss_index = question_store.result(), faiss_index.result()
+
+    if question_store is not None and faiss_index is not None:
+        try:
+            artifacts = assemble_artifact_set(faiss_index, question_store, read_artifact_version())
+            dimension = app.embedding_model.get_sentence_embedding_dimension() if app.embedding_model else None
+            artifacts.validate(dimension)
+        except Exception as e:
+            print(f"Error loading artifacts: {e}")
+            app.components['faiss_index'] = {'ready': False, 'error': str(e)}
+        else:
+            app.artifacts = artifacts
+            print(f"✓ Question store loaded with {len(question_store)} entries "
+                  f"({question_store.nbytes / 1024 ** 2:.1f} MB)")
+            print(f"✓ FAISS index loaded ({artifacts.index.main.ntotal} vectors, "
+                  f"{artifacts.index.delta.ntotal} in delta), artifact version {artifacts.version}")
+
+    if app.rerank_cache is not None:
+        app.rerank_cache.set_version(artifact_version(app))
+
+    app.load_timings['total'] = time.perf_counter() - start
+    if models_loaded(app):
+        print(f"All models and data loaded successfully in {app.load_timings['total']:.1f}s!")
+    else:
+        print("Some components failed to load, see /api/health. Run build_index_offline.py if artifacts are missing")
+
+
+def reload_artifacts(app):
+    """
+    Load the index and question store from disk next to the live ones and swap them in.
+
+    Searches keep using the live set while the new one loads. The new set is
+    validated before the swap; if loading or validation fails the live set stays.
+
+    Args:
+        app: Flask app with a loaded embedding model
+
+    Returns:
+        True if requests on the replaced set finished within ARTIFACT_DRAIN_TIMEOUT_SECONDS
+    """
+    # Holding the admin lock keeps incremental adds from writing files while they are read
+    with app.admin_lock:
+        if app.artifacts is not None and isinstance(app.artifacts.index.main, ShardedIndex) and \
+                app.artifacts.index.main.forked:
+            # Only the process that started the local shard workers can stop them, so this worker
+            # would start a second set and leave the old one running
+            raise RuntimeError("Local shard workers belong to the process that forked this one (gunicorn "
+                               "preload_app); restart the server to serve a new build, or run the shard "
+                               "workers with scripts/shard_worker.py and list them in SHARD_ADDRESSES")
+        print("Reloading artifacts...")
+        start = time.perf_counter()
+        artifacts = load_artifact_set(app.embedding_model.get_sentence_embedding_dimension())
+        previous, app.artifacts = app.artifacts, artifacts
+        app.components['question_store'] = {'ready': True, 'error': None}
+        app.components['faiss_index'] = {'ready': True, 'error': None}
+        if app.rerank_cache is not None:
+            app.rerank_cache.set_version(artifact_version(app))
+        print(f"✓ Artifact version {artifacts.version} loaded in {time.perf_counter() - start:.1f}s "
+              f"({artifacts.index.ntotal} vectors)")
+
+    if previous is None:
+        return True
+    drained = previous.wait_drained(Config.ARTIFACT_DRAIN_TIMEOUT_SECONDS)
+    if drained:
+        previous.close()
+        print(f"Released artifact version {previous.version}")
+    else:
+        print(f"Requests on artifact version {previous.version} still running after "
+              f"{Config.ARTIFACT_DRAIN_TIMEOUT_SECONDS}s; it is released when they finish")
+        threading.Thread(target=_release_when_drained, args=(previous,), daemon=True).start()
+    return drained
+
+
+def _release_when_drained(artifacts):
+    artifacts.wait_drained()
+    artifacts.close()
+    print(f"Released artifact version {artifacts.version}")
 
 
 # This would go in main.py or can be in the same file if preferred
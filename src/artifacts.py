@@ -0,0 +1,339 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from .config import Config
+from .faiss_index_search import TieredIndex, load_tiered_index
+from .question_store import QuestionStore
+from .sharding import ShardedIndex, load_sharded_index
+
+
+class ArtifactSet:
+    """
+    A FAISS index and the question store it was built from, swapped together.
+
+    Searches take one reference to the live set and use its index and store for
+    the whole request, so a swap never pairs an index with the wrong store.
+    Requests register with use() so a replaced set can wait for them to drain.
+    """
+
+    def __init__(self, index, question_store, version):
+        """
+        Args:
+            index: TieredIndex
+            question_store: QuestionStore with one row per index vector
+            version: Artifact version string
+        """
+        self.index = index
+        self.question_store = question_store
+        self.version = version
+        self.loaded_at = time.time()
+        self._active = 0
+        self._drained = threading.Condition()
+
+    def validate(self, dimension=None):
+        """
+        Check that the index and store belong together.
+
+        Args:
+            dimension: Expected embedding dimension, e.g. of the loaded embedding model
+
+        Raises:
+            ValueError: If row counts or dimensions do not match
+        """
+        if self.index.ntotal != len(self.question_store):
+            raise ValueError(f"Index has {self.index.ntotal} vectors but question store has "
+                             f"{len(self.question_store)} rows")
+        if dimension is not None and self.index.d != dimension:
+            raise ValueError(f"Index dimension {self.index.d} does not match embedding dimension {dimension}")
+
+    def use(self):
+        """Context manager marking a request that reads this set"""
+        return _ArtifactUse(self)
+
+    def wait_drained(self, timeout=None):
+        """
+        Wait until no request is using this set.
+
+        Args:
+            timeout: Maximum seconds to wait. If None, waits indefinitely.
+
+        Returns:
+            True if drained, False on timeout
+        """
+        with self._drained:
+            return self._drained.wait_for(lambda: self._active == 0, timeout)
+
+    def close(self):
+        """Stop the shard workers of a sharded index; other indexes are freed with their last reference"""
+        if isinstance(self.index.main, ShardedIndex):
+            self.index.main.close()
+
+    def describe(self):
+        return {
+            'version': self.version,
+            'vectors': self.index.ntotal,
+            'delta_vectors': self.index.delta.ntotal,
+            'dimension': self.index.d,
+            'shards': self.index.main.num_shards if isinstance(self.index.main, ShardedIndex) else 1,
+            'loaded_at': datetime.fromtimestamp(self.loaded_at, timezone.utc).isoformat()
+        }
+
+
+class _ArtifactUse:
+    def __init__(self, artifacts):
+        self.artifacts = artifacts
+
+    def __enter__(self):
+        with self.artifacts._drained:
+            self.artifacts._active += 1
+        return self.artifacts
+
+    def __exit__(self, *exc):
+        with self.artifacts._drained:
+            self.artifacts._active -= 1
+            if self.artifacts._active == 0:
+                self.artifacts._drained.notify_all()
+
+
+def write_manifest(num_questions, dimension, index_type, num_shards=1, manifest_path=None):
+    """
+    Record a finished build. Write it last: its version tells running servers to reload.
+
+    Args:
+        num_questions: Number of questions in the store and index
+        dimension: Embedding dimension
+        index_type: FAISS index type
+        num_shards: Number of shard files the index is split into
+        manifest_path: Path of the manifest file. If None, uses default from config.
+
+    Returns:
+        The version string written
+    """
+    manifest_path = manifest_path or Config.ARTIFACT_MANIFEST_PATH
+    manifest = {
+        'version': _new_version(),
+        'num_questions': num_questions,
+        'dimension': dimension,
+        'index_type': index_type,
+        'num_shards': num_shards
+    }
+    _write_manifest_file(manifest, manifest_path)
+    print(f"Artifact manifest written to {manifest_path} (version {manifest['version']})")
+    return manifest['version']
+
+
+def bump_artifact_version(num_questions, manifest_path=None):
+    """
+    Give the artifacts on disk a new version after an incremental update, so other processes reload them.
+
+    Args:
+        num_questions: Number of questions in the store and index after the update
+        manifest_path: Path of the manifest file. If None, uses default from config.
+
+    Returns:
+        The new version string
+    """
+    manifest_path = manifest_path or Config.ARTIFACT_MANIFEST_PATH
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    manifest.update(version=_new_version(), num_questions=num_questions)
+    _write_manifest_file(manifest, manifest_path)
+    return manifest['version']
+
+
+def _new_version():
+    return datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S.%fZ')
+
+
+def _write_manifest_file(manifest, manifest_path):
+    with open(f"{manifest_path}.tmp", 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+
+@contextmanager
+def artifact_lock(exclusive=True, lock_path=None):
+    """
+    Lock the artifact files against updates from other processes on the host.
+
+    Incremental adds and compactions hold the lock exclusively while they read,
+    extend and rewrite the question store, delta index and manifest; loads hold
+    it shared, so they never pair a store with the delta of another update.
+
+    Args:
+        exclusive: Take the lock for writing instead of reading
+        lock_path: Path of the lock file. If None, uses default from config.
+    """
+    lock_path = lock_path or Config.ARTIFACT_LOCK_PATH
+    if os.path.dirname(lock_path):
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    with open(lock_path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_artifact_version(manifest_path=None, index_path=None):
+    """
+    Version of the artifacts on disk.
+
+    Args:
+        manifest_path: Path of the manifest file. If None, uses default from config.
+        index_path: Index file used for builds without a manifest. If None, uses default from config.
+
+    Returns:
+        Version string from the manifest, or derived from the index modification time
+    """
+    manifest_path = manifest_path or Config.ARTIFACT_MANIFEST_PATH
+    index_path = index_path or Config.FAISS_INDEX_PATH
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)['version']
+    return f"mtime-{int(os.path.getmtime(index_path))}"
+
+
+def artifact_version_stamp(artifacts):
+    """
+    Version stamp of the configured reranker and the served artifacts, used to invalidate cached scores and responses.
+
+    Args:
+        artifacts: ArtifactSet, or None before the artifacts are loaded
+
+    Returns:
+        Version string that changes with the reranker model and the manifest version, which builds,
+        incremental adds and compactions all bump
+    """
+    model = Config.RERANKER_ONNX_PATH if Config.INFERENCE_BACKEND == 'onnx' else Config.RERANKER_MODEL
+    if Config.INFERENCE_BACKEND == 'onnx':
+        model = f"{model}/{Config.RERANKER_ONNX_FILE_NAME}"
+    if artifacts is None:
+        return f"{model}:none"
+    return f"{model}:{artifacts.version}"
+
+
+def load_question_store(store_path=None):
+    """
+    Load the question store, failing with build instructions when it is missing.
+
+    Args:
+        store_path: Directory of the store. If None, uses default from config.
+
+    Returns:
+        QuestionStore
+    """
+    store_path = store_path or Config.QUESTION_STORE_PATH
+    if not QuestionStore.exists(store_path):
+        raise FileNotFoundError(f"Question store not found at {store_path}. Run build_index_offline.py first, "
+                                f"or convert an old questions_df.pkl with build_index_offline.py --convert-pickle")
+    return QuestionStore.load(store_path)
+
+
+def load_index(index_path=None, delta_path=None):
+    """
+    Load the main and delta index, connecting to shard workers when the index is sharded.
+
+    Args:
+        index_path: Path of the main index. If None, uses default from config.
+        delta_path: Path of the delta index. If None, uses default from config.
+
+    Returns:
+        TieredIndex
+    """
+    if (Config.NUM_SHARDS or 1) > 1 or Config.SHARD_ADDRESSES:
+        return load_sharded_index(faiss_index_output_path=index_path, delta_index_path=delta_path)
+    index_path = index_path or Config.FAISS_INDEX_PATH
+    if not os.path.exists(index_path):
+        raise FileNotFoundError(f"FAISS index not found at {index_path}. Run build_index_offline.py first")
+    return load_tiered_index(index_path, delta_path)
+
+
+def assemble_artifact_set(index, question_store, version):
+    """
+    Pair a loaded index with its question store.
+
+    Args:
+        index: TieredIndex
+        question_store: QuestionStore
+        version: Artifact version string
+
+    Returns:
+        ArtifactSet
+    """
+    if index.ntotal != len(question_store) and index.main.ntotal == len(question_store):
+        # An interrupted compaction leaves a delta that is already part of the main index
+        print("Warning: delta index is already merged into the main index, ignoring it")
+        index = TieredIndex(index.main)
+    elif index.ntotal < len(question_store):
+        # An add that failed after saving the store has no vectors for its rows; the next add overwrites them
+        print(f"Warning: question store has {len(question_store) - index.ntotal} rows without vectors "
+              f"from an unfinished add, ignoring them")
+        question_store = question_store.head(index.ntotal)
+    return ArtifactSet(index, question_store, version)
+
+
+def load_artifact_set(dimension=None):
+    """
+    Load the index and question store from the configured paths and validate them.
+
+    Args:
+        dimension: Expected embedding dimension
+
+    Returns:
+        ArtifactSet
+    """
+    with artifact_lock(exclusive=False):
+        version = read_artifact_version()
+        artifacts = assemble_artifact_set(load_index(), load_question_store(), version)
+    artifacts.validate(dimension)
+    return artifacts
+
+
+class ArtifactWatcher:
+    """
+    Poll the artifact manifest and call a reload function when its version changes.
+
+    The polling thread starts lazily in the process that serves requests, so it
+    survives servers that fork workers after loading the app.
+    """
+
+    def __init__(self, get_version, reload_fn, interval_seconds):
+        """
+        Args:
+            get_version: Callable returning the version currently served
+            reload_fn: Callable loading and swapping in the artifacts on disk
+            interval_seconds: Seconds between checks
+        """
+        self.get_version = get_version
+        self.reload_fn = reload_fn
+        self.interval_seconds = interval_seconds
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def ensure_started(self):
+        """Start the polling thread in this process if it is not running"""
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='artifact-watcher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval_seconds)
+            try:
+                if os.path.exists(Config.ARTIFACT_MANIFEST_PATH) and read_artifact_version() != self.get_version():
+                    self.reload_fn()
+            except Exception as e:
+                print(f"Artifact reload failed, keeping the current artifacts: {e}")
@@ -0,0 +1,5 @@
+from .async_app import create_asgi_app
+
+# ASGI entry point for async serving. Run one uvicorn process; the parallelism comes from
+# the INFERENCE_WORKERS inference processes it starts, not from more HTTP workers.
+app = create_asgi_app()
@@ -0,0 +1,392 @@
+import asyncio
+import itertools
+import json
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import wraps
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from starlette.templating import Jinja2Templates
+from .config import Config
+from .inference_pool import InferencePool, QueueFullError
+from .metrics import MetricsRegistry
+from .utils import search_options_error
+
+# How often a bulk chunk retries while the pool is full
+BULK_RETRY_INTERVAL_SECONDS = 0.05
+
+
+def create_asgi_app(pool=None):
+    """
+    Create the async serving app, with the endpoints and pages of the Flask app.
+
+    One event loop parses requests and waits on the inference pool, so slow
+    clients and queued requests hold no thread or model. Searches and admin
+    updates run in the pool's worker processes; when its queue is full, requests
+    get 503 with Retry-After instead of waiting.
+
+    Args:
+        pool: InferencePool. If None, one is created from config.
+
+    Returns:
+        Starlette app; the pool starts and stops with the app's lifespan
+    """
+    pool = pool or InferencePool()
+    templates = Jinja2Templates(directory=os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'templates')))
+
+    # Prometheus metrics, exposed at /metrics with the names of the Flask app where they mean the same
+    registry = MetricsRegistry()
+    request_latency = registry.histogram('http_request_duration_seconds', 'Request latency by endpoint',
+                                         ('endpoint',))
+    request_count = registry.counter('http_requests_total', 'Requests by endpoint and status code',
+                                     ('endpoint', 'status'))
+    stage_latency = registry.histogram('search_stage_duration_seconds',
+                                       'Time spent per search stage, per pipeline batch', ('stage',))
+    search_batch_size = registry.histogram('search_batch_queries', 'Queries per pipeline batch',
+                                           buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+    searches = registry.counter('searches_total', 'Searched queries by reranking path', ('path',))
+    exact_match_count = registry.counter('exact_matches_total', 'Queries answered by the exact-match index')
+    candidates_reranked = registry.counter('candidates_reranked_total', 'Candidates scored by the reranker')
+    registry.callback('cache_lookups_total', 'Cache lookups by cache and result, summed over the inference workers',
+                      'counter', pool.cache_lookups, ('cache', 'result'))
+    registry.callback('inference_queue_depth', 'Jobs queued or running in the inference workers', 'gauge',
+                      lambda: {(): pool.queue_depth})
+    registry.callback('inference_jobs_total', 'Inference jobs by outcome', 'counter',
+                      lambda: {(name,): value for name, value in pool.stats().items()
+                               if name in ('completed', 'failed', 'rejected', 'timeouts', 'restarts')},
+                      ('result',))
+    registry.callback('inference_worker_load_seconds', 'Time taken by each inference worker to load', 'gauge',
+                      lambda: {(worker_id,): status['load_seconds']
+                               for worker_id, status in pool.worker_status().items()
+                               if status.get('load_seconds') is not None},
+                      ('worker',))
+
+    def record_batch(size, timings):
+        for stage, seconds in timings.items():
+            stage_latency.observe(seconds, stage=stage)
+        search_batch_size.observe(size)
+
+    pool.on_batch = record_batch
+
+    def instrumented(endpoint):
+        # Record latency and status under the endpoint's name; streamed responses are measured up to the first byte
+        @wraps(endpoint)
+        async def wrapper(request):
+            start = time.perf_counter()
+            response = await endpoint(request)
+            request_latency.observe(time.perf_counter() - start, endpoint=endpoint.__name__)
+            request_count.inc(endpoint=endpoint.__name__, status=response.status_code)
+            return response
+        return wrapper
+
+    @asynccontextmanager
+    async def lifespan(app):
+        pool.start()
+        yield
+        pool.close()
+
+    def busy():
+        return JSONResponse({'error': 'Server busy. Please try again later.'}, status_code=503,
+                            headers={'Retry-After': '1'})
+
+    def not_ready():
+        return JSONResponse({'error': 'Models not loaded. Please try again later.'}, status_code=503)
+
+    async def read_json(request):
+        try:
+            return await request.json()
+        except ValueError:
+            return None
+
+    async def api_search(request):
+        """API endpoint for searching similar questions"""
+        data = await read_json(request)
+        if not isinstance(data, dict) or 'query' not in data:
+            return JSONResponse({'error': 'No query provided'}, status_code=400)
+
+        if not isinstance(data['query'], str):
+            return JSONResponse({'error': 'Query must be a string'}, status_code=400)
+
+        options_error = search_options_error(data)
+        if options_error:
+            return JSONResponse({'error': options_error}, status_code=400)
+
+        if not pool.ready:
+            return not_ready()
+
+        try:
+            results, plan, cached = await pool.search(data['query'], k_candidates=data.get('k_candidates'),
+                                                      k_final=data.get('k_final'), nprobe=data.get('nprobe'),
+                                                      ef_search=data.get('ef_search'),
+                                                      latency_budget_ms=data.get('latency_budget_ms'),
+                                                      fill_exact=data.get('fill_exact'))
+        except QueueFullError:
+            return busy()
+        except asyncio.TimeoutError:
+            return JSONResponse({'error': 'Search timed out'}, status_code=504)
+        except Exception as e:
+            print(f"API error: {str(e)}")
+            return JSONResponse({'error': str(e)}, status_code=500)
+
+        record_search(plan, cached)
+        return JSONResponse({'results': results, 'rerank': plan, 'cached': cached})
+
+    def record_search(plan, cached):
+        if cached:
+            searches.inc(path='cached')
+            return
+        searches.inc(path=plan['path'])
+        candidates_reranked.inc(plan['reranked'])
+        if plan['exact_match']:
+            exact_match_count.inc()
+
+    def bulk_error(e):
+        # Status and message for a failed bulk chunk; a timeout's own message is empty
+        if isinstance(e, QueueFullError):
+            return 503, 'Server busy. Please try again later.'
+        if isinstance(e, asyncio.TimeoutError):
+            return 504, (f"A chunk of {Config.BULK_CHUNK_SIZE} queries did not finish within "
+                         f"{Config.INFERENCE_BULK_TIMEOUT_SECONDS}s")
+        return 500, str(e) or type(e).__name__
+
+    async def submit_chunk(payload):
+        # An admitted request waits for a free slot rather than failing partway through
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + Config.INFERENCE_BULK_TIMEOUT_SECONDS
+        while True:
+            try:
+                return await pool.submit('bulk', payload, Config.INFERENCE_BULK_TIMEOUT_SECONDS)
+            except QueueFullError:
+                if loop.time() > deadline:
+                    raise
+                await asyncio.sleep(BULK_RETRY_INTERVAL_SECONDS)
+
+    async def iter_chunk_results(queries, settings):
+        # Yields (offset, results) in input order, with one chunk in flight per worker at most,
+        # so a bulk request of any size holds a bounded share of the queue
+        offsets = iter(range(0, len(queries), Config.BULK_CHUNK_SIZE))
+        window = max(1, min(pool.num_workers, pool.max_queue_depth))
+        in_flight = deque()
+
+        def submit_next(count):
+            for offset in itertools.islice(offsets, count):
+                payload = {'queries': queries[offset:offset + Config.BULK_CHUNK_SIZE], **settings}
+                in_flight.append((offset, asyncio.ensure_future(submit_chunk(payload))))
+
+        try:
+            submit_next(window)
+            while in_flight:
+                offset, chunk = in_flight.popleft()
+                results = await chunk
+                submit_next(1)
+                yield offset, results
+        finally:
+            for _, chunk in in_flight:
+                chunk.cancel()
+
+    async def api_search_batch(request):
+        """API endpoint for searching many queries; chunks run in parallel across the workers"""
+        data = await read_json(request)
+        if not isinstance(data, dict) or not isinstance(data.get('queries'), list):
+            return JSONResponse({'error': 'No queries provided'}, status_code=400)
+
+        queries = data['queries']
+        if not all(isinstance(query, str) for query in queries):
+            return JSONResponse({'error': 'Queries must be strings'}, status_code=400)
+
+        options_error = search_options_error(data)
+        if options_error:
+            return JSONResponse({'error': options_error}, status_code=400)
+
+        if len(queries) > Config.BULK_MAX_QUERIES:
+            return JSONResponse({'error': f"At most {Config.BULK_MAX_QUERIES} queries per request"}, status_code=413)
+
+        if not pool.ready:
+            return not_ready()
+
+        # Admit the request only if its first chunk can be queued now; later chunks wait for slots
+        if pool.queue_depth >= pool.max_queue_depth:
+            return busy()
+
+        settings = {name: data.get(name) for name in ('k_candidates', 'k_final', 'nprobe', 'ef_search')}
+        chunks = iter_chunk_results(queries, settings)
+
+        stream = data.get('stream', len(queries) > Config.BULK_STREAM_THRESHOLD)
+        if not stream:
+            try:
+                results = [query_results async for _, chunk in chunks for query_results in chunk]
+            except Exception as e:
+                status_code, message = bulk_error(e)
+                print(f"API error: {message}")
+                return JSONResponse({'error': message}, status_code=status_code,
+                                    headers={'Retry-After': '1'} if status_code == 503 else None)
+            finally:
+                await chunks.aclose()
+            return JSONResponse({'results': results})
+
+        async def generate_ndjson():
+            # One line per query, in input order, sent as soon as each chunk and those before it are done.
+            # A failed chunk ends the stream with an {"error"} line, so a cut-short response is recognisable.
+            try:
+                async for offset, chunk in chunks:
+                    lines = [json.dumps({'index': offset + i, 'query': queries[offset + i], 'results': query_results})
+                             for i, query_results in enumerate(chunk)]
+                    yield '\n'.join(lines) + '\n'
+            except Exception as e:
+                _, message = bulk_error(e)
+                print(f"API error: {message}")
+                yield json.dumps({'error': message}) + '\n'
+            finally:
+                await chunks.aclose()
+
+        return StreamingResponse(generate_ndjson(), media_type='application/x-ndjson')
+
+    async def health_check(request):
+        """Health check endpoint for monitoring"""
+        return JSONResponse({
+            'status': 'ready' if pool.ready else 'initializing',
+            'live': True,
+            'version': Config.VERSION,
+            'workers': pool.worker_status()
+        })
+
+    async def liveness_check(request):
+        """Liveness probe: the event loop serves requests, even while the workers load"""
+        return JSONResponse({'status': 'alive'})
+
+    async def readiness_check(request):
+        """Readiness probe: 503 until a worker has loaded its models and artifacts"""
+        return JSONResponse({
+            'status': 'ready' if pool.ready else 'initializing',
+            'workers': pool.worker_status()
+        }, status_code=200 if pool.ready else 503)
+
+    async def stats(request):
+        """Runtime statistics for tuning"""
+        return JSONResponse({'inference': pool.stats()})
+
+    async def metrics(request):
+        """Prometheus metrics in the text exposition format"""
+        return Response(registry.render(), media_type='text/plain; version=0.0.4')
+
+    async def index(request):
+        """Render the search page"""
+        return templates.TemplateResponse(request, 'index.html')
+
+    async def search_page(request):
+        """Web interface for searching"""
+        query = request.query_params.get('query', '')
+        results = []
+        if query:
+            if not pool.ready:
+                return templates.TemplateResponse(
+                    request, 'error.html', {'error': "Search system is initializing. Please try again later."})
+            try:
+                results, plan, cached = await pool.search(query)
+            except QueueFullError:
+                return templates.TemplateResponse(
+                    request, 'error.html', {'error': "Server busy. Please try again later."}, status_code=503)
+            except Exception as e:
+                print(f"Error during search: {str(e)}")
+                return templates.TemplateResponse(request, 'error.html', {'error': str(e) or 'Search timed out'})
+            record_search(plan, cached)
+        return templates.TemplateResponse(request, 'results.html', {'query': query, 'results': results})
+
+    def admin_error(request):
+        # Response refusing an admin request, or None if the token matches
+        token = Config.ADMIN_TOKEN
+        if not token:
+            return JSONResponse({'error': 'Admin endpoints are disabled. Set ADMIN_TOKEN to enable them.'},
+                                status_code=403)
+        if request.headers.get('X-Admin-Token') != token:
+            return JSONResponse({'error': 'Invalid admin token'}, status_code=401)
+        return None
+
+    async def run_update(kind, payload):
+        # Run an add or compaction in one worker, which bumps the manifest version, then have every
+        # worker load that version at once instead of waiting for ARTIFACT_WATCH_INTERVAL_SECONDS
+        result = await pool.submit(kind, payload, Config.INFERENCE_BULK_TIMEOUT_SECONDS)
+        await pool.broadcast('reload', {}, Config.INFERENCE_BULK_TIMEOUT_SECONDS)
+        return result
+
+    async def admin_add_questions(request):
+        """Add new questions to the live index without a rebuild"""
+        error = admin_error(request)
+        if error is not None:
+            return error
+
+        data = await read_json(request)
+        questions = data.get('questions') if isinstance(data, dict) else None
+        if not isinstance(questions, list) or not all(isinstance(q, dict) and 'qid' in q and 'question' in q
+                                                      for q in questions):
+            return JSONResponse({'error': 'Expected questions as a list of {"qid", "question"} objects'},
+                                status_code=400)
+
+        if not pool.ready:
+            return not_ready()
+
+        try:
+            result = await run_update('add', {'questions': [(q['qid'], q['question']) for q in questions]})
+        except QueueFullError:
+            return busy()
+        except Exception as e:
+            print(f"Admin error: {str(e)}")
+            return JSONResponse({'error': str(e) or 'Update timed out'}, status_code=500)
+
+        return JSONResponse({'added': result['added'], 'skipped': len(questions) - result['added'],
+                             'total': result['artifacts']['vectors']})
+
+    async def admin_compact(request):
+        """Merge the delta index into the main index"""
+        error = admin_error(request)
+        if error is not None:
+            return error
+        if not pool.ready:
+            return not_ready()
+
+        try:
+            result = await run_update('compact', {})
+        except QueueFullError:
+            return busy()
+        except Exception as e:
+            print(f"Admin error: {str(e)}")
+            return JSONResponse({'error': str(e) or 'Update timed out'}, status_code=500)
+
+        return JSONResponse({'merged': result['merged'], 'total': result['artifacts']['vectors']})
+
+    async def admin_reload(request):
+        """Have every worker load the index and question store from disk without a restart"""
+        error = admin_error(request)
+        if error is not None:
+            return error
+        if not pool.ready:
+            return not_ready()
+
+        try:
+            results = await pool.broadcast('reload', {'force': True}, Config.INFERENCE_BULK_TIMEOUT_SECONDS)
+        except Exception as e:
+            print(f"Admin error: {str(e)}")
+            return JSONResponse({'error': str(e) or 'Reload timed out'}, status_code=500)
+
+        return JSONResponse({'workers': {str(worker_id): result['artifacts'] for worker_id, result in results.items()}})
+
+    app = Starlette(routes=[
+        Route('/', instrumented(index)),
+        Route('/search', instrumented(search_page)),
+        Route('/api/search', instrumented(api_search), methods=['POST']),
+        Route('/api/search/batch', instrumented(api_search_batch), methods=['POST']),
+        Route('/api/health', instrumented(health_check)),
+        Route('/api/health/live', instrumented(liveness_check)),
+        Route('/api/health/ready', instrumented(readiness_check)),
+        Route('/api/admin/questions', instrumented(admin_add_questions), methods=['POST']),
+        Route('/api/admin/compact', instrumented(admin_compact), methods=['POST']),
+        Route('/api/admin/reload', instrumented(admin_reload), methods=['POST']),
+        Route('/metrics', instrumented(metrics)),
+        Route('/api/stats', instrumented(stats))
+    ], lifespan=lifespan)
+    app.state.pool = pool
+    app.state.metrics = registry
+    return app
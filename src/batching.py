@@ -0,0 +1,192 @@
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from .config import Config
+
+
+def search_group_key(options):
+    """
+    Key of the search options that may share one pipeline call.
+
+    Requests with a latency budget share a call whatever their budgets, since the
+    budget bounds the whole batched reranker call; they never share one with
+    requests without a budget, which would otherwise be cut short by it.
+
+    Args:
+        options: Search options of one request
+
+    Returns:
+        Tuple of option items, hashable unless an option value is not
+    """
+    return tuple(sorted((name, value is not None if name == 'latency_budget_ms' else value)
+                        for name, value in options.items()))
+
+
+def group_call_options(options_list):
+    """
+    Options of the shared call for requests with the same search_group_key: the tightest latency budget applies.
+
+    Args:
+        options_list: Search options of the requests in the group
+
+    Returns:
+        Dictionary of keyword arguments for the search call
+    """
+    options = dict(options_list[0])
+    budgets = [options['latency_budget_ms'] for options in options_list
+               if options.get('latency_budget_ms') is not None]
+    if budgets:
+        options['latency_budget_ms'] = min(budgets)
+    return options
+
+
+def budgeted_first(groups):
+    """Order grouped requests so calls under a latency budget do not wait behind unbudgeted ones"""
+    return sorted(groups.items(), key=lambda item: not dict(item[0]).get('latency_budget_ms'))
+
+
+class _PendingSearch:
+    """A single search request waiting for its batch to be processed."""
+
+    def __init__(self, query_text, options):
+        self.query_text = query_text
+        self.options = options
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class SearchBatcher:
+    """
+    Collect concurrent search requests into micro-batches.
+
+    Requests are gathered for up to max_wait_ms or until max_batch_size requests
+    are queued, then handed to search_fn as one batch. Requests with different
+    search options are grouped so each group is a single batch call; requests
+    with latency budgets share a call under the tightest budget and run first.
+    """
+
+    def __init__(self, search_fn, max_batch_size=None, max_wait_ms=None, timeout_seconds=None):
+        """
+        Args:
+            search_fn: Callable taking (query_texts, **options) and returning one result per query
+            max_batch_size: Maximum number of queries per batch. If None, uses default from config.
+            max_wait_ms: Maximum time to wait for a batch to fill. If None, uses default from config.
+            timeout_seconds: Maximum time submit waits for a result. If None, uses default from config.
+        """
+        self.search_fn = search_fn
+        self.max_batch_size = max_batch_size or Config.SEARCH_BATCH_MAX_SIZE
+        self.max_wait_ms = Config.SEARCH_BATCH_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms
+        self.timeout_seconds = timeout_seconds or Config.SEARCH_BATCH_TIMEOUT_SECONDS
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+
+        self._batch_sizes = Counter()
+        self._total_requests = 0
+
+    def submit(self, query_text, **options):
+        """
+        Submit a query and block until its batch has been processed.
+
+        Args:
+            query_text: Query text
+            **options: Keyword arguments passed to search_fn for this query
+
+        Returns:
+            The result of search_fn for this query
+
+        Raises:
+            TimeoutError: If no result arrived within timeout_seconds
+        """
+        self._ensure_worker()
+        pending = _PendingSearch(query_text, options)
+        self._queue.put(pending)
+        if not pending.done.wait(self.timeout_seconds):
+            raise TimeoutError(f"Search did not finish within {self.timeout_seconds}s")
+
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def stats(self):
+        """
+        Report the batch-size distribution observed so far.
+
+        Returns:
+            Dictionary with batch and request counts and a size -> count distribution
+        """
+        with self._lock:
+            batches = sum(self._batch_sizes.values())
+            return {
+                'batches': batches,
+                'requests': self._total_requests,
+                'mean_batch_size': self._total_requests / batches if batches else 0.0,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait_ms,
+                'batch_size_distribution': {str(size): count for size, count in sorted(self._batch_sizes.items())}
+            }
+
+    def _ensure_worker(self):
+        # Threads do not survive fork, so a worker started before fork is restarted in the child
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+                return
+            if self._worker_pid != os.getpid():
+                self._queue = queue.Queue()
+            self._worker = threading.Thread(target=self._run, name='search-batcher', daemon=True)
+            self._worker_pid = os.getpid()
+            self._worker.start()
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000.0
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+
+            with self._lock:
+                self._batch_sizes[len(batch)] += 1
+                self._total_requests += len(batch)
+
+            # Group requests that can share one search call
+            groups = {}
+            for pending in batch:
+                try:
+                    groups.setdefault(search_group_key(pending.options), []).append(pending)
+                except TypeError as e:
+                    # Unhashable or unorderable option values fail their own request, not the batcher
+                    pending.error = ValueError(f"Invalid search options: {e}")
+                    pending.done.set()
+
+            for _, group in budgeted_first(groups):
+                self._process_group(group)
+
+    def _process_group(self, group):
+        try:
+            results = self.search_fn([pending.query_text for pending in group],
+                                     **group_call_options([pending.options for pending in group]))
+            for pending, result in zip(group, results):
+                pending.result = result
+        except Exception as e:
+            for pending in group:
+                pending.error = e
+        finally:
+            for pending in group:
+                pending.done.set()
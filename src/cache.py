@@ -0,0 +1,141 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Approximate per-entry bookkeeping cost (dict slot, tuple, key object header)
+ENTRY_OVERHEAD_BYTES = 128
+
+
+def default_sizeof(key, value):
+    """
+    Estimate the memory used by a cache entry.
+
+    Args:
+        key: Cache key
+        value: Cached value; numpy arrays are measured by their buffer size
+
+    Returns:
+        Approximate size in bytes
+    """
+    value_size = getattr(value, 'nbytes', None)
+    if value_size is None:
+        value_size = sys.getsizeof(value)
+    return sys.getsizeof(key) + value_size + ENTRY_OVERHEAD_BYTES
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache bounded by total size in bytes.
+
+    Entries can optionally expire after a time-to-live. Hit, miss, eviction
+    and expiration counters are kept for sizing the cache.
+    """
+
+    def __init__(self, max_bytes, ttl_seconds=None, sizeof=default_sizeof):
+        """
+        Args:
+            max_bytes: Maximum total size of cached entries
+            ttl_seconds: Time after which entries expire. If None, entries never expire.
+            sizeof: Callable taking (key, value) and returning the entry size in bytes
+        """
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sizeof = sizeof
+
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._lock = threading.Lock()
+        self._current_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """
+        Look up a key and mark it as recently used.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            Cached value, or None if missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, size, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Insert or replace a value, evicting least recently used entries to stay under max_bytes.
+
+        Args:
+            key: Cache key
+            value: Value to cache
+        """
+        size = self.sizeof(key, value)
+        if size > self.max_bytes:
+            return
+
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (value, size, expires_at)
+            self._current_bytes += size
+
+            while self._current_bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def clear(self):
+        """Remove all entries. Counters are kept."""
+        with self._lock:
+            self._entries.clear()
+            self._current_bytes = 0
+
+    def stats(self):
+        """
+        Report cache usage counters.
+
+        Returns:
+            Dictionary with entry count, size, hit/miss/eviction counters and hit rate
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._current_bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._current_bytes -= size
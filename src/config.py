@@ -1,17 +1,111 @@
+import os
+
+
 class Config:
     """Configuration settings for the similar questions system."""
 
+    VERSION = "1.1.0"
+
     # Model paths
     EMBEDDING_MODEL = "sentence-transformers/all-mpnet-base-v2"
     RERANKER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    EMBEDDING_MAX_SEQ_LENGTH = None  # Max tokens per text; None keeps the model's limit
+    RERANKER_MAX_SEQ_LENGTH = None  # Max tokens per query-candidate pair; None keeps the model's limit
+
+    # Inference backend: "torch", or "onnx" for ONNX Runtime models exported with scripts/export_onnx.py
+    INFERENCE_BACKEND = "torch"
+    EMBEDDING_ONNX_PATH = "models/onnx/embedding"
+    RERANKER_ONNX_PATH = "models/onnx/reranker"
+    # ONNX files inside the export directories, e.g. "onnx/model_qint8_avx512_vnni.onnx" for an int8 model
+    EMBEDDING_ONNX_FILE_NAME = "onnx/model.onnx"
+    RERANKER_ONNX_FILE_NAME = "onnx/model.onnx"
 
     # File paths
     DATA_PATH = "data/qqp/train.tsv"
-    QUESTIONS_DF_PATH = "models/questions_df.pkl"
+    QUESTIONS_DF_PATH = "models/questions_df.pkl"  # Legacy format, only read by build_index_offline.py --convert-pickle
+    QUESTION_STORE_PATH = "models/question_store"
     EMBEDDINGS_PATH = "models/questions_embeddings.npy"
+    EMBEDDINGS_DTYPE = "float32"  # Storage of the saved embeddings: float32, float16 or int8
     FAISS_INDEX_PATH = "models/questions_index.faiss"
+    DELTA_INDEX_PATH = "models/questions_delta.faiss"
+    BUILD_CHECKPOINT_PATH = "models/build_checkpoint.json"
+    ARTIFACT_MANIFEST_PATH = "models/manifest.json"  # Written last by a build; its version triggers hot reloads
+    ARTIFACT_LOCK_PATH = "models/artifacts.lock"  # Serializes incremental adds and reloads across processes
 
     # Search parameters
     DEFAULT_CANDIDATES = 50
     DEFAULT_RESULTS = 10
-    BATCH_SIZE = 64
\ No newline at end of file
+    BATCH_SIZE = 64
+    BUILD_CHUNK_SIZE = 50000  # Rows read, embedded and indexed per step in the streaming build
+    EMBEDDING_WORKERS = 1  # Processes encoding in parallel during offline builds
+    EMBEDDING_THREADS_PER_WORKER = None  # None splits the CPU cores evenly between workers
+    BULK_CHUNK_SIZE = 1024  # Queries per pipeline pass in bulk search
+    BULK_LOCKED_CHUNK_SIZE = 64  # Queries per pass while a Flask bulk request holds the model lock
+    BULK_MAX_QUERIES = 100000
+    BULK_STREAM_THRESHOLD = 1000  # Bulk requests larger than this are streamed as NDJSON
+
+    # Sharded search: the index is split into NUM_SHARDS files, each searched by its own worker process
+    NUM_SHARDS = None  # None or 1 serves a single index from the app process
+    SHARD_ADDRESSES = None  # "host:port" of running shard_worker.py processes in shard order; None starts local ones
+    SHARD_HOST = "127.0.0.1"
+    SHARD_WORKER_THREADS = None  # FAISS threads per local shard worker; None splits the cores between them
+    SHARD_TIMEOUT_SECONDS = 30
+
+    # Startup and artifact reloads
+    BACKGROUND_LOADING = False  # Serve liveness checks while loading; do not combine with gunicorn preload_app
+    ARTIFACT_WATCH_INTERVAL_SECONDS = None  # Poll the manifest and hot-swap new artifacts; None disables
+    ARTIFACT_DRAIN_TIMEOUT_SECONDS = 30  # How long a replaced artifact set waits for in-flight requests
+
+    # Async serving (src/asgi.py): an event loop handles HTTP and inference worker processes run the searches
+    INFERENCE_WORKERS = 2
+    INFERENCE_TORCH_THREADS = None  # Torch threads per inference worker; None splits the CPU cores evenly between them
+    INFERENCE_MAX_QUEUE_DEPTH = 64  # Jobs queued or running before new requests get 503
+    INFERENCE_TIMEOUT_SECONDS = 30
+    INFERENCE_BULK_TIMEOUT_SECONDS = 300  # Per BULK_CHUNK_SIZE chunk of a bulk request, queueing included
+
+    # Memory-map the index and question store so worker processes share them through the page cache
+    MMAP_ARTIFACTS = True
+
+    # Index parameters
+    INDEX_TYPE = "flat"  # One of: flat, ivf_flat, ivf_pq, hnsw, sq8, sq_fp16, ivf_sq8
+    INDEX_TRAIN_SAMPLE_SIZE = 100000
+    IVF_NLIST = 1024
+    IVF_NPROBE = 16
+    PQ_M = 64  # Must divide the embedding dimension
+    PQ_NBITS = 8
+    HNSW_M = 32
+    HNSW_EF_CONSTRUCTION = 200
+    HNSW_EF_SEARCH = 64
+
+    # Query embedding cache
+    EMBEDDING_CACHE_MAX_BYTES = 64 * 1024 * 1024  # 0 disables the cache
+    EMBEDDING_CACHE_TTL_SECONDS = None
+
+    # Queries matching a corpus question after cleaning are answered from the text hash index
+    EXACT_MATCH_ENABLED = True
+    EXACT_MATCH_FILL_RESULTS = False  # Also fill the other result slots through the full pipeline
+
+    # Reranker score cache, keyed on (clean query, candidate question id)
+    RERANK_CACHE_MAX_BYTES = 32 * 1024 * 1024  # 0 disables the cache
+    RERANK_CACHE_TTL_SECONDS = None
+
+    # Full search responses, shared by all worker processes on the host through an SQLite file
+    RESPONSE_CACHE_PATH = "models/response_cache.sqlite"
+    RESPONSE_CACHE_MAX_BYTES = 256 * 1024 * 1024  # 0 disables the cache
+    RESPONSE_CACHE_TTL_SECONDS = None
+    RESPONSE_CACHE_BUSY_TIMEOUT_MS = 50  # Lookups and writes blocked longer than this count as misses
+
+    # Request micro-batching
+    SEARCH_BATCHING_ENABLED = True
+    SEARCH_BATCH_MAX_SIZE = 32
+    SEARCH_BATCH_MAX_WAIT_MS = 5
+    SEARCH_BATCH_TIMEOUT_SECONDS = 30  # Longest a request waits for its batch before failing
+
+    # Adaptive reranking; distances are squared L2 between normalized embeddings (0 to 4)
+    RERANK_SKIP_GAP = None  # Skip the reranker when the best candidate is this much closer than the next, e.g. 0.25
+    RERANK_DISTANCE_MARGIN = None  # Only rerank candidates within this distance of the best, e.g. 0.5
+    RERANK_PAIR_COST_MS = 1.0  # Initial estimate of reranker time per pair, refined from measured calls
+    RERANK_COST_EWMA_ALPHA = 0.2
+
+    # Admin endpoints are disabled unless a token is configured
+    ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
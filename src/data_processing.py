@@ -1,7 +1,10 @@
+import hashlib
+import numpy as np
 import pandas as pd
-from typing import Tuple, List
+from itertools import chain
+from typing import Iterator, Tuple, List
 from .config import Config
-from .utils import clean_question_text
+from .utils import clean_question_texts
 
 
 def load_df(file_name: str = None) -> pd.DataFrame:
@@ -27,10 +30,17 @@ def load_df(file_name: str = None) -> pd.DataFrame:
         print(f"ERROR: File not found at {file_name}")
         raise
 
+    processed_df = _process_pairs(df)
+
+    print(f"Successfully loaded and processed '{file_name}'. Shape of processed_df: {processed_df.shape}")
+    return processed_df
+
+
+def _process_pairs(df: pd.DataFrame) -> pd.DataFrame:
     essential_columns = ['qid1', 'qid2', 'question1', 'question2', 'is_duplicate']
     df_clean = df.dropna(subset=essential_columns, how='any').reset_index(drop=True)
 
-    processed_df = pd.DataFrame({
+    return pd.DataFrame({
         'id_left': df_clean['qid1'],
         'id_right': df_clean['qid2'],
         'text_left': df_clean['question1'],
@@ -38,14 +48,93 @@ def load_df(file_name: str = None) -> pd.DataFrame:
         'label': df_clean['is_duplicate'].astype(int)
     })
 
-    print(f"Successfully loaded and processed '{file_name}'. Shape of processed_df: {processed_df.shape}")
-    return processed_df
+
+def iter_unique_question_chunks(file_name: str = None, chunk_size: int = None) -> Iterator[pd.DataFrame]:
+    """
+    Stream unique questions from the dataset without loading it into memory.
+
+    The file is read in chunks of pairs. Each chunk is cleaned and deduplicated
+    by qid and then by clean text, both within the chunk and against everything
+    seen in earlier chunks. Only 128-bit digests of seen qids and texts are kept
+    in memory, so distinct questions do not collide in practice.
+
+    Args:
+        file_name: Path to the dataset file. If None, uses default from config.
+        chunk_size: Number of question pairs per chunk. If None, uses default from config.
+
+    Yields:
+        DataFrames with 'qid' and 'clean_question' columns holding questions not seen before
+    """
+    file_name = file_name or Config.DATA_PATH
+    chunk_size = chunk_size or Config.BUILD_CHUNK_SIZE
+    print(f"Streaming '{file_name}' dataset in chunks of {chunk_size} rows...")
+
+    seen_qids = set()
+    seen_texts = set()
+
+    reader = pd.read_csv(file_name,
+                         sep='\t',
+                         on_bad_lines='skip',
+                         dtype=object,
+                         quoting=3,
+                         chunksize=chunk_size)
+
+    for chunk in reader:
+        pairs = _process_pairs(chunk)
+        questions = pd.DataFrame({
+            'qid': pd.concat([pairs['id_left'], pairs['id_right']], ignore_index=True),
+            'clean_question': clean_question_texts(pd.concat([pairs['text_left'], pairs['text_right']],
+                                                             ignore_index=True))
+        })
+
+        # Same order of deduplication as create_unique_questions_df: qid first, then clean text
+        keep = []
+        for qid, text in zip(questions['qid'], questions['clean_question']):
+            qid_digest = _digest(qid)
+            if qid_digest in seen_qids:
+                keep.append(False)
+                continue
+            seen_qids.add(qid_digest)
+            text_digest = _digest(text)
+            if text_digest in seen_texts:
+                keep.append(False)
+                continue
+            seen_texts.add(text_digest)
+            keep.append(True)
+
+        yield questions[keep].reset_index(drop=True)
+
+
+def _digest(value: str) -> bytes:
+    # A collision would silently drop a distinct question; 128 bits make that negligible, unlike 64-bit hash()
+    return hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+
+
+def unique_question_mask(qids: np.ndarray, clean_texts: np.ndarray) -> np.ndarray:
+    """
+    Select the first occurrence of each qid, then the first remaining occurrence of each clean text.
+
+    Each pass is a single hash-table scan, and rows keep their original order.
+
+    Args:
+        qids: Array of question ids
+        clean_texts: Array of clean question texts, aligned with qids
+
+    Returns:
+        Boolean array, True for the rows to keep
+    """
+    keep = ~pd.Series(qids).duplicated(keep='first').to_numpy()
+    keep[keep] = ~pd.Series(clean_texts[keep]).duplicated(keep='first').to_numpy()
+    return keep
 
 
 def create_unique_questions_df(df: pd.DataFrame) -> Tuple[pd.DataFrame, List[str]]:
     """
     Create a DataFrame with unique questions from question pairs.
 
+    Left questions come before right questions, and the first occurrence of a qid
+    or clean text is kept.
+
     Args:
         df: DataFrame with question pairs
 
@@ -54,20 +143,17 @@ def create_unique_questions_df(df: pd.DataFrame) -> Tuple[pd.DataFrame, List[str
     """
     print("Starting question_df creation...")
 
-    # Extract left questions and apply cleaning directly
-    left_questions = df[['id_left', 'text_left']].rename(columns={'id_left': 'qid', 'text_left': 'clean_question'})
-    left_questions['clean_question'] = left_questions['clean_question'].apply(clean_question_text)
-
-    # Extract right questions and apply cleaning directly
-    right_questions = df[['id_right', 'text_right']].rename(columns={'id_right': 'qid', 'text_right': 'clean_question'})
-    right_questions['clean_question'] = right_questions['clean_question'].apply(clean_question_text)
+    # Left questions followed by right questions, cleaned in one batch
+    qids = np.concatenate([df['id_left'].to_numpy(dtype=object), df['id_right'].to_numpy(dtype=object)])
+    clean_texts = np.empty(len(qids), dtype=object)
+    clean_texts[:] = clean_question_texts(chain(df['text_left'], df['text_right']))
 
-    # Combine and remove duplicates by qid first
-    combined_df = (pd.concat([left_questions, right_questions], ignore_index=True)
-                   .drop_duplicates(subset=['qid'], keep='first'))
-
-    # Remove duplicates by clean question text (final deduplication)
-    all_questions_df = combined_df.drop_duplicates(subset=['clean_question'], keep='first').reset_index(drop=True)
+    # Deduplicate by qid first, then by clean question text
+    keep = unique_question_mask(qids, clean_texts)
+    all_questions_df = pd.DataFrame({
+        'qid': pd.Series(qids[keep], dtype=df['id_left'].dtype),
+        'clean_question': pd.Series(clean_texts[keep], dtype='str')
+    })
     texts_to_embed_list = all_questions_df['clean_question'].tolist()
 
     print(f"Successfully created question_df. Shape of question_df: {all_questions_df.shape}")
@@ -1,20 +1,37 @@
+import multiprocessing
+import os
+import time
+import numpy as np
+import torch
 from sentence_transformers import SentenceTransformer
-from .utils import clean_question_text
+from .utils import clean_question_texts, backend_model_kwargs
 from .config import Config
+from .cache import LRUCache
 
 
-def load_embedding_model(model_name=None):
+def load_embedding_model(model_name=None, max_seq_length=None, backend=None, onnx_file_name=None):
     """
     Load sentence transformer model for embeddings.
 
     Args:
-        model_name: Name or path of the model. If None, uses default from config.
+        model_name: Name or path of the model. If None, uses default from config
+            (the exported ONNX model for the onnx backend).
+        max_seq_length: Maximum number of tokens per text. If None, uses default from config,
+            or the model's own limit if that is not set.
+        backend: Inference backend, "torch" or "onnx". If None, uses default from config.
+        onnx_file_name: ONNX file inside the model directory for the onnx backend. If None,
+            uses default from config.
 
     Returns:
         Loaded SentenceTransformer model
     """
-    model_name = model_name or Config.EMBEDDING_MODEL
-    embed_model = SentenceTransformer(model_name)
+    backend = backend or Config.INFERENCE_BACKEND
+    model_name = model_name or (Config.EMBEDDING_ONNX_PATH if backend == 'onnx' else Config.EMBEDDING_MODEL)
+    max_seq_length = max_seq_length or Config.EMBEDDING_MAX_SEQ_LENGTH
+    onnx_file_name = onnx_file_name or Config.EMBEDDING_ONNX_FILE_NAME
+    embed_model = SentenceTransformer(model_name, **backend_model_kwargs(model_name, backend, onnx_file_name))
+    if max_seq_length:
+        embed_model.max_seq_length = max_seq_length
     return embed_model
 
 
@@ -33,27 +50,190 @@ def generate_embeddings(texts_to_embed_list: list, model_name=None):
     model_name = model_name or Config.EMBEDDING_MODEL
 
     embed_model = load_embedding_model(model_name)
-    embed_list = embed_model.encode(texts_to_embed_list,
-                                    batch_size=Config.BATCH_SIZE,
-                                    show_progress_bar=True,
-                                    convert_to_numpy=True
-                                    )
+    # encode() already batches the texts in length order and returns them in input order
+    embed_list = embed_model.encode(texts_to_embed_list, batch_size=Config.BATCH_SIZE, show_progress_bar=False,
+                                    convert_to_numpy=True)
 
     print(f"Generated embeddings shape: {embed_list.shape}")
     return embed_list
 
 
-def embed_single_question(model, question):
+def generate_embeddings_to_file(texts, output_path=None, model_name=None, start_row=0, chunk_size=None,
+                                on_chunk_done=None, num_workers=None, threads_per_worker=None):
+    """
+    Generate embeddings chunk by chunk into a preallocated memory-mapped .npy file.
+
+    Only one chunk of texts and embeddings is in memory at a time. Rows before
+    start_row are assumed to be already written, so an interrupted run can resume.
+    With several workers each chunk is split into shards encoded by a pool of
+    processes, each with its own model copy, writing straight into the file.
+
+    Args:
+        texts: Sequence of texts supporting len() and slicing (a list or StringColumn)
+        output_path: Path of the .npy file. If None, uses default from config.
+        model_name: Name or path of the model. If None, uses default from config.
+        start_row: First row to embed; rows before it are kept from an earlier run
+        chunk_size: Number of texts encoded and flushed per chunk. If None, uses default from config.
+        on_chunk_done: Optional callable receiving the number of rows written so far after each flush
+        num_workers: Number of encoding processes. If None, uses default from config.
+        threads_per_worker: Torch threads per process. If None, uses default from config,
+            or splits the CPU cores evenly between workers.
+
+    Returns:
+        Read-only memory-mapped array of embeddings
+    """
+    output_path = output_path or Config.EMBEDDINGS_PATH
+    model_name = model_name or Config.EMBEDDING_MODEL
+    chunk_size = chunk_size or Config.BUILD_CHUNK_SIZE
+    num_workers = num_workers or Config.EMBEDDING_WORKERS
+    threads_per_worker = (threads_per_worker or Config.EMBEDDING_THREADS_PER_WORKER
+                          or max(1, (os.cpu_count() or 1) // num_workers))
+
+    embed_model = load_embedding_model(model_name)
+    shape = (len(texts), embed_model.get_sentence_embedding_dimension())
+
+    if start_row > 0:
+        embeddings = np.lib.format.open_memmap(output_path, mode='r+')
+        if embeddings.shape != shape:
+            raise ValueError(f"Cannot resume: {output_path} has shape {embeddings.shape}, expected {shape}")
+        if embeddings.dtype != np.float32:
+            raise ValueError(f"Cannot resume: {output_path} holds {embeddings.dtype} embeddings of a finished build, "
+                             f"expected float32")
+        print(f"Resuming embedding generation at row {start_row} of {shape[0]}")
+    else:
+        embeddings = np.lib.format.open_memmap(output_path, mode='w+', dtype=np.float32, shape=shape)
+        embeddings.flush()
+        print(f"Starting embedding generation for {shape[0]} texts...")
+
+    pool = None
+    if num_workers > 1:
+        # Workers load their own model copy
+        del embed_model
+        print(f"Encoding with {num_workers} worker processes, {threads_per_worker} threads each")
+        pool = multiprocessing.get_context('spawn').Pool(
+            num_workers,
+            initializer=_init_embedding_worker,
+            initargs=(model_name, output_path, threads_per_worker, Config.BATCH_SIZE,
+                      Config.EMBEDDING_MAX_SEQ_LENGTH, Config.INFERENCE_BACKEND, Config.EMBEDDING_ONNX_FILE_NAME)
+        )
+
+    start_time = time.perf_counter()
+    try:
+        for start in range(start_row, shape[0], chunk_size):
+            end = min(start + chunk_size, shape[0])
+            chunk_texts = texts[start:end]
+            if pool is None:
+                embeddings[start:end] = embed_model.encode(chunk_texts, batch_size=Config.BATCH_SIZE,
+                                                           show_progress_bar=False, convert_to_numpy=True)
+                embeddings.flush()
+            else:
+                # Several shards per worker balance the load. Each shard knows its row ids.
+                shards = [(start + shard_ids, [chunk_texts[i] for i in shard_ids])
+                          for shard_ids in np.array_split(np.arange(end - start), num_workers * 4) if len(shard_ids)]
+                for _ in pool.imap_unordered(_embed_shard, shards):
+                    pass
+            print(f"Embedded {end}/{shape[0]} texts")
+            if on_chunk_done is not None:
+                on_chunk_done(end)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    elapsed = time.perf_counter() - start_time
+    embedded = shape[0] - start_row
+    print(f"Embedded {embedded} texts in {elapsed:.1f}s "
+          f"({embedded / elapsed if elapsed > 0 else 0.0:.1f} sentences/sec, {num_workers} worker(s))")
+
+    del embeddings
+    return np.load(output_path, mmap_mode='r')
+
+
+# Per-process state of embedding pool workers
+_worker_state = {}
+
+
+def _init_embedding_worker(model_name, output_path, threads_per_worker, batch_size, max_seq_length, backend,
+                           onnx_file_name):
+    torch.set_num_threads(threads_per_worker)
+    _worker_state['model'] = load_embedding_model(model_name, max_seq_length, backend, onnx_file_name)
+    _worker_state['output'] = np.load(output_path, mmap_mode='r+')
+    _worker_state['batch_size'] = batch_size
+
+
+def _embed_shard(shard):
+    row_ids, texts = shard
+    output = _worker_state['output']
+    output[row_ids] = _worker_state['model'].encode(texts, batch_size=_worker_state['batch_size'],
+                                                    show_progress_bar=False, convert_to_numpy=True)
+    output.flush()
+    return len(texts)
+
+
+def create_embedding_cache(max_bytes=None, ttl_seconds=None):
+    """
+    Create a query embedding cache keyed on cleaned question text.
+
+    Args:
+        max_bytes: Maximum cache size in bytes. If None, uses default from config.
+        ttl_seconds: Entry lifetime in seconds. If None, uses default from config.
+
+    Returns:
+        LRUCache instance, or None if caching is disabled (max_bytes of 0)
+    """
+    max_bytes = Config.EMBEDDING_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    ttl_seconds = ttl_seconds or Config.EMBEDDING_CACHE_TTL_SECONDS
+    if not max_bytes:
+        return None
+    return LRUCache(max_bytes, ttl_seconds)
+
+
+def embed_single_question(model, question, cache=None):
     """
     Generate embedding for a single question.
 
     Args:
         model: SentenceTransformer model
         question: Question text
+        cache: Optional LRUCache of embeddings keyed on cleaned text
 
     Returns:
         Embedding vector for the question
     """
-    clean_question = clean_question_text(question)
-    emb_question = model.encode([clean_question])
-    return emb_question[0]
+    return embed_questions(model, [question], cache)[0]
+
+
+def embed_questions(model, questions, cache=None):
+    """
+    Generate embeddings for a batch of questions in a single encode call.
+
+    Questions whose cleaned text is in the cache are not sent to the model.
+
+    Args:
+        model: SentenceTransformer model
+        questions: List of question texts
+        cache: Optional LRUCache of embeddings keyed on cleaned text
+
+    Returns:
+        Float32 numpy array of shape (len(questions), dimension)
+    """
+    clean_questions = clean_question_texts(questions)
+    if cache is None:
+        return model.encode(clean_questions, batch_size=Config.BATCH_SIZE).astype('float32')
+
+    embeddings = [cache.get(clean_question) for clean_question in clean_questions]
+    # Encode each distinct missing text once
+    missing = list(dict.fromkeys(text for text, emb in zip(clean_questions, embeddings) if emb is None))
+
+    if missing:
+        encoded = model.encode(missing, batch_size=Config.BATCH_SIZE).astype('float32')
+        encoded_by_text = {}
+        for text, emb in zip(missing, encoded):
+            emb = emb.copy()
+            emb.setflags(write=False)
+            cache.put(text, emb)
+            encoded_by_text[text] = emb
+        embeddings = [emb if emb is not None else encoded_by_text[text]
+                      for text, emb in zip(clean_questions, embeddings)]
+
+    return np.stack(embeddings)
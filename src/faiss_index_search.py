@@ -1,44 +1,260 @@
-from .embedding import embed_single_question
 from .config import Config
+from .metrics import timed
+import os
+import numpy as np
 import faiss
 
+INDEX_TYPES = ('flat', 'ivf_flat', 'ivf_pq', 'hnsw', 'sq8', 'sq_fp16', 'ivf_sq8')
 
-def build_faiss_index(emb_list):
+# Index types that store vectors in less than float32 precision
+COMPRESSED_INDEX_TYPES = ('ivf_pq', 'sq8', 'sq_fp16', 'ivf_sq8')
+
+
+def create_faiss_index(dimension, index_type=None, num_vectors=None):
     """
-    Build FAISS index from embeddings.
+    Create an empty FAISS index of the requested type.
+
+    Args:
+        dimension: Embedding dimension
+        index_type: One of INDEX_TYPES. If None, uses default from config.
+        num_vectors: Number of vectors the index will hold, used to cap the IVF list count
+
+    Returns:
+        FAISS index (untrained for IVF types)
+    """
+    index_type = index_type or Config.INDEX_TYPE
+
+    if index_type == 'flat':
+        return faiss.IndexFlatL2(dimension)
+
+    if index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dimension, Config.HNSW_M)
+        index.hnsw.efConstruction = Config.HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = Config.HNSW_EF_SEARCH
+        return index
+
+    # Scalar quantizers store each dimension as int8 or float16. Queries stay float32 and are
+    # compared against the decoded vectors, so they need no quantization of their own.
+    if index_type == 'sq8':
+        return faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit)
+
+    if index_type == 'sq_fp16':
+        return faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_fp16)
+
+    if index_type in ('ivf_flat', 'ivf_pq', 'ivf_sq8'):
+        # FAISS needs roughly 39 training points per list, so small corpora get fewer lists
+        nlist = Config.IVF_NLIST
+        if num_vectors:
+            nlist = max(1, min(nlist, num_vectors // 39))
+
+        quantizer = faiss.IndexFlatL2(dimension)
+        if index_type == 'ivf_flat':
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+        elif index_type == 'ivf_sq8':
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dimension, nlist, faiss.ScalarQuantizer.QT_8bit)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, Config.PQ_M, Config.PQ_NBITS)
+        index.nprobe = min(Config.IVF_NPROBE, nlist)
+        return index
+
+    raise ValueError(f"Unknown index type '{index_type}'. Expected one of: {', '.join(INDEX_TYPES)}")
+
+
+def train_faiss_index(index, emb_list, train_sample_size=None):
+    """
+    Train the index on a random sample of the embeddings if it needs training.
 
     Args:
+        index: FAISS index
         emb_list: Numpy array of embeddings
+        train_sample_size: Maximum number of vectors to train on. If None, uses default from config.
+    """
+    if index.is_trained:
+        return
+
+    train_sample_size = train_sample_size or Config.INDEX_TRAIN_SAMPLE_SIZE
+    if len(emb_list) > train_sample_size:
+        rng = np.random.default_rng(42)
+        sample_ids = np.sort(rng.choice(len(emb_list), size=train_sample_size, replace=False))
+        train_vectors = emb_list[sample_ids]
+    else:
+        train_vectors = emb_list
+
+    print(f"Training index on {len(train_vectors)} vectors...")
+    index.train(np.ascontiguousarray(train_vectors, dtype='float32'))
+
+
+def build_faiss_index(emb_list, index_type=None, train_sample_size=None, chunk_size=None):
+    """
+    Build FAISS index from embeddings.
+
+    Args:
+        emb_list: Numpy array of embeddings (may be memory-mapped)
+        index_type: One of INDEX_TYPES. If None, uses default from config.
+        train_sample_size: Maximum number of vectors used to train IVF indexes
+        chunk_size: Number of vectors added per call, bounding the float32 copy made for each chunk.
+            If None, all vectors are added at once.
 
     Returns:
         FAISS index
     """
-    print("Building FAISS index...")
+    index_type = index_type or Config.INDEX_TYPE
+    print(f"Building FAISS index ({index_type})...")
     dimension = emb_list.shape[1]
-    index = faiss.IndexFlatL2(dimension)
+    index = create_faiss_index(dimension, index_type, num_vectors=len(emb_list))
+    train_faiss_index(index, emb_list, train_sample_size)
 
     print("Adding embeddings to index...")
-    index.add(emb_list.astype('float32'))
+    chunk_size = chunk_size or max(len(emb_list), 1)
+    for start in range(0, len(emb_list), chunk_size):
+        index.add(np.ascontiguousarray(emb_list[start:start + chunk_size], dtype='float32'))
 
     print(f"Successfully created index with {index.ntotal} vectors")
     return index
 
 
-def load_faiss_index(faiss_index_output_path=None):
+def load_faiss_index(faiss_index_output_path=None, mmap=None):
     """
     Load FAISS index from file.
 
     Args:
         faiss_index_output_path: Path to the index file. If None, uses default from config.
+        mmap: Memory-map the index read-only instead of reading it into process memory.
+            If None, uses default from config. A memory-mapped index cannot be modified.
 
     Returns:
         FAISS index
     """
     path = faiss_index_output_path or Config.FAISS_INDEX_PATH
-    return faiss.read_index(path)
+    mmap = Config.MMAP_ARTIFACTS if mmap is None else mmap
+    if not mmap:
+        return faiss.read_index(path)
+    return faiss.read_index(path, _mmap_io_flags(path))
+
+
+def _mmap_io_flags(path):
+    # The two mmap flags cannot be combined, so pick one from the index fourcc:
+    # IVF indexes ('Iw..') map their inverted lists, the others their flat code arrays
+    with open(path, 'rb') as f:
+        fourcc = f.read(4)
+    if fourcc.startswith(b'Iw'):
+        mmap_flag = faiss.IO_FLAG_MMAP
+    else:
+        mmap_flag = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP)
+    return mmap_flag | faiss.IO_FLAG_READ_ONLY
+
+
+class TieredIndex:
+    """
+    Main FAISS index plus a small delta index of recently added vectors.
+
+    Delta vectors get row ids after the main index (main.ntotal + i), matching
+    the order in which their questions are appended to the question store.
+    Searches query both indexes and merge the results by distance.
+    """
+
+    def __init__(self, main, delta=None):
+        """
+        Args:
+            main: FAISS index built offline (may be memory-mapped and read-only)
+            delta: Flat FAISS index with vectors added since the build. If None, an empty one is created.
+        """
+        self.main = main
+        self.delta = delta if delta is not None else faiss.IndexFlatL2(main.d)
+
+    @property
+    def d(self):
+        return self.main.d
+
+    @property
+    def ntotal(self):
+        return self.main.ntotal + self.delta.ntotal
+
+    def search(self, x, k, params=None):
+        """
+        Search both indexes and return the merged top k.
+
+        Args:
+            x: Float32 query matrix
+            k: Number of neighbours per query
+            params: Search parameters for the main index
 
+        Returns:
+            Tuple of (distances, indices)
+        """
+        distances, indices = self.main.search(x, k, params=params)
+        if self.delta.ntotal == 0:
+            return distances, indices
 
-def search_faiss(query_text, emb_model, index, k_candidates=None):
+        delta_distances, delta_indices = self.delta.search(x, min(k, self.delta.ntotal))
+        delta_indices = np.where(delta_indices >= 0, delta_indices + self.main.ntotal, -1)
+
+        distances = np.concatenate([distances, delta_distances], axis=1)
+        indices = np.concatenate([indices, delta_indices], axis=1)
+        order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+
+def load_tiered_index(faiss_index_output_path=None, delta_index_path=None, mmap=None):
+    """
+    Load the main FAISS index together with its delta index, if one exists.
+
+    Args:
+        faiss_index_output_path: Path to the main index file. If None, uses default from config.
+        delta_index_path: Path to the delta index file. If None, uses default from config.
+        mmap: Memory-map the main index. If None, uses default from config.
+
+    Returns:
+        TieredIndex
+    """
+    main = load_faiss_index(faiss_index_output_path, mmap)
+    return TieredIndex(main, read_delta_index(delta_index_path))
+
+
+def read_delta_index(delta_index_path=None):
+    """
+    Read the delta index of incremental adds.
+
+    Args:
+        delta_index_path: Path to the delta index file. If None, uses default from config.
+
+    Returns:
+        FAISS index, or None if no questions were added since the build
+    """
+    delta_index_path = delta_index_path or Config.DELTA_INDEX_PATH
+    # The delta index stays small and is modified in place, so it is never memory-mapped
+    return faiss.read_index(delta_index_path) if os.path.exists(delta_index_path) else None
+
+
+def get_search_parameters(index, nprobe=None, ef_search=None):
+    """
+    Build per-call search parameters for the index type.
+
+    Parameters are passed to each search call instead of being set on the index,
+    so concurrent requests can use different values safely.
+
+    Args:
+        index: FAISS index
+        nprobe: Number of inverted lists to visit (IVF indexes)
+        ef_search: Size of the dynamic candidate list (HNSW indexes)
+
+    Returns:
+        FAISS SearchParameters object, or None to use the index defaults
+    """
+    if isinstance(index, TieredIndex):
+        index = index.main
+    if hasattr(index, 'search_parameters'):
+        # A sharded index forwards plain values to its workers
+        return index.search_parameters(nprobe, ef_search)
+    if nprobe and faiss.try_extract_index_ivf(index) is not None:
+        return faiss.SearchParametersIVF(nprobe=int(nprobe))
+    if ef_search and isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=int(ef_search))
+    return None
+
+
+def search_faiss(query_text, emb_model, index, k_candidates=None, nprobe=None, ef_search=None,
+                 embedding_cache=None):
     """
     Search for similar questions using FAISS.
 
@@ -47,14 +263,43 @@ def search_faiss(query_text, emb_model, index, k_candidates=None):
         emb_model: SentenceTransformer model
         index: FAISS index
         k_candidates: Number of candidates to retrieve
+        nprobe: Number of inverted lists to visit (IVF indexes only)
+        ef_search: HNSW search depth (HNSW indexes only)
+        embedding_cache: Optional LRUCache of query embeddings
 
     Returns:
         Tuple of (distances, indices)
     """
+    return search_faiss_batch([query_text], emb_model, index, k_candidates, nprobe, ef_search, embedding_cache)
+
+
+def search_faiss_batch(query_texts, emb_model, index, k_candidates=None, nprobe=None, ef_search=None,
+                       embedding_cache=None, timings=None):
+    """
+    Search for similar questions for several queries with one encode and one index search.
+
+    Args:
+        query_texts: List of query texts
+        emb_model: SentenceTransformer model
+        index: FAISS index
+        k_candidates: Number of candidates to retrieve per query
+        nprobe: Number of inverted lists to visit (IVF indexes only)
+        ef_search: HNSW search depth (HNSW indexes only)
+        embedding_cache: Optional LRUCache of query embeddings
+        timings: Optional dictionary collecting seconds spent per stage ('encode', 'faiss')
+
+    Returns:
+        Tuple of (distances, indices), each with one row per query
+    """
+    # Imported on use so shard workers, which only search, do not load torch
+    from .embedding import embed_questions
+
     k_candidates = k_candidates or Config.DEFAULT_CANDIDATES
 
-    emb_question = embed_single_question(emb_model, query_text)
-    emb_question = emb_question.astype('float32').reshape(1, -1)
-    distances, indices = index.search(emb_question, k=k_candidates)
+    with timed(timings, 'encode'):
+        emb_questions = embed_questions(emb_model, query_texts, embedding_cache)
+    with timed(timings, 'faiss'):
+        params = get_search_parameters(index, nprobe, ef_search)
+        distances, indices = index.search(np.ascontiguousarray(emb_questions), k=k_candidates, params=params)
 
     return distances, indices
@@ -0,0 +1,139 @@
+import os
+import faiss
+from .config import Config
+from .artifacts import ArtifactSet, artifact_lock, assemble_artifact_set, bump_artifact_version, read_artifact_version
+from .embedding import embed_questions
+from .faiss_index_search import TieredIndex, load_faiss_index, read_delta_index
+from .question_store import QuestionStore
+from .sharding import ShardedIndex
+from .utils import clean_question_text
+
+
+def _write_index_atomic(index, path):
+    # Rename over the old file so readers that memory-mapped it are not affected
+    faiss.write_index(index, f"{path}.tmp")
+    os.replace(f"{path}.tmp", path)
+
+
+def add_questions(new_questions, emb_model, artifacts, question_store_path=None, delta_index_path=None):
+    """
+    Append new questions to the search system without rebuilding the main index.
+
+    Only the new questions are embedded. Their vectors go into the delta index
+    and their texts are appended to the question store. Other processes serving
+    the same files may have added questions since artifacts was loaded, so the
+    store and delta are read back from disk under the artifact lock, extended,
+    saved, and the manifest version is bumped so those processes reload them.
+
+    Args:
+        new_questions: List of (qid, question text) tuples
+        emb_model: SentenceTransformer model
+        artifacts: ArtifactSet currently used for search; its main index is reused
+        question_store_path: Directory of the persisted question store. If None, uses default from config.
+        delta_index_path: Path of the persisted delta index. If None, uses default from config.
+
+    Returns:
+        Tuple of (new ArtifactSet, number of questions added)
+    """
+    question_store_path = question_store_path or Config.QUESTION_STORE_PATH
+    delta_index_path = delta_index_path or Config.DELTA_INDEX_PATH
+
+    with artifact_lock():
+        index, question_store = _read_updated_artifacts(artifacts, question_store_path, delta_index_path)
+
+        # Skip questions whose clean text is already present, including repeats within the input
+        seen_texts = set()
+        qids, texts = [], []
+        for qid, question in new_questions:
+            clean_question = clean_question_text(question)
+            if clean_question in seen_texts or question_store.find_exact(clean_question) is not None:
+                continue
+            seen_texts.add(clean_question)
+            qids.append(str(qid))
+            texts.append(clean_question)
+
+        if not texts:
+            print("No new questions to add")
+            return ArtifactSet(index, question_store, read_artifact_version()), 0
+
+        print(f"Embedding {len(texts)} new questions...")
+        embeddings = embed_questions(emb_model, texts)
+
+        # Build new objects instead of modifying the live ones, so in-flight searches are unaffected
+        delta = faiss.clone_index(index.delta)
+        delta.add(embeddings)
+        new_index = TieredIndex(index.main, delta)
+        new_store = question_store.append(qids, texts)
+
+        # Store first: loading drops store rows the index has no vectors for, so a failure before
+        # the delta is written leaves the previous state
+        new_store.save(question_store_path)
+        _write_index_atomic(delta, delta_index_path)
+        version = bump_artifact_version(new_index.ntotal)
+
+    print(f"Added {len(texts)} questions; delta index now holds {delta.ntotal} vectors")
+    return ArtifactSet(new_index, new_store, version), len(texts)
+
+
+def compact_index(artifacts, faiss_index_output_path=None, delta_index_path=None, question_store_path=None):
+    """
+    Merge the delta index into the main index and persist both.
+
+    Row ids do not change, so the question store needs no update. The delta is
+    read from disk under the artifact lock, so questions added by other processes
+    are merged too, and the manifest version is bumped so they reload.
+
+    Args:
+        artifacts: ArtifactSet currently used for search
+        faiss_index_output_path: Path of the main index file. If None, uses default from config.
+        delta_index_path: Path of the delta index file. If None, uses default from config.
+        question_store_path: Directory of the persisted question store. If None, uses default from config.
+
+    Returns:
+        New ArtifactSet with an empty delta
+    """
+    faiss_index_output_path = faiss_index_output_path or Config.FAISS_INDEX_PATH
+    delta_index_path = delta_index_path or Config.DELTA_INDEX_PATH
+    question_store_path = question_store_path or Config.QUESTION_STORE_PATH
+
+    with artifact_lock():
+        index, question_store = _read_updated_artifacts(artifacts, question_store_path, delta_index_path)
+        if index.delta.ntotal == 0:
+            print("Delta index is empty, nothing to compact")
+            return ArtifactSet(index, question_store, read_artifact_version())
+
+        if isinstance(index.main, ShardedIndex):
+            raise ValueError("A sharded index cannot be compacted; rebuild it to move the delta into the shards")
+
+        # A memory-mapped index is read-only, so add to a private copy read from disk
+        main = load_faiss_index(faiss_index_output_path, mmap=False)
+        if main.ntotal != index.main.ntotal:
+            raise ValueError(f"Main index on disk has {main.ntotal} vectors, expected {index.main.ntotal}")
+
+        print(f"Merging {index.delta.ntotal} delta vectors into the main index...")
+        main.add(index.delta.reconstruct_n(0, index.delta.ntotal))
+
+        empty_delta = faiss.IndexFlatL2(main.d)
+        _write_index_atomic(main, faiss_index_output_path)
+        _write_index_atomic(empty_delta, delta_index_path)
+        version = bump_artifact_version(main.ntotal)
+
+    print(f"Compacted index holds {main.ntotal} vectors")
+    return ArtifactSet(TieredIndex(load_faiss_index(faiss_index_output_path), empty_delta), question_store, version)
+
+
+def _read_updated_artifacts(artifacts, question_store_path, delta_index_path):
+    # The store and delta on disk, which include the adds of every process, paired with the main
+    # index already loaded. Call with the artifact lock held.
+    main = artifacts.index.main
+    current = assemble_artifact_set(TieredIndex(main, read_delta_index(delta_index_path)),
+                                    QuestionStore.load(question_store_path), None)
+    index, question_store = current.index, current.question_store
+
+    # The rows of the main index must still be the questions it was loaded with
+    main_rows = main.ntotal
+    if index.ntotal != len(question_store) or \
+            question_store.texts.offsets[main_rows] != artifacts.question_store.texts.offsets[main_rows] or \
+            question_store.qids.offsets[main_rows] != artifacts.question_store.qids.offsets[main_rows]:
+        raise ValueError("The artifacts on disk were rebuilt since they were loaded; reload them before updating")
+    return index, question_store
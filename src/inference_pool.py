@@ -0,0 +1,355 @@
+import asyncio
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from multiprocessing.connection import wait
+from .config import Config
+
+# How often the result reader checks for workers that exited without closing their pipe
+WORKER_CHECK_INTERVAL_SECONDS = 1.0
+
+
+class QueueFullError(Exception):
+    """Raised when the pool already has max_queue_depth jobs queued or running"""
+
+
+class InferenceError(Exception):
+    """Raised for a job that failed inside an inference worker"""
+
+
+class _WorkerHandle:
+    """Process, pipe and job queue of one inference worker, seen from the pool"""
+
+    def __init__(self, process, connection):
+        self.process = process
+        self.connection = connection
+        self.jobs = set()  # ids of the jobs sent to this worker and not answered yet
+        self.status = {'ready': False, 'error': None, 'pid': process.pid}
+        self.cache_lookups = {}  # (cache, 'hit' or 'miss') -> count, as last reported by the worker
+        # Sends happen on a thread: a large job can fill the pipe while the worker is busy
+        self.outbox = queue.Queue()
+        self.sender = threading.Thread(target=self._send, name=f'{process.name}-sender', daemon=True)
+        self.sender.start()
+
+    def _send(self):
+        while True:
+            job = self.outbox.get()
+            try:
+                self.connection.send(job)
+            except (OSError, ValueError):
+                return
+            if job is None:
+                return
+
+
+class InferencePool:
+    """
+    Inference worker processes, each fed jobs over its own pipe.
+
+    Each worker loads its own embedding model and reranker, memory-maps the
+    index and question store (shared through the page cache) and runs jobs one
+    list at a time with its own torch threads. Jobs are submitted from an asyncio
+    event loop and complete as futures, so a waiting request holds no thread, and
+    go to the ready worker with the fewest outstanding jobs. At most
+    max_queue_depth jobs are outstanding in the workers, counting jobs whose
+    request already timed out until a worker answers them; beyond that submit
+    raises QueueFullError instead of letting the queues grow. Workers drop jobs
+    whose deadline passed while they were queued. A worker that dies fails its
+    outstanding jobs and is restarted; the other workers are unaffected.
+
+    The workers cannot share local shard workers, so a sharded index must be
+    served by shard workers listed in SHARD_ADDRESSES.
+    """
+
+    def __init__(self, num_workers=None, threads_per_worker=None, max_queue_depth=None, timeout_seconds=None,
+                 config_object=Config):
+        """
+        Args:
+            num_workers: Number of worker processes. If None, uses default from config.
+            threads_per_worker: Torch and FAISS threads per worker. If None, uses default from config,
+                or splits the CPU cores evenly between workers.
+            max_queue_depth: Maximum jobs queued or running. If None, uses default from config.
+            timeout_seconds: Time a job may take before submit gives up. If None, uses default from config.
+            config_object: Configuration class passed on to the workers
+
+        Raises:
+            ValueError: If the index is sharded and no SHARD_ADDRESSES are configured
+        """
+        if (config_object.NUM_SHARDS or 1) > 1 and not config_object.SHARD_ADDRESSES:
+            # Each worker would otherwise start its own set of NUM_SHARDS shard processes
+            raise ValueError("Async serving with NUM_SHARDS > 1 needs SHARD_ADDRESSES: start one "
+                             "scripts/shard_worker.py per shard and list them there")
+        self.num_workers = num_workers or Config.INFERENCE_WORKERS
+        self.threads_per_worker = (threads_per_worker or Config.INFERENCE_TORCH_THREADS
+                                   or max(1, (os.cpu_count() or 1) // self.num_workers))
+        self.max_queue_depth = max_queue_depth or Config.INFERENCE_MAX_QUEUE_DEPTH
+        self.timeout_seconds = timeout_seconds or Config.INFERENCE_TIMEOUT_SECONDS
+        self.config_values = {name: getattr(config_object, name) for name in dir(config_object) if name.isupper()}
+
+        # Workers load torch themselves; spawning keeps them clear of the parent's threads
+        self._context = multiprocessing.get_context('spawn')
+        self._workers = {}  # worker id -> _WorkerHandle
+        self._pending = {}  # job id -> (event loop, future, worker id)
+        self._job_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._reader = None
+        self._closed = False
+
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.restarts = 0
+        self.paths = Counter()
+        # Called from the result thread with (queries, stage timings) of each pipeline call in a worker
+        self.on_batch = None
+
+    def start(self):
+        """Start the worker processes and the thread delivering their results"""
+        print(f"Starting {self.num_workers} inference workers, {self.threads_per_worker} threads each")
+        for worker_id in range(self.num_workers):
+            self._start_worker(worker_id)
+        self._reader = threading.Thread(target=self._read_responses, name='inference-results', daemon=True)
+        self._reader.start()
+
+    def _start_worker(self, worker_id):
+        connection, worker_connection = self._context.Pipe()
+        process = self._context.Process(target=_worker_main, name=f'inference-worker-{worker_id}', daemon=True,
+                                        args=(worker_id, self.config_values, self.threads_per_worker,
+                                              worker_connection))
+        process.start()
+        worker_connection.close()
+        self._workers[worker_id] = _WorkerHandle(process, connection)
+
+    @property
+    def ready(self):
+        """True once at least one worker has loaded its models and artifacts"""
+        return any(worker.status['ready'] for worker in self._workers.values())
+
+    @property
+    def queue_depth(self):
+        """Jobs sent to the workers and not answered yet, including those whose request timed out"""
+        return sum(len(worker.jobs) for worker in self._workers.values())
+
+    async def submit(self, kind, payload, timeout_seconds=None):
+        """
+        Queue a job and wait for its result.
+
+        Args:
+            kind: 'search', 'bulk', or an update run by InferenceWorker.update
+            payload: Job arguments, see InferenceWorker.run
+            timeout_seconds: Time the job may take, queueing included. If None, uses the pool's timeout.
+
+        Returns:
+            The result computed by the worker
+
+        Raises:
+            QueueFullError: If max_queue_depth jobs are already queued or running
+            InferenceError: If the job failed in the worker
+            asyncio.TimeoutError: If no result arrived within the timeout
+        """
+        return await self._dispatch(kind, payload, timeout_seconds)
+
+    async def broadcast(self, kind, payload, timeout_seconds=None):
+        """
+        Run a job on every ready worker, e.g. to make all of them reload the artifacts.
+
+        The jobs are queued even when the queue is full, so every worker gets one.
+
+        Args:
+            kind: Job kind, see submit
+            payload: Job arguments
+            timeout_seconds: Time each job may take, queueing included. If None, uses the pool's timeout.
+
+        Returns:
+            Dictionary of worker id -> result
+
+        Raises:
+            InferenceError or asyncio.TimeoutError: Of the first worker that failed, after all have answered
+        """
+        worker_ids = [worker_id for worker_id, worker in self._workers.items() if worker.status['ready']]
+        results = await asyncio.gather(*(self._dispatch(kind, payload, timeout_seconds, worker_id)
+                                         for worker_id in worker_ids), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return dict(zip(worker_ids, results))
+
+    async def _dispatch(self, kind, payload, timeout_seconds, worker_id=None):
+        # Send a job to the given worker, or to the ready worker with the fewest outstanding jobs
+        timeout_seconds = timeout_seconds or self.timeout_seconds
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            if worker_id is None:
+                depth = self.queue_depth
+                if depth >= self.max_queue_depth:
+                    self.rejected += 1
+                    raise QueueFullError(f"{depth} inference jobs already queued")
+                ready = [(worker_id, worker) for worker_id, worker in self._workers.items()
+                         if worker.status['ready']]
+                if not ready:
+                    raise InferenceError("No inference worker is ready")
+                worker_id, worker = min(ready, key=lambda item: len(item[1].jobs))
+            else:
+                worker = self._workers[worker_id]
+            job_id = next(self._job_ids)
+            self._pending[job_id] = (loop, future, worker_id)
+            worker.jobs.add(job_id)
+
+        # Wall-clock deadline, which the worker process can compare against its own clock
+        worker.outbox.put((job_id, kind, payload, time.time() + timeout_seconds))
+        try:
+            return await asyncio.wait_for(future, timeout_seconds)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise
+        finally:
+            # A job that timed out stays in its worker's jobs, and in the queue depth, until the worker answers it
+            with self._lock:
+                self._pending.pop(job_id, None)
+
+    async def search(self, query, **options):
+        """
+        Search one query in a worker.
+
+        Args:
+            query: Query text
+            **options: Options of search_similar_questions_batch, e.g. nprobe or latency_budget_ms
+
+        Returns:
+            Tuple of (results, reranking plan, whether the response came from the shared cache)
+        """
+        results, plan, cached = await self.submit('search', {'query': query, 'options': options})
+        with self._lock:
+            self.paths['cached' if cached else plan['path']] += 1
+        return results, plan, cached
+
+    def _read_responses(self):
+        while not self._closed:
+            connections = {worker.connection: worker_id for worker_id, worker in self._workers.items()
+                           if not worker.status['error']}
+            for connection in wait(list(connections), timeout=WORKER_CHECK_INTERVAL_SECONDS):
+                worker_id = connections[connection]
+                try:
+                    message = connection.recv()
+                except (EOFError, OSError):
+                    self._worker_exited(worker_id)
+                    continue
+                self._handle_message(worker_id, *message)
+
+            for worker_id, worker in list(self._workers.items()):
+                if not worker.process.is_alive() and not worker.status['error']:
+                    self._worker_exited(worker_id)
+
+    def _handle_message(self, worker_id, job_id, status, payload):
+        worker = self._workers[worker_id]
+        if job_id is None and status == 'stats':
+            # Sent after each job list: pipeline calls and cache counters of the worker
+            worker.cache_lookups = payload['cache_lookups']
+            if self.on_batch is not None:
+                for size, timings in payload['batches']:
+                    self.on_batch(size, timings)
+            return
+        if job_id is None:
+            # Worker event: ready, failed or reloaded
+            worker.status.update({key: value for key, value in payload.items() if key != 'worker'},
+                                 ready=status != 'failed')
+            return
+
+        with self._lock:
+            entry = self._pending.get(job_id)
+            worker.jobs.discard(job_id)
+            self.completed += status == 'ok'
+            self.failed += status == 'error'
+        # Jobs that timed out have no waiting request left
+        if entry is not None:
+            loop, future, _ = entry
+            loop.call_soon_threadsafe(_resolve, future, status, payload)
+
+    def _worker_exited(self, worker_id):
+        # Fail the jobs the worker held, then restart it unless it failed to load (it would fail again)
+        worker = self._workers[worker_id]
+        worker.process.join(1)
+        worker.connection.close()
+        worker.outbox.put(None)
+        with self._lock:
+            lost = [self._pending[job_id] for job_id in worker.jobs if job_id in self._pending]
+            worker.jobs.clear()
+            self.failed += len(lost)
+        for loop, future, _ in lost:
+            loop.call_soon_threadsafe(_resolve, future, 'error', f"Inference worker {worker_id} exited")
+
+        if self._closed or worker.status['error']:
+            return
+        print(f"Inference worker {worker_id} exited with code {worker.process.exitcode}, restarting it")
+        self.restarts += 1
+        self._start_worker(worker_id)
+
+    def worker_status(self):
+        """Readiness, process id, load time, artifact version and load error of each worker"""
+        return {str(worker_id): {**worker.status, 'alive': worker.process.is_alive(), 'jobs': len(worker.jobs)}
+                for worker_id, worker in self._workers.items()}
+
+    def cache_lookups(self):
+        """Cache hits and misses summed over the workers, keyed on (cache, 'hit' or 'miss')"""
+        totals = Counter()
+        for worker in self._workers.values():
+            totals.update(worker.cache_lookups)
+        return dict(totals)
+
+    def stats(self):
+        """
+        Report queue usage and job counters.
+
+        Returns:
+            Dictionary with worker settings, queue depth and job counters
+        """
+        with self._lock:
+            return {
+                'workers': self.num_workers,
+                'threads_per_worker': self.threads_per_worker,
+                'queue_depth': self.queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'restarts': self.restarts,
+                'paths': dict(self.paths)
+            }
+
+    def close(self, timeout=10):
+        """Stop the workers after the jobs already sent to them, terminating those that do not exit in time"""
+        self._closed = True
+        for worker in self._workers.values():
+            worker.outbox.put(None)
+        deadline = time.monotonic() + timeout
+        for worker in self._workers.values():
+            worker.process.join(max(0.0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                worker.process.terminate()
+        print("Inference workers stopped")
+
+
+def _worker_main(worker_id, config_values, threads, connection):
+    # Imported in the worker only, so the front-end process never loads torch or the models
+    from .inference_worker import run_worker
+    run_worker(worker_id, config_values, threads, connection)
+
+
+def _resolve(future, status, payload):
+    if future.done():
+        return
+    if status == 'ok':
+        future.set_result(payload)
+    elif status == 'expired':
+        # Reported like a timeout of the request, which it is
+        future.set_exception(asyncio.TimeoutError(payload))
+    else:
+        future.set_exception(InferenceError(payload))
@@ -0,0 +1,265 @@
+import os
+import time
+import faiss
+import torch
+from .config import Config
+from .artifacts import artifact_version_stamp, load_artifact_set, read_artifact_version
+from .embedding import load_embedding_model, create_embedding_cache
+from .index_updates import add_questions, compact_index
+from .reranker import load_reranker, RerankCostModel, create_rerank_cache
+from .question_matcher import search_similar_questions_batch
+from .response_cache import create_response_cache, search_response_key
+from .batching import search_group_key, group_call_options, budgeted_first
+
+
+def run_worker(worker_id, config_values, threads, connection):
+    """
+    Entry point of an inference worker process started by InferencePool.
+
+    Args:
+        worker_id: Index of the worker in the pool
+        config_values: Config attributes of the parent process, which a spawned process does not inherit
+        threads: Torch and FAISS threads of this worker
+        connection: Pipe end receiving (job id, kind, payload, deadline) jobs, with None to stop, and sending
+            (job id, status, payload) results and (None, event, details) worker events
+    """
+    for name, value in config_values.items():
+        setattr(Config, name, value)
+    torch.set_num_threads(threads)
+    faiss.omp_set_num_threads(threads)
+
+    start = time.perf_counter()
+    try:
+        worker = InferenceWorker()
+    except Exception as e:
+        print(f"Inference worker {worker_id} failed to load: {e}")
+        connection.send((None, 'failed', {'worker': worker_id, 'error': str(e)}))
+        return
+
+    print(f"✓ Inference worker {worker_id} ready in {time.perf_counter() - start:.1f}s ({threads} threads)")
+    connection.send((None, 'ready', {'worker': worker_id, 'pid': os.getpid(), 'threads': threads,
+                                   'load_seconds': time.perf_counter() - start,
+                                   'artifact_version': worker.artifacts.version}))
+    worker.serve(worker_id, connection)
+
+
+class InferenceWorker:
+    """
+    Models, artifacts and caches of one inference worker process.
+
+    The worker runs one job list at a time, so it owns its models and needs no
+    locks. Searches that are already queued when it picks up a job join the same
+    pipeline call, like the micro-batches of SearchBatcher.
+    """
+
+    def __init__(self):
+        self.embedding_model = load_embedding_model()
+        self.reranker = load_reranker()
+        self.artifacts = load_artifact_set(self.embedding_model.get_sentence_embedding_dimension())
+        self.embedding_cache = create_embedding_cache()
+        self.rerank_cache = create_rerank_cache(version=self.version())
+        self.response_cache = create_response_cache()
+        self.rerank_cost_model = RerankCostModel()
+
+    def version(self):
+        """Version stamp of the reranker and artifacts, used to invalidate cached scores and responses"""
+        return artifact_version_stamp(self.artifacts)
+
+    def serve(self, worker_id, connection):
+        """
+        Run jobs from the pool until the stop sentinel arrives or the pool goes away.
+
+        Args:
+            worker_id: Index of the worker in the pool, reported with reload events
+            connection: Pipe end receiving jobs and sending results
+        """
+        watch_interval = Config.ARTIFACT_WATCH_INTERVAL_SECONDS
+        next_check = time.monotonic() + (watch_interval or 0)
+        while True:
+            if watch_interval and time.monotonic() >= next_check:
+                if self.reload_if_changed():
+                    connection.send((None, 'reloaded', {'worker': worker_id,
+                                                        'artifact_version': self.artifacts.version}))
+                next_check = time.monotonic() + watch_interval
+
+            try:
+                if not connection.poll(watch_interval):
+                    continue
+                jobs = [connection.recv()]
+                # Take the jobs that queued up while this worker was busy, without waiting for more
+                while jobs[-1] is not None and len(jobs) < Config.SEARCH_BATCH_MAX_SIZE and connection.poll():
+                    jobs.append(connection.recv())
+            except EOFError:
+                # The pool process is gone
+                jobs = [None]
+
+            stop = jobs[-1] is None
+            if stop:
+                jobs.pop()
+            for response in self.run(jobs):
+                connection.send(response)
+            if stop:
+                self.artifacts.close()
+                return
+
+    def run(self, jobs):
+        """
+        Run a list of jobs. Searches with the same options share one pipeline call, grouped like SearchBatcher.
+
+        Args:
+            jobs: List of (job id, kind, payload, deadline) tuples. A 'search' payload holds a query and
+                its options; a 'bulk' payload holds a list of queries and their search settings; 'add',
+                'compact' and 'reload' payloads hold the arguments of update() and run after the
+                searches. Jobs still queued at their deadline (a time.time() value) are dropped, as
+                nobody waits for them.
+
+        Returns:
+            List of (None, event, details) worker events, 'reloaded' after an update and 'stats' with the
+            size and stage timings of each pipeline call and the cache counters of this worker, followed by
+            (job id, 'ok', 'error' or 'expired', result or error message) tuples
+        """
+        outputs = []
+        batches = []
+        searches = {}
+        updates = []
+        version = self.version()
+        for job_id, kind, payload, deadline in jobs:
+            try:
+                if time.time() > deadline:
+                    outputs.append((job_id, 'expired', 'Job expired before a worker picked it up'))
+                    continue
+                if kind == 'bulk':
+                    outputs.append((job_id, 'ok', self.bulk_search(**payload)))
+                    continue
+                if kind in ('add', 'compact', 'reload'):
+                    # Run after the searches, which were keyed on the current version
+                    updates.append((job_id, kind, payload))
+                    continue
+                if kind != 'search':
+                    raise ValueError(f"Unknown job kind: {kind}")
+
+                key = None
+                if self.response_cache is not None:
+                    key = search_response_key(payload['query'], version, **payload['options'])
+                    cached = self.response_cache.get(key)
+                    if cached is not None:
+                        outputs.append((job_id, 'ok', (cached['results'], cached['rerank'], True)))
+                        continue
+                searches.setdefault(search_group_key(payload['options']), []).append(
+                    (job_id, payload['query'], key, payload['options']))
+            except Exception as e:
+                outputs.append((job_id, 'error', str(e)))
+
+        for _, group in budgeted_first(searches):
+            timings = {}
+            try:
+                results = self.search([query for _, query, _, _ in group], timings=timings,
+                                      **group_call_options([options for _, _, _, options in group]))
+            except Exception as e:
+                print(f"Inference error: {e}")
+                outputs.extend((job_id, 'error', str(e)) for job_id, _, _, _ in group)
+                continue
+            batches.append((len(group), timings))
+            for (job_id, _, key, _), (query_results, plan) in zip(group, results):
+                # Responses cut short by a latency budget are not stored, so a cached response is always complete
+                if key is not None and plan['path'] != 'budget':
+                    self.response_cache.put(key, {'results': query_results, 'rerank': plan})
+                outputs.append((job_id, 'ok', (query_results, plan, False)))
+
+        events = []
+        for job_id, kind, payload in updates:
+            try:
+                outputs.append((job_id, 'ok', self.update(kind, **payload)))
+            except Exception as e:
+                print(f"Artifact update failed: {e}")
+                outputs.append((job_id, 'error', str(e)))
+            events.append((None, 'reloaded', {'artifact_version': self.artifacts.version}))
+
+        events.append((None, 'stats', {'batches': batches, 'cache_lookups': self.cache_lookups()}))
+        # Events first, so the pool's view of this worker is current once a result is delivered
+        return events + outputs
+
+    def update(self, kind, questions=None, force=False):
+        """
+        Add questions, compact the delta index or reload the artifacts, as the Flask admin endpoints do.
+
+        Args:
+            kind: 'add', 'compact' or 'reload'
+            questions: List of (qid, question text) pairs to add
+            force: Reload even if the manifest version is the one already loaded
+
+        Returns:
+            Dictionary with the number of questions added or merged and the loaded artifacts
+        """
+        result = {}
+        if kind == 'add':
+            self.artifacts, result['added'] = add_questions([tuple(question) for question in questions],
+                                                            self.embedding_model, self.artifacts)
+        elif kind == 'compact':
+            previous_main = self.artifacts.index.main.ntotal
+            self.artifacts = compact_index(self.artifacts)
+            result['merged'] = self.artifacts.index.main.ntotal - previous_main
+        elif force or read_artifact_version() != self.artifacts.version:
+            self.reload()
+        if self.rerank_cache is not None:
+            self.rerank_cache.set_version(self.version())
+        return {**result, 'artifacts': self.artifacts.describe()}
+
+    def cache_lookups(self):
+        """Hit and miss counts of this worker's caches, keyed on (cache, 'hit' or 'miss')"""
+        lookups = {}
+        for name, cache in (('embedding', self.embedding_cache), ('rerank', self.rerank_cache),
+                            ('response', self.response_cache)):
+            if cache is not None:
+                # The response cache's stats() also queries the database; its counters are attributes
+                stats = cache.stats() if name != 'response' else {'hits': cache.hits, 'misses': cache.misses}
+                lookups[(name, 'hit')] = stats['hits']
+                lookups[(name, 'miss')] = stats['misses']
+        return lookups
+
+    def search(self, query_texts, **options):
+        """Search with the caches and cost model of this worker; returns (results, reranking plan) per query"""
+        return search_similar_questions_batch(
+            query_texts,
+            self.embedding_model,
+            self.artifacts.index,
+            self.artifacts.question_store,
+            self.reranker,
+            embedding_cache=self.embedding_cache,
+            rerank_cost_model=self.rerank_cost_model,
+            rerank_cache=self.rerank_cache,
+            return_rerank_info=True,
+            **options
+        )
+
+    def bulk_search(self, queries, k_candidates=None, k_final=None, nprobe=None, ef_search=None):
+        """Search a chunk of a bulk request; bulk jobs bypass the caches so they do not evict hot entries"""
+        return search_similar_questions_batch(queries, self.embedding_model, self.artifacts.index,
+                                              self.artifacts.question_store, self.reranker,
+                                              k_candidates, k_final, nprobe, ef_search)
+
+    def reload_if_changed(self):
+        """
+        Swap in the artifacts on disk when the manifest has a new version.
+
+        Returns:
+            True if new artifacts were loaded; a failed load keeps the current ones
+        """
+        try:
+            if not os.path.exists(Config.ARTIFACT_MANIFEST_PATH) or read_artifact_version() == self.artifacts.version:
+                return False
+            self.reload()
+        except Exception as e:
+            print(f"Artifact reload failed, keeping the current artifacts: {e}")
+            return False
+        return True
+
+    def reload(self):
+        """Load the artifacts on disk and swap them in; a failed load raises and keeps the current ones"""
+        artifacts = load_artifact_set(self.embedding_model.get_sentence_embedding_dimension())
+        # Jobs run one list at a time in this process, so none is using the previous set
+        previous, self.artifacts = self.artifacts, artifacts
+        previous.close()
+        if self.rerank_cache is not None:
+            self.rerank_cache.set_version(self.version())
+        print(f"✓ Artifact version {artifacts.version} loaded ({artifacts.index.ntotal} vectors)")
@@ -0,0 +1,199 @@
+import os
+import numpy as np
+import faiss
+from .config import Config
+
+EMBEDDING_DTYPES = ('float32', 'float16', 'int8')
+
+
+def _scale_path(embedding_path):
+    root, _ = os.path.splitext(embedding_path)
+    return f"{root}_scale.npy"
+
+
+def compute_int8_scale(embeddings, chunk_size=None):
+    """
+    Compute symmetric per-dimension int8 scales, reading the embeddings in chunks.
+
+    Args:
+        embeddings: Float32 array of embeddings (may be memory-mapped)
+        chunk_size: Number of rows read at a time. If None, uses default from config.
+
+    Returns:
+        Float32 array with one scale per dimension (value = code * scale)
+    """
+    chunk_size = chunk_size or Config.BUILD_CHUNK_SIZE
+    max_abs = np.zeros(embeddings.shape[1], dtype=np.float32)
+    for start in range(0, len(embeddings), chunk_size):
+        np.maximum(max_abs, np.abs(embeddings[start:start + chunk_size]).max(axis=0), out=max_abs)
+    return np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+
+
+def quantize_embeddings(embeddings, dtype, scale=None):
+    """
+    Convert float32 embeddings to the storage dtype.
+
+    Args:
+        embeddings: Float32 array of embeddings
+        dtype: One of EMBEDDING_DTYPES
+        scale: Per-dimension int8 scale from compute_int8_scale (int8 only)
+
+    Returns:
+        Array in the storage dtype
+    """
+    if dtype == 'float32':
+        return np.asarray(embeddings, dtype=np.float32)
+    if dtype == 'float16':
+        return np.asarray(embeddings, dtype=np.float16)
+    if dtype == 'int8':
+        return np.clip(np.rint(embeddings / scale), -127, 127).astype(np.int8)
+    raise ValueError(f"Unknown embedding dtype '{dtype}'. Expected one of: {', '.join(EMBEDDING_DTYPES)}")
+
+
+def dequantize_embeddings(stored, scale=None):
+    """
+    Convert stored embeddings back to float32.
+
+    Args:
+        stored: Array in a storage dtype
+        scale: Per-dimension int8 scale (int8 only)
+
+    Returns:
+        Float32 array
+    """
+    if stored.dtype == np.int8:
+        return stored.astype(np.float32) * scale
+    return np.asarray(stored, dtype=np.float32)
+
+
+def compress_embeddings_file(embedding_path=None, dtype=None, chunk_size=None):
+    """
+    Rewrite a float32 embeddings .npy file in a compressed dtype, in chunks.
+
+    The int8 scales are saved next to the file as <name>_scale.npy.
+
+    Args:
+        embedding_path: Path of the float32 .npy file. If None, uses default from config.
+        dtype: Storage dtype. If None, uses default from config.
+        chunk_size: Number of rows converted at a time. If None, uses default from config.
+    """
+    embedding_path = embedding_path or Config.EMBEDDINGS_PATH
+    dtype = dtype or Config.EMBEDDINGS_DTYPE
+    chunk_size = chunk_size or Config.BUILD_CHUNK_SIZE
+    if dtype == 'float32':
+        return
+
+    source = np.load(embedding_path, mmap_mode='r')
+    scale = compute_int8_scale(source, chunk_size) if dtype == 'int8' else None
+
+    compressed = np.lib.format.open_memmap(f"{embedding_path}.tmp", mode='w+', dtype=dtype, shape=source.shape)
+    for start in range(0, len(source), chunk_size):
+        compressed[start:start + chunk_size] = quantize_embeddings(source[start:start + chunk_size], dtype, scale)
+    compressed.flush()
+    del compressed, source
+
+    if scale is not None:
+        np.save(_scale_path(embedding_path), scale)
+    os.replace(f"{embedding_path}.tmp", embedding_path)
+    print(f"Embeddings stored as {dtype} in {embedding_path}")
+
+
+def load_embeddings(embedding_path=None, mmap=True):
+    """
+    Load an embeddings file written by the build, in whatever dtype it is stored.
+
+    Args:
+        embedding_path: Path of the .npy file. If None, uses default from config.
+        mmap: Memory-map the file
+
+    Returns:
+        Tuple of (stored array, int8 scale or None); use dequantize_embeddings on row slices
+    """
+    embedding_path = embedding_path or Config.EMBEDDINGS_PATH
+    stored = np.load(embedding_path, mmap_mode='r' if mmap else None)
+    scale = np.load(_scale_path(embedding_path)) if stored.dtype == np.int8 else None
+    return stored, scale
+
+
+def exact_search(embeddings, queries, k, chunk_size=None, scale=None):
+    """
+    Exact L2 search over embeddings read in chunks, for ground truth on large corpora.
+
+    Args:
+        embeddings: Stored embeddings (float32, float16 or int8; may be memory-mapped)
+        queries: Float32 query matrix
+        k: Number of neighbours per query
+        chunk_size: Number of rows searched at a time. If None, uses default from config.
+        scale: Per-dimension int8 scale (int8 embeddings only)
+
+    Returns:
+        Tuple of (distances, indices)
+    """
+    chunk_size = chunk_size or Config.BUILD_CHUNK_SIZE
+    heap = faiss.ResultHeap(len(queries), k)
+    for start in range(0, len(embeddings), chunk_size):
+        chunk = dequantize_embeddings(embeddings[start:start + chunk_size], scale)
+        distances, indices = faiss.knn(queries, chunk, min(k, len(chunk)))
+        heap.add_result(distances, np.where(indices >= 0, indices + start, -1))
+    heap.finalize()
+    return heap.D, heap.I
+
+
+def recall_at_k(true_indices, found_indices, k):
+    """Share of the true top-k neighbours found in the top-k results, averaged over queries"""
+    hits = [len(set(true_row[:k]) & set(found_row[:k])) for true_row, found_row in zip(true_indices, found_indices)]
+    return float(np.mean(hits)) / k
+
+
+def report_compression(float32_embeddings, index, index_path=None, embedding_path=None, k=10, num_queries=1000):
+    """
+    Report memory saved and recall@k lost by compressed index and embedding storage.
+
+    Recall is measured against exact search over the float32 embeddings, using a
+    random sample of corpus vectors as queries.
+
+    Args:
+        float32_embeddings: Float32 embeddings the index was built from (may be memory-mapped)
+        index: FAISS index built from them
+        index_path: Path of the saved index, used for its size on disk
+        embedding_path: Path of the saved (possibly compressed) embeddings file
+        k: Number of neighbours for recall@k
+        num_queries: Number of sampled queries
+
+    Returns:
+        Dictionary with sizes in bytes and recall values
+    """
+    rng = np.random.default_rng(42)
+    sample = np.sort(rng.choice(len(float32_embeddings), size=min(num_queries, len(float32_embeddings)),
+                                replace=False))
+    queries = np.ascontiguousarray(float32_embeddings[sample], dtype=np.float32)
+    k = min(k, len(float32_embeddings))
+
+    _, true_indices = exact_search(float32_embeddings, queries, k)
+    _, index_indices = index.search(queries, k)
+
+    float32_bytes = float32_embeddings.shape[0] * float32_embeddings.shape[1] * 4
+    report = {
+        'float32_bytes': float32_bytes,
+        'index_bytes': os.path.getsize(index_path) if index_path else None,
+        'index_recall_at_k': recall_at_k(true_indices, index_indices, k),
+        'k': k
+    }
+
+    if embedding_path and os.path.exists(embedding_path):
+        stored, scale = load_embeddings(embedding_path)
+        report['embeddings_dtype'] = str(stored.dtype)
+        report['embeddings_bytes'] = stored.nbytes
+        _, stored_indices = exact_search(stored, queries, k, scale=scale)
+        report['embeddings_recall_at_k'] = recall_at_k(true_indices, stored_indices, k)
+
+    print(f"Float32 vectors: {float32_bytes / 1024 ** 2:.1f} MB")
+    if report['index_bytes'] is not None:
+        print(f"Index on disk: {report['index_bytes'] / 1024 ** 2:.1f} MB "
+              f"({1 - report['index_bytes'] / float32_bytes:.0%} saved)")
+    print(f"Index recall@{k} vs exact float32 search: {report['index_recall_at_k']:.4f}")
+    if 'embeddings_bytes' in report:
+        print(f"Embeddings file ({report['embeddings_dtype']}): {report['embeddings_bytes'] / 1024 ** 2:.1f} MB "
+              f"({1 - report['embeddings_bytes'] / float32_bytes:.0%} saved), "
+              f"recall@{k}: {report['embeddings_recall_at_k']:.4f}")
+    return report
@@ -1,10 +1,15 @@
+import numpy as np
 from .config import Config
-from .faiss_index_search import search_faiss
-from .reranker import rerank_candidates
+from .faiss_index_search import search_faiss_batch
+from .reranker import rerank_candidates_batch, plan_reranking, apply_rerank_budget
+from .metrics import timed
+from .utils import clean_question_texts
 
 
-def search_similar_questions(query_text, emb_model, index, questions_df, reranker,
-                             k_candidates=None, k_final=None):
+def search_similar_questions(query_text, emb_model, index, question_store, reranker,
+                             k_candidates=None, k_final=None, nprobe=None, ef_search=None,
+                             embedding_cache=None, latency_budget_ms=None, rerank_cost_model=None,
+                             rerank_cache=None):
     """
     Search for questions similar to the input query.
 
@@ -12,32 +17,209 @@ def search_similar_questions(query_text, emb_model, index, questions_df, reranke
         query_text: Query text
         emb_model: SentenceTransformer model
         index: FAISS index
-        questions_df: DataFrame with questions
+        question_store: QuestionStore with the corpus questions
         reranker: CrossEncoder model
         k_candidates: Number of candidates to retrieve from FAISS
         k_final: Number of final results to return after reranking
+        nprobe: Number of inverted lists to visit (IVF indexes only)
+        ef_search: HNSW search depth (HNSW indexes only)
+        embedding_cache: Optional LRUCache of query embeddings
+        latency_budget_ms: Optional reranking time budget, capping how many candidates are reranked
+        rerank_cost_model: Optional RerankCostModel estimating the reranker time per pair
+        rerank_cache: Optional RerankScoreCache of query-candidate scores
 
     Returns:
         List of dictionaries with similar questions and metadata
     """
-    k_candidates = k_candidates or Config.DEFAULT_CANDIDATES
+    return search_similar_questions_batch([query_text], emb_model, index, question_store, reranker,
+                                          k_candidates, k_final, nprobe, ef_search, embedding_cache,
+                                          latency_budget_ms, rerank_cost_model, rerank_cache)[0]
+
+
+def search_similar_questions_batch(query_texts, emb_model, index, question_store, reranker,
+                                   k_candidates=None, k_final=None, nprobe=None, ef_search=None,
+                                   embedding_cache=None, latency_budget_ms=None, rerank_cost_model=None,
+                                   rerank_cache=None, return_rerank_info=False, exact_match=None,
+                                   fill_exact=None, timings=None, rerank=True, rerank_thresholds=None,
+                                   exclude_rows=None):
+    """
+    Search for questions similar to each of several queries.
+
+    All queries share one encode call, one FAISS search and one reranker call.
+    Each query reranks only the candidates chosen by plan_reranking. Queries whose
+    clean text is in the corpus are answered from the question store's hash index
+    without running the pipeline, unless fill_exact asks for the remaining results.
+
+    Args:
+        query_texts: List of query texts
+        emb_model: SentenceTransformer model
+        index: FAISS index
+        question_store: QuestionStore with the corpus questions
+        reranker: CrossEncoder model
+        k_candidates: Number of candidates to retrieve from FAISS per query
+        k_final: Number of final results to return per query after reranking
+        nprobe: Number of inverted lists to visit (IVF indexes only)
+        ef_search: HNSW search depth (HNSW indexes only)
+        embedding_cache: Optional LRUCache of query embeddings
+        latency_budget_ms: Optional time budget of the batch's single reranker call, shared by all queries
+        rerank_cost_model: Optional RerankCostModel estimating the reranker time per pair
+        rerank_cache: Optional RerankScoreCache of query-candidate scores
+        return_rerank_info: Also return the reranking plan of each query
+        exact_match: Answer exact corpus matches directly. If None, uses default from config.
+        fill_exact: Fill the results after an exact match through the pipeline. If None, uses default from config.
+        timings: Optional dictionary collecting seconds spent per stage (clean, exact_lookup,
+            encode, faiss, lookup, rerank) over the whole batch
+        rerank: Run the cross-encoder. If False, candidates are returned in FAISS order.
+        rerank_thresholds: Tuple of (skip gap, distance margin) for plan_reranking. If None, uses config.
+        exclude_rows: Optional question store row per query to leave out of its candidates, e.g. the
+            query's own row when corpus questions are used as queries. k_candidates others are kept.
+
+    Returns:
+        List of result lists, one per query, in the order of query_texts. With
+        return_rerank_info, a list of (results, reranking plan) tuples instead.
+    """
     k_final = k_final or Config.DEFAULT_RESULTS
+    exact_match = Config.EXACT_MATCH_ENABLED if exact_match is None else exact_match
+    fill_exact = Config.EXACT_MATCH_FILL_RESULTS if fill_exact is None else fill_exact
+
+    # Step 0: Look up exact matches of the clean query text
+    exact_rows = [None] * len(query_texts)
+    if exact_match:
+        with timed(timings, 'clean'):
+            clean_queries = clean_question_texts(query_texts)
+        with timed(timings, 'exact_lookup'):
+            exact_rows = [question_store.find_exact(clean_query) for clean_query in clean_queries]
+    pipeline_positions = [i for i, row in enumerate(exact_rows) if row is None or fill_exact]
+
+    pipeline_outputs = []
+    if pipeline_positions:
+        pipeline_outputs = _search_pipeline([query_texts[i] for i in pipeline_positions], emb_model, index,
+                                            question_store, reranker, k_candidates, k_final, nprobe, ef_search,
+                                            embedding_cache, latency_budget_ms, rerank_cost_model, rerank_cache,
+                                            timings, rerank, rerank_thresholds,
+                                            None if exclude_rows is None
+                                            else [exclude_rows[i] for i in pipeline_positions])
+    outputs = dict(zip(pipeline_positions, pipeline_outputs))
+
+    combined = []
+    for i, row in enumerate(exact_rows):
+        if row is None:
+            results, plan = outputs[i]
+        else:
+            exact = _exact_match_result(question_store, row)
+            if i in outputs:
+                results, plan = outputs[i]
+                results = [exact] + [result for result in results
+                                     if result['clean_question'] != exact['clean_question']][:k_final - 1]
+                for rank, result in enumerate(results):
+                    result['rank'] = rank + 1
+            else:
+                results, plan = [exact], {'path': 'exact', 'reranked': 0, 'candidates': 0}
+        combined.append((results, {**plan, 'exact_match': row is not None}))
+
+    if return_rerank_info:
+        return combined
+    return [results for results, _ in combined]
+
 
-    # Step 1: Get candidates from FAISS
-    distances, indices = search_faiss(query_text, emb_model, index, k_candidates)
+def _exact_match_result(question_store, row):
+    qids, texts = question_store.lookup([row])
+    return {
+        'question_id': qids[0],
+        'clean_question': texts[0],
+        'faiss_rank': None,
+        'faiss_distance': 0.0,
+        'rerank_score': None,
+        'similarity_percentage': "100.0%",
+        'rank': 1,
+        'exact_match': True
+    }
+
+
+def _search_pipeline(query_texts, emb_model, index, question_store, reranker, k_candidates, k_final,
+                     nprobe, ef_search, embedding_cache, latency_budget_ms, rerank_cost_model, rerank_cache,
+                     timings, rerank, rerank_thresholds, exclude_rows):
+    # Embed, search the index and rerank; returns (results, reranking plan) per query
+    k_candidates = k_candidates or Config.DEFAULT_CANDIDATES
+
+    # Step 1: Get candidates from FAISS, one extra when a row per query is excluded
+    distances, indices = search_faiss_batch(query_texts, emb_model, index,
+                                            k_candidates + (exclude_rows is not None),
+                                            nprobe=nprobe, ef_search=ef_search,
+                                            embedding_cache=embedding_cache, timings=timings)
 
     # Step 2: Prepare candidates for reranking
-    candidates = []
-    for i, (distance, idx) in enumerate(zip(distances[0], indices[0])):
-        candidates.append({
-            'question_id': questions_df.iloc[idx]['qid'],
-            'clean_question': questions_df.iloc[idx]['clean_question'],
-            'faiss_rank': i + 1,
-            'faiss_distance': float(distance)
-        })
-
-    # Step 3: Rerank candidates
-    reranked_results = rerank_candidates(query_text, candidates, reranker)
+    # Approximate indexes pad with -1 when fewer than k_candidates are found
+    with timed(timings, 'lookup'):
+        valid = indices >= 0
+        if exclude_rows is not None:
+            valid &= indices != np.asarray(exclude_rows).reshape(-1, 1)
+            valid &= np.cumsum(valid, axis=1) <= k_candidates
+        qids, texts = question_store.lookup(indices[valid])
+
+    candidates_lists = []
+    offset = 0
+    for query_distances, query_valid in zip(distances, valid):
+        candidates = []
+        for faiss_rank in np.flatnonzero(query_valid).tolist():
+            candidates.append({
+                'question_id': qids[offset],
+                'clean_question': texts[offset],
+                'faiss_rank': faiss_rank + 1,
+                'faiss_distance': float(query_distances[faiss_rank]),
+                'exact_match': False
+            })
+            offset += 1
+        candidates_lists.append(candidates)
+
+    # Step 3: Rerank candidates, skipping or shrinking where FAISS is decisive or the budget is short
+    with timed(timings, 'rerank'):
+        if rerank:
+            plans = apply_rerank_budget([plan_reranking(candidates, k_final, rerank_thresholds)
+                                         for candidates in candidates_lists],
+                                        latency_budget_ms, rerank_cost_model)
+        else:
+            plans = [{'path': 'disabled', 'reranked': 0, 'candidates': len(candidates)}
+                     for candidates in candidates_lists]
+        reranked_lists = rerank_candidates_batch(query_texts, candidates_lists, reranker,
+                                                 rerank_counts=[plan['reranked'] for plan in plans],
+                                                 cost_model=rerank_cost_model,
+                                                 score_cache=rerank_cache)
 
     # Step 4: Return top k_final results
-    return reranked_results[:k_final]
+    return [(reranked[:k_final], plan) for reranked, plan in zip(reranked_lists, plans)]
+
+
+def iter_similar_questions_batches(query_texts, emb_model, index, question_store, reranker,
+                                   k_candidates=None, k_final=None, nprobe=None, ef_search=None,
+                                   embedding_cache=None, chunk_size=None, timings=None):
+    """
+    Search for similar questions for a large list of queries, one chunk at a time.
+
+    Each chunk runs through the batched pipeline, so results can be consumed
+    (for example streamed to a client) before the whole input is processed.
+
+    Args:
+        query_texts: List of query texts
+        emb_model: SentenceTransformer model
+        index: FAISS index
+        question_store: QuestionStore with the corpus questions
+        reranker: CrossEncoder model
+        k_candidates: Number of candidates to retrieve from FAISS per query
+        k_final: Number of final results to return per query after reranking
+        nprobe: Number of inverted lists to visit (IVF indexes only)
+        ef_search: HNSW search depth (HNSW indexes only)
+        embedding_cache: Optional LRUCache of query embeddings
+        chunk_size: Number of queries per chunk. If None, uses default from config.
+        timings: Optional dictionary collecting seconds spent per stage over all chunks
+
+    Yields:
+        Tuple of (offset of the chunk in query_texts, list of result lists for the chunk)
+    """
+    chunk_size = chunk_size or Config.BULK_CHUNK_SIZE
+
+    for start in range(0, len(query_texts), chunk_size):
+        chunk = query_texts[start:start + chunk_size]
+        yield start, search_similar_questions_batch(chunk, emb_model, index, question_store, reranker,
+                                                    k_candidates, k_final, nprobe, ef_search,
+                                                    embedding_cache, timings=timings)
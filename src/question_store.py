@@ -0,0 +1,471 @@
+import hashlib
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+from .config import Config
+
+# Array files making up a saved question store directory
+STORE_FILES = ('qid_offsets', 'qid_blob', 'text_offsets', 'text_blob')
+
+# Exact-match hash index files; stores saved without them rebuild the index on load
+HASH_INDEX_FILES = ('text_hashes', 'text_hash_rows')
+
+# Names the generation directory holding the current files. Stores saved before generations
+# existed keep their files directly in the store directory and have no pointer file.
+CURRENT_FILE = 'CURRENT'
+GENERATION_PREFIX = 'gen-'
+
+
+def _generation_path(store_path):
+    # Directory holding the files of the current generation
+    pointer = os.path.join(store_path, CURRENT_FILE)
+    if not os.path.exists(pointer):
+        return store_path
+    with open(pointer) as f:
+        return os.path.join(store_path, f.read().strip())
+
+
+def _new_generation(store_path):
+    # Create an empty generation directory and return its name
+    generation = f"{GENERATION_PREFIX}{time.time_ns()}"
+    os.makedirs(os.path.join(store_path, generation))
+    return generation
+
+
+def _switch_generation(store_path, generation):
+    """
+    Point readers at a fully written generation and delete superseded ones.
+
+    A single rename of the CURRENT pointer file switches readers, so a reader never
+    sees files of two different saves. Processes that memory-mapped an older
+    generation keep reading it; generations before the previous one are deleted.
+
+    Args:
+        store_path: Store directory
+        generation: Name of the generation directory inside store_path
+    """
+    pointer = os.path.join(store_path, CURRENT_FILE)
+    previous = os.path.basename(_generation_path(store_path)) if os.path.exists(pointer) else None
+    with open(f"{pointer}.tmp", 'w') as f:
+        f.write(generation)
+    os.replace(f"{pointer}.tmp", pointer)
+
+    # Keep the previous generation for readers that resolved it just before the switch
+    for entry in os.listdir(store_path):
+        if entry.startswith(GENERATION_PREFIX) and entry not in (generation, previous):
+            shutil.rmtree(os.path.join(store_path, entry), ignore_errors=True)
+        elif previous is not None and entry.endswith('.npy'):
+            # Files of the flat layout, superseded one save ago
+            os.remove(os.path.join(store_path, entry))
+
+
+def _hash_bytes(data):
+    # Stable across processes, unlike hash() on str
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+
+class StringColumn:
+    """
+    Immutable column of strings stored as one UTF-8 byte blob plus offsets.
+
+    String i occupies blob[offsets[i]:offsets[i + 1]]. Compared to a column of
+    Python string objects this needs no per-string object header and is read
+    with a single gather over the offsets array.
+    """
+
+    def __init__(self, offsets, blob):
+        """
+        Args:
+            offsets: Int64 array of length n + 1 with the start of each string in the blob
+            blob: Uint8 array holding the concatenated UTF-8 bytes
+        """
+        self.offsets = offsets
+        self.blob = blob
+
+    @classmethod
+    def from_strings(cls, strings):
+        """
+        Build a column from an iterable of strings.
+
+        Args:
+            strings: Iterable of strings
+
+        Returns:
+            StringColumn
+        """
+        encoded = [str(s).encode('utf-8') for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(offsets, blob)
+
+    def concat(self, other):
+        """
+        Create a new column with the strings of other added after this column's strings.
+
+        Args:
+            other: StringColumn
+
+        Returns:
+            New StringColumn
+        """
+        offsets = np.concatenate([self.offsets, other.offsets[1:] + self.offsets[-1]])
+        return StringColumn(offsets, np.concatenate([self.blob, other.blob]))
+
+    def take(self, indices):
+        """
+        Gather strings by position.
+
+        Args:
+            indices: Sequence or array of row positions
+
+        Returns:
+            List of strings
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        starts = self.offsets[indices]
+        ends = self.offsets[indices + 1]
+        blob = self.blob
+        return [blob[start:end].tobytes().decode('utf-8') for start, end in zip(starts.tolist(), ends.tolist())]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.take(np.arange(len(self))[i])
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def iter_bytes(self):
+        """Iterate over the UTF-8 encoded strings without decoding them"""
+        blob = self.blob
+        offsets = self.offsets.tolist()
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield blob[start:end].tobytes()
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.blob.nbytes
+
+
+class TextHashIndex:
+    """
+    Exact-match lookup from clean question text to row id.
+
+    Holds sorted 64-bit hashes of the texts with their row ids, so a lookup is a
+    binary search. Hash collisions are resolved by comparing the stored text.
+    """
+
+    def __init__(self, hashes, rows):
+        """
+        Args:
+            hashes: Sorted uint64 array of text hashes
+            rows: Int64 array with the row id of each hash
+        """
+        self.hashes = hashes
+        self.rows = rows
+
+    @classmethod
+    def from_column(cls, texts, start_row=0):
+        """
+        Build an index over a StringColumn of clean texts.
+
+        Args:
+            texts: StringColumn
+            start_row: Row id of the first text
+
+        Returns:
+            TextHashIndex
+        """
+        hashes = np.fromiter((_hash_bytes(data) for data in texts.iter_bytes()), dtype=np.uint64, count=len(texts))
+        # Stable sort keeps the first row of repeated texts first
+        order = np.argsort(hashes, kind='stable')
+        return cls(hashes[order], order.astype(np.int64) + start_row)
+
+    def merge(self, other):
+        """
+        Create a new index holding the entries of both indexes.
+
+        Args:
+            other: TextHashIndex with rows after this index's rows
+
+        Returns:
+            New TextHashIndex
+        """
+        hashes = np.concatenate([self.hashes, other.hashes])
+        rows = np.concatenate([self.rows, other.rows])
+        order = np.argsort(hashes, kind='stable')
+        return TextHashIndex(hashes[order], rows[order])
+
+    def candidate_rows(self, text):
+        """
+        Row ids whose text hash equals the hash of text.
+
+        Args:
+            text: Clean question text
+
+        Returns:
+            Int64 array of row ids
+        """
+        text_hash = np.uint64(_hash_bytes(text.encode('utf-8')))
+        start = np.searchsorted(self.hashes, text_hash, side='left')
+        end = np.searchsorted(self.hashes, text_hash, side='right')
+        return self.rows[start:end]
+
+    @property
+    def nbytes(self):
+        return self.hashes.nbytes + self.rows.nbytes
+
+
+class QuestionStore:
+    """
+    Compact, read-only lookup of corpus questions by index row id.
+
+    Row i holds the question whose embedding is vector i in the FAISS index.
+    """
+
+    def __init__(self, qids, texts, text_index=None):
+        """
+        Args:
+            qids: StringColumn of question ids
+            texts: StringColumn of clean question texts
+            text_index: TextHashIndex over texts. If None, it is built from texts.
+        """
+        if len(qids) != len(texts):
+            raise ValueError(f"Question store columns differ in length: {len(qids)} ids, {len(texts)} texts")
+        self.qids = qids
+        self.texts = texts
+        self.text_index = text_index if text_index is not None else TextHashIndex.from_column(texts)
+
+    @classmethod
+    def from_dataframe(cls, questions_df):
+        """
+        Build a store from a questions DataFrame with 'qid' and 'clean_question' columns.
+
+        Args:
+            questions_df: DataFrame with questions
+
+        Returns:
+            QuestionStore
+        """
+        return cls(StringColumn.from_strings(questions_df['qid'].tolist()),
+                   StringColumn.from_strings(questions_df['clean_question'].tolist()))
+
+    def save(self, store_path=None):
+        """
+        Save the store as raw .npy arrays that can be memory-mapped on load.
+
+        The arrays go into a new generation directory, which becomes current
+        once every file is written (see _switch_generation).
+
+        Args:
+            store_path: Directory to write to. If None, uses default from config.
+        """
+        store_path = store_path or Config.QUESTION_STORE_PATH
+        generation = _new_generation(store_path)
+        generation_path = os.path.join(store_path, generation)
+
+        arrays = {
+            'qid_offsets': self.qids.offsets,
+            'qid_blob': self.qids.blob,
+            'text_offsets': self.texts.offsets,
+            'text_blob': self.texts.blob,
+            'text_hashes': self.text_index.hashes,
+            'text_hash_rows': self.text_index.rows
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(generation_path, f"{name}.npy"), np.ascontiguousarray(array))
+
+        _switch_generation(store_path, generation)
+
+    @classmethod
+    def load(cls, store_path=None, mmap=None):
+        """
+        Load a store saved with save().
+
+        With mmap the arrays stay in the OS page cache and are shared by every
+        process that maps the same files instead of being copied per process.
+
+        Args:
+            store_path: Directory to read from. If None, uses default from config.
+            mmap: Memory-map the arrays read-only. If None, uses default from config.
+
+        Returns:
+            QuestionStore
+        """
+        store_path = _generation_path(store_path or Config.QUESTION_STORE_PATH)
+        mmap = Config.MMAP_ARTIFACTS if mmap is None else mmap
+        names = STORE_FILES
+        if all(os.path.exists(os.path.join(store_path, f"{name}.npy")) for name in HASH_INDEX_FILES):
+            names += HASH_INDEX_FILES
+        arrays = {name: np.load(os.path.join(store_path, f"{name}.npy"), mmap_mode='r' if mmap else None)
+                  for name in names}
+        text_index = None
+        if 'text_hashes' in arrays:
+            text_index = TextHashIndex(arrays['text_hashes'], arrays['text_hash_rows'])
+        return cls(StringColumn(arrays['qid_offsets'], arrays['qid_blob']),
+                   StringColumn(arrays['text_offsets'], arrays['text_blob']),
+                   text_index)
+
+    @staticmethod
+    def exists(store_path=None):
+        """Check whether a saved store is present at store_path"""
+        store_path = _generation_path(store_path or Config.QUESTION_STORE_PATH)
+        return all(os.path.exists(os.path.join(store_path, f"{name}.npy")) for name in STORE_FILES)
+
+    def append(self, qids, texts):
+        """
+        Create a new store with extra questions added after the existing rows.
+
+        Args:
+            qids: List of question ids
+            texts: List of clean question texts
+
+        Returns:
+            New QuestionStore; row ids of existing questions are unchanged
+        """
+        new_texts = StringColumn.from_strings(texts)
+        return QuestionStore(self.qids.concat(StringColumn.from_strings(qids)),
+                             self.texts.concat(new_texts),
+                             self.text_index.merge(TextHashIndex.from_column(new_texts, start_row=len(self))))
+
+    def head(self, num_rows):
+        """
+        Create a store with only the first rows, e.g. to drop the rows of an add that did not finish.
+
+        Args:
+            num_rows: Number of rows to keep
+
+        Returns:
+            New QuestionStore sharing the arrays of this one
+        """
+        def column_head(column):
+            return StringColumn(column.offsets[:num_rows + 1], column.blob[:column.offsets[num_rows]])
+
+        keep = self.text_index.rows < num_rows
+        return QuestionStore(column_head(self.qids), column_head(self.texts),
+                             TextHashIndex(self.text_index.hashes[keep], self.text_index.rows[keep]))
+
+    def find_exact(self, clean_text):
+        """
+        Find the row whose clean text equals clean_text.
+
+        Args:
+            clean_text: Text normalized with clean_question_text
+
+        Returns:
+            Row id of the first matching question, or None
+        """
+        for row in self.text_index.candidate_rows(clean_text).tolist():
+            if self.texts[row] == clean_text:
+                return row
+        return None
+
+    def lookup(self, indices):
+        """
+        Fetch question ids and texts for a set of row ids.
+
+        Args:
+            indices: Sequence or array of row ids
+
+        Returns:
+            Tuple of (list of question ids, list of clean question texts)
+        """
+        return self.qids.take(indices), self.texts.take(indices)
+
+    def to_dataframe(self):
+        """
+        Convert the store back to a questions DataFrame.
+
+        Returns:
+            DataFrame with 'qid' and 'clean_question' columns
+        """
+        return pd.DataFrame({'qid': list(self.qids), 'clean_question': list(self.texts)})
+
+    def __len__(self):
+        return len(self.qids)
+
+    @property
+    def nbytes(self):
+        return self.qids.nbytes + self.texts.nbytes + self.text_index.nbytes
+
+
+class QuestionStoreWriter:
+    """
+    Write a question store incrementally, without holding all questions in memory.
+
+    Chunks are appended to raw files in a new generation directory and converted
+    to the .npy arrays read by QuestionStore.load when the writer is closed. The
+    generation becomes current only then, so readers keep the previous store
+    until the new one is complete.
+    """
+
+    def __init__(self, store_path=None):
+        """
+        Args:
+            store_path: Directory to write to. If None, uses default from config.
+        """
+        self.store_path = store_path or Config.QUESTION_STORE_PATH
+        os.makedirs(self.store_path, exist_ok=True)
+        self.generation = _new_generation(self.store_path)
+        self.num_rows = 0
+        self._blob_sizes = {'qid': 0, 'text': 0}
+        self._files = {f"{column}_{part}": open(self._raw_path(f"{column}_{part}"), 'wb')
+                       for column in ('qid', 'text') for part in ('offsets', 'blob')}
+
+    def append(self, qids, texts):
+        """
+        Append a chunk of questions.
+
+        Args:
+            qids: List of question ids
+            texts: List of clean question texts
+        """
+        for column, strings in (('qid', qids), ('text', texts)):
+            chunk = StringColumn.from_strings(strings)
+            # Offsets are written without the leading zero; it is added on close
+            self._files[f"{column}_offsets"].write((chunk.offsets[1:] + self._blob_sizes[column]).tobytes())
+            self._files[f"{column}_blob"].write(chunk.blob.tobytes())
+            self._blob_sizes[column] += len(chunk.blob)
+        self.num_rows += len(qids)
+
+    def close(self):
+        """Convert the raw chunk files to the .npy arrays of a saved store and make it current"""
+        for f in self._files.values():
+            f.close()
+
+        generation_path = os.path.join(self.store_path, self.generation)
+        for name in STORE_FILES:
+            dtype = np.int64 if name.endswith('offsets') else np.uint8
+            if os.path.getsize(self._raw_path(name)):
+                raw = np.memmap(self._raw_path(name), mode='r', dtype=dtype)
+            else:
+                raw = np.zeros(0, dtype=dtype)  # an empty file cannot be memory-mapped
+            leading = 1 if name.endswith('offsets') else 0
+            out = np.lib.format.open_memmap(os.path.join(generation_path, f"{name}.npy"), mode='w+',
+                                            dtype=raw.dtype, shape=(len(raw) + leading,))
+            if leading:
+                out[0] = 0
+            out[leading:] = raw
+            out.flush()
+            del out, raw
+            os.remove(self._raw_path(name))
+
+        # Build the exact-match index from the finished text column
+        texts = StringColumn(*(np.load(os.path.join(generation_path, f"{name}.npy"), mmap_mode='r')
+                               for name in ('text_offsets', 'text_blob')))
+        text_index = TextHashIndex.from_column(texts)
+        for name, array in (('text_hashes', text_index.hashes), ('text_hash_rows', text_index.rows)):
+            np.save(os.path.join(generation_path, f"{name}.npy"), array)
+        del texts
+
+        _switch_generation(self.store_path, self.generation)
+
+    def _raw_path(self, name):
+        return os.path.join(self.store_path, self.generation, f"{name}.raw")
@@ -1,25 +1,206 @@
+import sys
+import threading
+import time
 import numpy as np
 from sentence_transformers import CrossEncoder
+from .cache import LRUCache, ENTRY_OVERHEAD_BYTES
 from .config import Config
-from .utils import clean_question_text
+from .utils import clean_question_text, length_sorted_order, backend_model_kwargs
 
 
-def load_reranker(model_name=None):
+def load_reranker(model_name=None, max_length=None, backend=None, onnx_file_name=None):
     """
     Load cross-encoder model for reranking.
 
     Args:
-        model_name: Name or path of the model. If None, uses default from config.
+        model_name: Name or path of the model. If None, uses default from config
+            (the exported ONNX model for the onnx backend).
+        max_length: Maximum number of tokens per query-candidate pair. If None, uses default
+            from config, or the model's own limit if that is not set.
+        backend: Inference backend, "torch" or "onnx". If None, uses default from config.
+        onnx_file_name: ONNX file inside the model directory for the onnx backend. If None,
+            uses default from config.
 
     Returns:
         Loaded CrossEncoder model
     """
-    model_name = model_name or Config.RERANKER_MODEL
-    print(f"Loading reranker model: {model_name}")
-    return CrossEncoder(model_name)
+    backend = backend or Config.INFERENCE_BACKEND
+    model_name = model_name or (Config.RERANKER_ONNX_PATH if backend == 'onnx' else Config.RERANKER_MODEL)
+    max_length = max_length or Config.RERANKER_MAX_SEQ_LENGTH
+    onnx_file_name = onnx_file_name or Config.RERANKER_ONNX_FILE_NAME
+    print(f"Loading reranker model: {model_name} ({backend})")
+    return CrossEncoder(model_name, max_length=max_length,
+                        **backend_model_kwargs(model_name, backend, onnx_file_name))
 
 
-def rerank_candidates(query_text, candidates, reranker):
+def _score_entry_size(key, value):
+    # Keys are (version, clean query, question id) tuples of strings; values are floats
+    return sum(sys.getsizeof(part) for part in key) + sys.getsizeof(key) + sys.getsizeof(value) + ENTRY_OVERHEAD_BYTES
+
+
+class RerankScoreCache:
+    """
+    Bounded cache of cross-encoder scores keyed on (clean query, candidate question id).
+
+    Entries belong to a version stamp of the reranker and the corpus. Setting a
+    new version drops the cached scores, so a model or index change never serves
+    stale scores.
+    """
+
+    def __init__(self, max_bytes, ttl_seconds=None, version=None):
+        """
+        Args:
+            max_bytes: Maximum cache size in bytes
+            ttl_seconds: Entry lifetime in seconds. If None, entries never expire.
+            version: Version stamp of the reranker and corpus
+        """
+        self._cache = LRUCache(max_bytes, ttl_seconds, sizeof=_score_entry_size)
+        self.version = version
+
+    def set_version(self, version):
+        """Switch to a new version stamp, dropping scores cached for the previous one"""
+        if version != self.version:
+            self.version = version
+            self._cache.clear()
+
+    def get(self, clean_query, question_id):
+        """Return the cached score of a pair, or None"""
+        return self._cache.get((self.version, clean_query, question_id))
+
+    def put(self, clean_query, question_id, score):
+        """Cache the score of a pair"""
+        self._cache.put((self.version, clean_query, question_id), score)
+
+    def stats(self):
+        return {**self._cache.stats(), 'version': self.version}
+
+
+def create_rerank_cache(max_bytes=None, ttl_seconds=None, version=None):
+    """
+    Create a reranker score cache.
+
+    Args:
+        max_bytes: Maximum cache size in bytes. If None, uses default from config.
+        ttl_seconds: Entry lifetime in seconds. If None, uses default from config.
+        version: Version stamp of the reranker and corpus
+
+    Returns:
+        RerankScoreCache instance, or None if caching is disabled (max_bytes of 0)
+    """
+    max_bytes = Config.RERANK_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    ttl_seconds = ttl_seconds or Config.RERANK_CACHE_TTL_SECONDS
+    if not max_bytes:
+        return None
+    return RerankScoreCache(max_bytes, ttl_seconds, version)
+
+
+class RerankCostModel:
+    """
+    Running estimate of the reranker time per query-candidate pair.
+
+    Updated with an exponentially weighted moving average of measured calls and
+    used to turn a latency budget into a number of pairs to rerank.
+    """
+
+    def __init__(self, initial_pair_ms=None, alpha=None):
+        """
+        Args:
+            initial_pair_ms: Estimate used before the first measurement. If None, uses default from config.
+            alpha: Weight of the newest measurement. If None, uses default from config.
+        """
+        self.pair_ms = initial_pair_ms or Config.RERANK_PAIR_COST_MS
+        self.alpha = alpha or Config.RERANK_COST_EWMA_ALPHA
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def update(self, num_pairs, elapsed_ms):
+        """Record a reranker call that scored num_pairs pairs in elapsed_ms"""
+        if num_pairs <= 0:
+            return
+        with self._lock:
+            self.pair_ms += self.alpha * (elapsed_ms / num_pairs - self.pair_ms)
+            self.calls += 1
+
+    def max_pairs(self, budget_ms):
+        """Number of pairs expected to fit in budget_ms"""
+        with self._lock:
+            return max(int(budget_ms / self.pair_ms), 0)
+
+    def stats(self):
+        with self._lock:
+            return {'pair_ms': self.pair_ms, 'calls': self.calls}
+
+
+def plan_reranking(candidates, k_final, thresholds=None):
+    """
+    Decide how many of a query's candidates to send through the cross-encoder.
+
+    Candidates are in FAISS order. The reranker is skipped when the best candidate
+    is closer than the next one by at least the skip gap, and otherwise restricted
+    to candidates within the distance margin of the best one. Latency budgets are
+    applied to the plans of a whole batch by apply_rerank_budget.
+
+    Args:
+        candidates: List of candidates with 'faiss_distance', in FAISS order
+        k_final: Number of final results
+        thresholds: Tuple of (skip gap, distance margin), each None to disable. If None, uses
+            RERANK_SKIP_GAP and RERANK_DISTANCE_MARGIN from config.
+
+    Returns:
+        Dictionary with the path taken ('full', 'shrunk' or 'skipped'),
+        the number of candidates to rerank and the number of candidates
+    """
+    skip_gap, distance_margin = thresholds or (Config.RERANK_SKIP_GAP, Config.RERANK_DISTANCE_MARGIN)
+    num_candidates = len(candidates)
+    distances = [candidate['faiss_distance'] for candidate in candidates]
+    path, limit = 'full', num_candidates
+
+    if skip_gap is not None and num_candidates >= 2 and distances[1] - distances[0] >= skip_gap:
+        path, limit = 'skipped', 0
+    else:
+        if distance_margin is not None and num_candidates:
+            within_margin = sum(d <= distances[0] + distance_margin for d in distances)
+            limit = max(within_margin, min(k_final, num_candidates))
+            if limit < num_candidates:
+                path = 'shrunk'
+
+    return {'path': path, 'reranked': limit, 'candidates': num_candidates}
+
+
+def apply_rerank_budget(plans, latency_budget_ms, cost_model=None):
+    """
+    Cap the reranking plans of a batch so their single cross-encoder call fits a latency budget.
+
+    All queries of a batch share one predict call, so the budget bounds the pairs
+    of the whole call. When the plans ask for more pairs than fit, the pairs are
+    shared out evenly, and queries needing fewer than their share give the rest
+    to the others. Plans that lose candidates take the 'budget' path.
+
+    Args:
+        plans: Reranking plans from plan_reranking, updated in place
+        latency_budget_ms: Reranking time budget of the whole call, or None for no budget
+        cost_model: RerankCostModel used to convert the budget into pairs
+
+    Returns:
+        The plans
+    """
+    if latency_budget_ms is None:
+        return plans
+    cost_model = cost_model or RerankCostModel()
+    remaining = cost_model.max_pairs(latency_budget_ms)
+    if sum(plan['reranked'] for plan in plans) <= remaining:
+        return plans
+
+    by_size = sorted(plans, key=lambda plan: plan['reranked'])
+    for i, plan in enumerate(by_size):
+        share = min(plan['reranked'], remaining // (len(by_size) - i))
+        if share < plan['reranked']:
+            plan.update(path='budget', reranked=share)
+        remaining -= share
+    return plans
+
+
+def rerank_candidates(query_text, candidates, reranker, score_cache=None):
     """
     Rerank candidates using cross-encoder.
 
@@ -27,29 +208,93 @@ def rerank_candidates(query_text, candidates, reranker):
         query_text: Query text
         candidates: List of candidate questions with metadata
         reranker: CrossEncoder model
+        score_cache: Optional RerankScoreCache
 
     Returns:
         List of reranked candidates
     """
-    clean_query = clean_question_text(query_text)
+    return rerank_candidates_batch([query_text], [candidates], reranker, score_cache=score_cache)[0]
+
+
+def rerank_candidates_batch(query_texts, candidates_lists, reranker, rerank_counts=None, cost_model=None,
+                            score_cache=None):
+    """
+    Rerank the candidates of several queries with a single cross-encoder call.
+
+    Args:
+        query_texts: List of query texts
+        candidates_lists: List of candidate lists, one per query, in FAISS order
+        reranker: CrossEncoder model
+        rerank_counts: Optional number of leading candidates to rerank per query. The
+            others keep their FAISS order after the reranked ones. If None, all are reranked.
+        cost_model: Optional RerankCostModel updated with the measured time per pair
+        score_cache: Optional RerankScoreCache; only pairs missing from it are scored
+
+    Returns:
+        List of reranked candidate lists, one per query
+    """
+    if rerank_counts is None:
+        rerank_counts = [len(candidates) for candidates in candidates_lists]
+
+    # Prepare query-candidate pairs for all queries
+    query_pairs = []
+    question_ids = []
+    for query_text, candidates, count in zip(query_texts, candidates_lists, rerank_counts):
+        clean_query = clean_question_text(query_text)
+        query_pairs.extend((clean_query, candidate['clean_question']) for candidate in candidates[:count])
+        question_ids.extend(candidate['question_id'] for candidate in candidates[:count])
+
+    # Look up cached scores; only the misses go to the model
+    scores = np.empty(len(query_pairs), dtype=np.float32)
+    missing = []
+    for i, ((clean_query, _), question_id) in enumerate(zip(query_pairs, question_ids)):
+        cached = score_cache.get(clean_query, question_id) if score_cache is not None else None
+        if cached is None:
+            missing.append(i)
+        else:
+            scores[i] = cached
+
+    # Get reranking scores, batching pairs of similar length together when they span several batches
+    if missing:
+        start = time.perf_counter()
+        missing_pairs = [query_pairs[i] for i in missing]
+        missing_scores = np.empty(len(missing), dtype=np.float32)
+        if len(missing_pairs) <= Config.BATCH_SIZE:
+            missing_scores[:] = reranker.predict(missing_pairs, batch_size=Config.BATCH_SIZE)
+        else:
+            order = length_sorted_order([pair[0] for pair in missing_pairs], [pair[1] for pair in missing_pairs])
+            missing_scores[order] = reranker.predict([missing_pairs[i] for i in order],
+                                                     batch_size=Config.BATCH_SIZE)
+        scores[missing] = missing_scores
+        if cost_model is not None:
+            cost_model.update(len(missing), (time.perf_counter() - start) * 1000)
+        if score_cache is not None:
+            for i, score in zip(missing, missing_scores.tolist()):
+                score_cache.put(query_pairs[i][0], question_ids[i], score)
 
-    # Prepare query-candidate pairs
-    query_pairs = [(clean_query, candidate['clean_question']) for candidate in candidates]
+    reranked_lists = []
+    offset = 0
+    for candidates, count in zip(candidates_lists, rerank_counts):
+        # Add scores to candidates
+        for i, score in enumerate(scores[offset:offset + count]):
+            probability = 1 / (1 + np.exp(-score))
+            candidates[i]['rerank_score'] = float(score)
+            candidates[i]['similarity_percentage'] = f"{probability * 100:.1f}%"
+        offset += count
 
-    # Get reranking scores
-    scores = reranker.predict(query_pairs)
+        # Candidates left out keep their FAISS order, scored by cosine similarity of normalized embeddings
+        for candidate in candidates[count:]:
+            cosine = max(1 - candidate['faiss_distance'] / 2, 0.0)
+            candidate['rerank_score'] = None
+            candidate['similarity_percentage'] = f"{cosine * 100:.1f}%"
 
-    # Add scores to candidates
-    for i, score in enumerate(scores):
-        probability = 1 / (1 + np.exp(-score))
-        candidates[i]['rerank_score'] = float(score)
-        candidates[i]['similarity_percentage'] = f"{probability * 100:.1f}%"
+        # Sort by rerank score
+        reranked = sorted(candidates[:count], key=lambda x: x['rerank_score'], reverse=True) + candidates[count:]
 
-    # Sort by rerank score
-    reranked = sorted(candidates, key=lambda x: x['rerank_score'], reverse=True)
+        # Add ranks
+        for i, result in enumerate(reranked):
+            result['rank'] = i + 1
 
-    # Add ranks
-    for i, result in enumerate(reranked):
-        result['rank'] = i + 1
+        reranked_lists.append(reranked)
 
-    return reranked
+    return reranked_lists
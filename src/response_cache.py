@@ -0,0 +1,245 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from .config import Config
+from .utils import clean_question_text
+
+# Hits refresh an entry's recency at most this often, so hot reads rarely need the write lock
+TOUCH_INTERVAL_SECONDS = 1.0
+# Entries deleted per statement while evicting
+EVICTION_BATCH = 16
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+CREATE TABLE IF NOT EXISTS usage (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL);
+INSERT OR IGNORE INTO usage VALUES (0, 0);
+CREATE TRIGGER IF NOT EXISTS responses_added AFTER INSERT ON responses
+    BEGIN UPDATE usage SET bytes = bytes + NEW.size; END;
+CREATE TRIGGER IF NOT EXISTS responses_removed AFTER DELETE ON responses
+    BEGIN UPDATE usage SET bytes = bytes - OLD.size; END;
+"""
+
+
+def response_cache_key(clean_query, k_candidates, k_final, version, **options):
+    """
+    Cache key of a search response.
+
+    Args:
+        clean_query: Cleaned query text
+        k_candidates: Number of FAISS candidates
+        k_final: Number of results
+        version: Version stamp of the models and artifacts that produce the response
+        **options: Other search settings that change the results, e.g. nprobe
+
+    Returns:
+        Hex digest identifying the response
+    """
+    data = json.dumps([version, clean_query, k_candidates, k_final, options], sort_keys=True)
+    return hashlib.blake2b(data.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def search_response_key(query, version, k_candidates=None, k_final=None, nprobe=None, ef_search=None,
+                        fill_exact=None, **_):
+    """
+    Cache key of an /api/search response.
+
+    Args:
+        query: Raw query text
+        version: Version stamp of the models and artifacts
+        k_candidates: Requested number of FAISS candidates, or None for the configured default
+        k_final: Requested number of results, or None for the configured default
+        nprobe: Requested nprobe, or None
+        ef_search: Requested ef_search, or None
+        fill_exact: Requested fill_exact, or None for the configured default
+        **_: Options that do not change a complete response, such as latency_budget_ms
+
+    Returns:
+        Hex digest identifying the response
+    """
+    return response_cache_key(clean_question_text(query),
+                              k_candidates or Config.DEFAULT_CANDIDATES, k_final or Config.DEFAULT_RESULTS, version,
+                              nprobe=nprobe, ef_search=ef_search,
+                              fill_exact=Config.EXACT_MATCH_FILL_RESULTS if fill_exact is None else fill_exact)
+
+
+class SharedResponseCache:
+    """
+    Search responses cached in an SQLite file shared by all worker processes on a host.
+
+    The file is opened in WAL mode, so lookups from any number of processes run
+    alongside one writer. Inserts and evictions happen in a single IMMEDIATE
+    transaction per write, keeping the total size under max_bytes by removing the
+    least recently used entries. Database errors, such as a lock held past the
+    busy timeout, count as misses: the search then runs normally.
+    """
+
+    def __init__(self, path, max_bytes, ttl_seconds=None, busy_timeout_ms=None):
+        """
+        Args:
+            path: Path of the SQLite file, created if missing
+            max_bytes: Maximum total size of the cached responses
+            ttl_seconds: Entry lifetime in seconds. If None, entries never expire.
+            busy_timeout_ms: Time to wait for another process's write. If None, uses default from config.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.busy_timeout_ms = busy_timeout_ms or Config.RESPONSE_CACHE_BUSY_TIMEOUT_MS
+        self._local = threading.local()
+        self._counter_lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self):
+        # SQLite connections must not cross a fork; each thread of each process opens its own
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000,
+                                         isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def _count(self, counter):
+        with self._counter_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, key):
+        """
+        Look up a response.
+
+        Args:
+            key: Key from response_cache_key
+
+        Returns:
+            Cached response, or None if missing, expired or unreadable
+        """
+        now = time.time()
+        try:
+            connection = self._connection()
+            row = connection.execute('SELECT value, expires_at, last_used FROM responses WHERE key = ?',
+                                     (key,)).fetchone()
+            if row is not None and row[1] is not None and row[1] <= now:
+                connection.execute('DELETE FROM responses WHERE key = ? AND expires_at <= ?', (key, now))
+                row = None
+        except sqlite3.Error as e:
+            print(f"Response cache read failed: {e}")
+            self._count('errors')
+            row = None
+
+        if row is not None and now - row[2] > TOUCH_INTERVAL_SECONDS:
+            try:
+                connection.execute('UPDATE responses SET last_used = ? WHERE key = ?', (now, key))
+            except sqlite3.Error:
+                # A busy writer only delays the recency update; the hit stands
+                pass
+
+        if row is None:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return json.loads(row[0])
+
+    def put(self, key, response):
+        """
+        Insert or replace a response, evicting least recently used entries to stay under max_bytes.
+
+        Args:
+            key: Key from response_cache_key
+            response: JSON-serializable response
+        """
+        value = json.dumps(response, separators=(',', ':'))
+        size = len(key) + len(value)
+        if size > self.max_bytes:
+            return
+
+        now = time.time()
+        expires_at = now + self.ttl_seconds if self.ttl_seconds else None
+        try:
+            connection = self._connection()
+            # IMMEDIATE takes the write lock up front, so the size check and evictions see no concurrent insert
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+                connection.execute('INSERT INTO responses VALUES (?, ?, ?, ?, ?)',
+                                   (key, value, size, expires_at, now))
+                while connection.execute('SELECT bytes FROM usage').fetchone()[0] > self.max_bytes:
+                    connection.execute('DELETE FROM responses WHERE key IN '
+                                       '(SELECT key FROM responses ORDER BY last_used LIMIT ?)',
+                                       (EVICTION_BATCH,))
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            print(f"Response cache write failed: {e}")
+            self._count('errors')
+
+    def clear(self):
+        """Remove all entries, for every process sharing the file. Counters are kept."""
+        self._connection().execute('DELETE FROM responses')
+
+    def stats(self):
+        """
+        Report cache usage. Entry count and size cover all processes; counters cover this process.
+
+        Returns:
+            Dictionary with entry count, size, hit/miss/error counters and hit rate
+        """
+        try:
+            connection = self._connection()
+            entries = connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            size = connection.execute('SELECT bytes FROM usage').fetchone()[0]
+        except sqlite3.Error:
+            entries, size = None, None
+        with self._counter_lock:
+            lookups = self.hits + self.misses
+            return {
+                'path': self.path,
+                'entries': entries,
+                'bytes': size,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'errors': self.errors,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+def create_response_cache(path=None, max_bytes=None, ttl_seconds=None):
+    """
+    Create the shared search response cache.
+
+    Args:
+        path: Path of the SQLite file. If None, uses default from config.
+        max_bytes: Maximum cache size in bytes. If None, uses default from config.
+        ttl_seconds: Entry lifetime in seconds. If None, uses default from config.
+
+    Returns:
+        SharedResponseCache instance, or None if caching is disabled (max_bytes of 0)
+    """
+    path = path or Config.RESPONSE_CACHE_PATH
+    max_bytes = Config.RESPONSE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    ttl_seconds = ttl_seconds or Config.RESPONSE_CACHE_TTL_SECONDS
+    if not max_bytes:
+        return None
+    return SharedResponseCache(path, max_bytes, ttl_seconds)
@@ -0,0 +1,431 @@
+import json
+import os
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+import time
+import numpy as np
+import faiss
+from .config import Config
+from .faiss_index_search import (TieredIndex, build_faiss_index, get_search_parameters, load_faiss_index,
+                                 read_delta_index)
+
+# Each message is a JSON header, prefixed by its length, followed by the raw bytes of
+# the arrays it lists. Only numeric arrays are sent, so nothing is unpickled.
+_LENGTH = struct.Struct('!I')
+_ARRAY_DTYPES = ('<f4', '<i8')
+
+_WORKER_SCRIPT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts', 'shard_worker.py'))
+
+
+def shard_path(faiss_index_output_path=None, shard_id=0):
+    """Path of one shard file, e.g. models/questions_index.shard0.faiss"""
+    root, ext = os.path.splitext(faiss_index_output_path or Config.FAISS_INDEX_PATH)
+    return f"{root}.shard{shard_id}{ext}"
+
+
+def shard_bounds(num_vectors, num_shards):
+    """Row ranges of the shards: contiguous and as equal as possible"""
+    bounds = np.linspace(0, num_vectors, num_shards + 1).astype(int)
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def build_sharded_index(emb_list, num_shards, index_type=None, train_sample_size=None, chunk_size=None,
+                        faiss_index_output_path=None):
+    """
+    Split the embeddings into contiguous row ranges and write one index file per range.
+
+    Each shard is trained and built on its own rows only, so no process ever holds
+    more than one shard. Shard i covers the rows after those of shards 0..i-1, which
+    is how the router turns shard-local ids back into question store rows.
+
+    Args:
+        emb_list: Numpy array of embeddings (may be memory-mapped)
+        num_shards: Number of shards
+        index_type: One of INDEX_TYPES. If None, uses default from config.
+        train_sample_size: Maximum number of vectors used to train IVF indexes
+        chunk_size: Number of vectors added per call
+        faiss_index_output_path: Path of the unsharded index; shard files are named after it
+
+    Returns:
+        List of shard file paths
+    """
+    paths = []
+    for shard_id, (start, end) in enumerate(shard_bounds(len(emb_list), num_shards)):
+        print(f"Building shard {shard_id + 1}/{num_shards} (rows {start}-{end})...")
+        index = build_faiss_index(emb_list[start:end], index_type, train_sample_size, chunk_size)
+        path = shard_path(faiss_index_output_path, shard_id)
+        faiss.write_index(index, f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+        paths.append(path)
+    print(f"Wrote {num_shards} shards next to {faiss_index_output_path or Config.FAISS_INDEX_PATH}")
+    return paths
+
+
+def _recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    while view:
+        received = sock.recv_into(view)
+        if not received:
+            raise ConnectionError("Connection closed by peer")
+        view = view[received:]
+    return buffer
+
+
+def send_message(sock, header, *arrays):
+    """Send a JSON header followed by numeric arrays"""
+    arrays = [np.ascontiguousarray(array) for array in arrays]
+    header = dict(header, arrays=[[array.dtype.str, list(array.shape)] for array in arrays])
+    data = json.dumps(header).encode()
+    # One write per message: separate small writes stall on delayed acknowledgements
+    sock.sendall(b''.join([_LENGTH.pack(len(data)), data] + [array.tobytes() for array in arrays]))
+
+
+def recv_message(sock):
+    """
+    Receive a message sent with send_message.
+
+    Returns:
+        Tuple of (header dictionary, list of arrays)
+    """
+    (length,) = _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))
+    header = json.loads(_recv_exact(sock, length))
+    arrays = []
+    for dtype, shape in header.pop('arrays'):
+        if dtype not in _ARRAY_DTYPES:
+            raise ValueError(f"Unexpected array dtype {dtype}")
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        arrays.append(np.frombuffer(_recv_exact(sock, size), dtype=dtype).reshape(shape))
+    return header, arrays
+
+
+def _index_kind(index):
+    if faiss.try_extract_index_ivf(index) is not None:
+        return 'ivf'
+    if isinstance(index, faiss.IndexHNSW):
+        return 'hnsw'
+    return 'flat'
+
+
+class _ShardHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        index = self.server.index
+        while True:
+            try:
+                header, arrays = recv_message(self.request)
+            except ConnectionError:
+                return
+            try:
+                if header['op'] == 'info':
+                    send_message(self.request, {'ntotal': index.ntotal, 'd': index.d, 'kind': _index_kind(index),
+                                                'file': self.server.file_stamp})
+                elif header['op'] == 'search':
+                    params = get_search_parameters(index, **header.get('params', {}))
+                    distances, indices = index.search(arrays[0], header['k'], params=params)
+                    send_message(self.request, {}, distances, indices)
+                else:
+                    send_message(self.request, {'error': f"Unknown operation {header['op']}"})
+            except Exception as e:
+                send_message(self.request, {'error': str(e)})
+
+
+class _ShardServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def _exit_with_parent(parent_pid):
+    # A local worker must not outlive the server that started it, even if that server is killed
+    while os.getppid() == parent_pid:
+        time.sleep(1)
+    os._exit(0)
+
+
+def serve_shard(index_path, host=None, port=0, threads=None, parent_pid=None):
+    """
+    Serve searches on one shard file until the process is stopped.
+
+    Args:
+        index_path: Path of the shard index
+        host: Interface to listen on. If None, uses default from config.
+        port: Port to listen on
+        threads: OpenMP threads used by FAISS in this process, or None for the FAISS default
+        parent_pid: Exit when the process with this id is no longer the parent
+    """
+    host = host or Config.SHARD_HOST
+    if threads:
+        faiss.omp_set_num_threads(threads)
+    if parent_pid:
+        threading.Thread(target=_exit_with_parent, args=(parent_pid,), daemon=True).start()
+    file_stamp = _file_stamp(index_path)
+    index = load_faiss_index(index_path)
+    server = _ShardServer((host, port), _ShardHandler)
+    server.index = index
+    server.file_stamp = file_stamp
+    print(f"Shard {index_path} with {index.ntotal} vectors listening on {host}:{port}", flush=True)
+    server.serve_forever()
+
+
+def _file_stamp(path):
+    # Size and modification time identify the shard file a worker loaded
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _free_port(host):
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def _wait_until_serving(address, process, deadline, file_stamp):
+    # The info reply must come from our worker with the current shard file, not from another
+    # process listening on the same port (such as a worker of the set being replaced)
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f"Shard worker for {address[0]}:{address[1]} exited with code {process.returncode}")
+        try:
+            with socket.create_connection(address, timeout=1) as sock:
+                send_message(sock, {'op': 'info'})
+                info, _ = recv_message(sock)
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+    if info.get('file') != file_stamp:
+        raise RuntimeError(f"{address[0]}:{address[1]} serves a different shard file than the one on disk")
+
+
+def start_local_shard_workers(num_shards, faiss_index_output_path=None, host=None, threads=None, timeout=None):
+    """
+    Start one scripts/shard_worker.py process per shard file on this machine.
+
+    Args:
+        num_shards: Number of shards
+        faiss_index_output_path: Path of the unsharded index the shard files are named after
+        host: Interface the workers listen on. If None, uses default from config.
+        threads: FAISS threads per worker. If None, the cores are split between the workers.
+        timeout: Seconds to wait for the workers to load. If None, uses default from config.
+
+    Returns:
+        Tuple of (list of (host, port) addresses in shard order, list of processes)
+    """
+    faiss_index_output_path = faiss_index_output_path or Config.FAISS_INDEX_PATH
+    host = host or Config.SHARD_HOST
+    threads = threads or Config.SHARD_WORKER_THREADS or max(1, (os.cpu_count() or 1) // num_shards)
+    timeout = timeout or Config.SHARD_TIMEOUT_SECONDS
+
+    missing = [shard_path(faiss_index_output_path, shard_id) for shard_id in range(num_shards)
+               if not os.path.exists(shard_path(faiss_index_output_path, shard_id))]
+    if missing:
+        raise FileNotFoundError(f"Shard files not found: {', '.join(missing)}. "
+                                f"Run build_index_offline.py with --shards {num_shards}")
+
+    # Separate programs rather than forked or spawned copies of the server, which would
+    # inherit its model threads or re-import its models. Ports are always picked free: during a
+    # hot reload the workers being replaced still hold theirs.
+    addresses, processes = [], []
+    file_stamps = [_file_stamp(shard_path(faiss_index_output_path, shard_id)) for shard_id in range(num_shards)]
+    for shard_id in range(num_shards):
+        port = _free_port(host)
+        processes.append(subprocess.Popen([
+            sys.executable, _WORKER_SCRIPT, '--shard', str(shard_id), '--host', host, '--port', str(port),
+            '--index-path', faiss_index_output_path, '--threads', str(threads), '--parent-pid', str(os.getpid())
+        ]))
+        addresses.append((host, port))
+
+    deadline = time.monotonic() + timeout
+    try:
+        for address, process, file_stamp in zip(addresses, processes, file_stamps):
+            _wait_until_serving(address, process, deadline, file_stamp)
+    except Exception as e:
+        stop_processes(processes)
+        raise RuntimeError(f"Shard workers did not start within {timeout}s: {e}")
+    return addresses, processes
+
+
+def stop_processes(processes):
+    """Terminate local shard workers and wait for them to exit"""
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def parse_shard_addresses(addresses):
+    """Turn 'host:port' strings into (host, port) tuples"""
+    parsed = []
+    for address in addresses:
+        host, _, port = address.rpartition(':')
+        parsed.append((host, int(port)))
+    return parsed
+
+
+class ShardedIndex:
+    """
+    Router with the search interface of a FAISS index, backed by shard workers.
+
+    A search sends the query matrix to every shard before reading any reply, so
+    the shards search in parallel, then merges their top k by distance. Shard
+    workers return shard-local ids, which are offset by the rows of the shards
+    before them. Each thread of each process opens its own connections, so the
+    router can be shared by request threads and survives forking.
+    """
+
+    def __init__(self, addresses, processes=None, timeout=None):
+        """
+        Args:
+            addresses: List of (host, port) tuples in shard order
+            processes: Local worker processes owned by this router, stopped by close()
+            timeout: Socket timeout in seconds. If None, uses default from config.
+        """
+        self.addresses = list(addresses)
+        self.processes = list(processes or [])
+        self.timeout = timeout or Config.SHARD_TIMEOUT_SECONDS
+        self._owner_pid = os.getpid()
+        self._local = threading.local()
+
+        infos = [self._request(shard_id, {'op': 'info'})[0] for shard_id in range(self.num_shards)]
+        dimensions = {info['d'] for info in infos}
+        if len(dimensions) != 1:
+            raise ValueError(f"Shards have different dimensions: {sorted(dimensions)}")
+        self.d = dimensions.pop()
+        self.kind = infos[0]['kind']
+        self.shard_sizes = [info['ntotal'] for info in infos]
+        self.offsets = np.cumsum([0] + self.shard_sizes[:-1]).tolist()
+
+    @property
+    def num_shards(self):
+        return len(self.addresses)
+
+    @property
+    def ntotal(self):
+        return sum(self.shard_sizes)
+
+    @property
+    def forked(self):
+        """True in a process forked after the local workers started, e.g. a gunicorn worker under preload_app"""
+        return bool(self.processes) and os.getpid() != self._owner_pid
+
+    def search_parameters(self, nprobe=None, ef_search=None):
+        """Search parameters forwarded to the workers, which build the FAISS objects themselves"""
+        if nprobe and self.kind == 'ivf':
+            return {'nprobe': int(nprobe)}
+        if ef_search and self.kind == 'hnsw':
+            return {'ef_search': int(ef_search)}
+        return None
+
+    def _connections(self):
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.pid = os.getpid()
+            self._local.sockets = [None] * self.num_shards
+        return self._local.sockets
+
+    def _connection(self, shard_id):
+        sockets = self._connections()
+        if sockets[shard_id] is None:
+            sockets[shard_id] = socket.create_connection(self.addresses[shard_id], timeout=self.timeout)
+            sockets[shard_id].setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sockets[shard_id]
+
+    def _drop_connections(self):
+        sockets = self._connections()
+        for shard_id, sock in enumerate(sockets):
+            if sock is not None:
+                sock.close()
+                sockets[shard_id] = None
+
+    def _request(self, shard_id, header, *arrays):
+        try:
+            sock = self._connection(shard_id)
+            send_message(sock, header, *arrays)
+            return self._reply(shard_id)
+        except OSError:
+            self._drop_connections()
+            raise
+
+    def _reply(self, shard_id):
+        header, arrays = recv_message(self._connection(shard_id))
+        if 'error' in header:
+            raise RuntimeError(f"Shard {shard_id}: {header['error']}")
+        return header, arrays
+
+    def search(self, x, k, params=None):
+        """
+        Search all shards and return the merged top k.
+
+        Args:
+            x: Float32 query matrix
+            k: Number of neighbours per query
+            params: Dictionary from search_parameters, or None
+
+        Returns:
+            Tuple of (distances, indices) with question store row ids
+        """
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        header = {'op': 'search', 'k': int(k), 'params': params or {}}
+        try:
+            # Scatter to every shard first, then gather, so the shards work concurrently
+            for shard_id in range(self.num_shards):
+                send_message(self._connection(shard_id), header, x)
+            replies = [self._reply(shard_id)[1] for shard_id in range(self.num_shards)]
+        except (OSError, RuntimeError):
+            # A connection with unread replies cannot be reused
+            self._drop_connections()
+            raise
+
+        heap = faiss.ResultHeap(len(x), k)
+        for (distances, indices), offset in zip(replies, self.offsets):
+            heap.add_result(np.ascontiguousarray(distances),
+                            np.where(indices >= 0, indices + offset, -1).astype(np.int64))
+        heap.finalize()
+        return heap.D, heap.I
+
+    def close(self):
+        """Close this thread's connections and stop the local workers started by this process"""
+        self._drop_connections()
+        if os.getpid() == self._owner_pid:
+            stop_processes(self.processes)
+            self.processes = []
+
+
+def load_sharded_index(num_shards=None, faiss_index_output_path=None, delta_index_path=None, addresses=None):
+    """
+    Connect to the shard workers, starting local ones if no addresses are given.
+
+    Args:
+        num_shards: Number of shards. If None, uses default from config.
+        faiss_index_output_path: Path of the unsharded index the shard files are named after
+        delta_index_path: Path to the delta index file. If None, uses default from config.
+        addresses: List of 'host:port' strings of running workers. If None, uses SHARD_ADDRESSES from config,
+            and starts local workers when that is empty.
+
+    Returns:
+        TieredIndex with a ShardedIndex as its main index
+    """
+    num_shards = num_shards or Config.NUM_SHARDS
+    delta_index_path = delta_index_path or Config.DELTA_INDEX_PATH
+    addresses = addresses or Config.SHARD_ADDRESSES
+
+    if addresses:
+        router = ShardedIndex(parse_shard_addresses(addresses))
+    else:
+        shard_addresses, processes = start_local_shard_workers(num_shards, faiss_index_output_path)
+        try:
+            router = ShardedIndex(shard_addresses, processes)
+        except Exception:
+            stop_processes(processes)
+            raise
+    print(f"Connected to {router.num_shards} shards with {router.ntotal} vectors")
+
+    # New questions stay in the local delta index until the next build
+    return TieredIndex(router, read_delta_index(delta_index_path))
@@ -1,4 +1,7 @@
+import os
 import re
+import numpy as np
+from .config import Config
 
 
 def clean_question_text(raw_str: str) -> str:
@@ -15,3 +18,99 @@ def clean_question_text(raw_str: str) -> str:
     text = re.sub(r'\s+', ' ', text)  # Replace one or more whitespace characters with a single space
     text = text.strip()  # Remove leading/trailing spaces
     return text
+
+
+def search_options_error(data):
+    """
+    Check the optional search settings of an API request body.
+
+    Args:
+        data: Parsed JSON request body
+
+    Returns:
+        Error message for the first invalid setting, or None if all are valid
+    """
+    for name in ('k_candidates', 'k_final', 'nprobe', 'ef_search'):
+        value = data.get(name)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, int) or value < 1):
+            return f"{name} must be a positive integer"
+
+    latency_budget_ms = data.get('latency_budget_ms')
+    if latency_budget_ms is not None and (isinstance(latency_budget_ms, bool)
+                                          or not isinstance(latency_budget_ms, (int, float))
+                                          or latency_budget_ms < 0):
+        return 'latency_budget_ms must be a non-negative number'
+
+    fill_exact = data.get('fill_exact')
+    if fill_exact is not None and not isinstance(fill_exact, bool):
+        return 'fill_exact must be true or false'
+    return None
+
+
+def clean_question_texts(raw_texts) -> list:
+    """
+    Clean many question texts, with the same output as clean_question_text on each.
+
+    str.split() without arguments splits on exactly the characters the regex \\s
+    matches (both use Py_UNICODE_ISSPACE) and drops leading and trailing whitespace,
+    so joining the words with single spaces collapses and trims in one C-level pass
+    instead of a regex substitution per text.
+
+    Args:
+        raw_texts: Iterable of raw question texts (e.g. a pandas Series)
+
+    Returns:
+        List of cleaned text strings
+    """
+    return [' '.join(str(raw_str).lower().split()) for raw_str in raw_texts]
+
+
+def length_sorted_order(texts, text_pairs=None):
+    """
+    Order inputs by character length, longest first.
+
+    Batching inputs in this order groups texts of similar length, so little
+    compute is spent on padding tokens. Character length tracks token length
+    closely enough for bucketing and costs no extra tokenizer pass.
+
+    Args:
+        texts: List of texts
+        text_pairs: Optional list of second texts for pair inputs (cross-encoders)
+
+    Returns:
+        Numpy array of indices into texts
+    """
+    lengths = [len(text) for text in texts]
+    if text_pairs is not None:
+        lengths = [length + len(pair) for length, pair in zip(lengths, text_pairs)]
+    return np.argsort(-np.asarray(lengths), kind='stable')
+
+
+def backend_model_kwargs(model_path, backend, onnx_file_name=None):
+    """
+    Build the keyword arguments selecting an inference backend for a sentence-transformers model.
+
+    Args:
+        model_path: Name or path of the model
+        backend: "torch" or "onnx"
+        onnx_file_name: ONNX file inside the model directory for the onnx backend. If None,
+            sentence-transformers picks or exports the default model.onnx.
+
+    Returns:
+        Dictionary of keyword arguments for SentenceTransformer or CrossEncoder
+
+    Raises:
+        FileNotFoundError: If model_path is a local directory without onnx_file_name
+    """
+    if backend == 'torch':
+        return {}
+    if backend != 'onnx':
+        raise ValueError(f"Unknown inference backend '{backend}'. Expected 'torch' or 'onnx'")
+
+    if not onnx_file_name:
+        return {'backend': backend}
+    # A missing (e.g. quantized) file must not silently fall back to another model
+    if os.path.isdir(model_path) and not os.path.exists(os.path.join(model_path, onnx_file_name)):
+        raise FileNotFoundError(f"ONNX file '{onnx_file_name}' not found in {model_path}. "
+                                f"Export it with scripts/export_onnx.py")
+    return {'backend': backend, 'model_kwargs': {'file_name': onnx_file_name}}
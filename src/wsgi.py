@@ -0,0 +1,5 @@
+from .app import create_app
+
+# WSGI entry point. With gunicorn's preload_app the models and memory-mapped
+# artifacts are loaded once in the master process and shared by forked workers.
+app = create_app()
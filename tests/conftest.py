@@ -0,0 +1,66 @@
+import sys
+import os
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+sys.path.insert(0, os.path.join(project_root, 'scripts'))
+
+import numpy as np
+import pytest
+from src.config import Config
+from benchmark import create_stand_in_models, make_synthetic_questions
+
+
+@pytest.fixture(scope='session')
+def stand_in_models(tmp_path_factory):
+    """Small randomly initialized embedding model and reranker, shared by all tests"""
+    os.environ.setdefault('HF_HUB_OFFLINE', '1')
+    return create_stand_in_models(str(tmp_path_factory.mktemp('models')), hidden_size=32, num_layers=1)
+
+
+@pytest.fixture
+def artifact_config(tmp_path, monkeypatch, stand_in_models):
+    """Point every artifact path of Config at a fresh directory and use the stand-in models"""
+    embedding_path, reranker_path = stand_in_models
+    settings = {
+        'EMBEDDING_MODEL': embedding_path,
+        'RERANKER_MODEL': reranker_path,
+        'INFERENCE_BACKEND': 'torch',
+        'DATA_PATH': str(tmp_path / 'train.tsv'),
+        'QUESTION_STORE_PATH': str(tmp_path / 'question_store'),
+        'EMBEDDINGS_PATH': str(tmp_path / 'embeddings.npy'),
+        'FAISS_INDEX_PATH': str(tmp_path / 'index.faiss'),
+        'DELTA_INDEX_PATH': str(tmp_path / 'delta.faiss'),
+        'BUILD_CHECKPOINT_PATH': str(tmp_path / 'build_checkpoint.json'),
+        'ARTIFACT_MANIFEST_PATH': str(tmp_path / 'manifest.json'),
+        'ARTIFACT_LOCK_PATH': str(tmp_path / 'artifacts.lock'),
+        'RESPONSE_CACHE_PATH': str(tmp_path / 'response_cache.sqlite'),
+        'INDEX_TYPE': 'flat',
+        'NUM_SHARDS': None,
+        'SHARD_ADDRESSES': None,
+        'ARTIFACT_WATCH_INTERVAL_SECONDS': None,
+        'BACKGROUND_LOADING': False
+    }
+    for name, value in settings.items():
+        monkeypatch.setattr(Config, name, value)
+    return tmp_path
+
+
+@pytest.fixture
+def dataset(artifact_config):
+    """Write a QQP-format dataset of synthetic question pairs and return its unique questions"""
+    rng = np.random.default_rng(0)
+    questions = list(dict.fromkeys(make_synthetic_questions(400, rng)))
+    pairs = len(questions) // 2
+    with open(Config.DATA_PATH, 'w') as f:
+        f.write("id\tqid1\tqid2\tquestion1\tquestion2\tis_duplicate\n")
+        for i in range(pairs):
+            f.write(f"{i}\t{2 * i + 1}\t{2 * i + 2}\t{questions[2 * i]}\t{questions[2 * i + 1]}\t0\n")
+    return questions[:2 * pairs]
+
+
+@pytest.fixture
+def built_artifacts(dataset):
+    """Build a flat index and question store over the dataset with the in-memory build"""
+    from build_index_offline import setup_search_system
+    setup_search_system()
+    return dataset
@@ -0,0 +1,53 @@
+import pytest
+from src.app import create_app
+
+QUERY = "how can i learn python and java online for a new job"
+
+
+@pytest.fixture
+def client(built_artifacts):
+    app = create_app()
+    assert app.artifacts is not None
+    return app.test_client()
+
+
+def test_search_uses_default_result_count(client):
+    response = client.post('/api/search', json={'query': QUERY})
+    assert response.status_code == 200
+    assert len(response.get_json()['results']) == 10
+
+
+def test_search_honours_k_final_and_k_candidates(client):
+    response = client.post('/api/search', json={'query': QUERY, 'k_final': 3})
+    assert response.status_code == 200
+    assert len(response.get_json()['results']) == 3
+
+    response = client.post('/api/search', json={'query': QUERY, 'k_candidates': 2, 'k_final': 5})
+    assert response.status_code == 200
+    assert len(response.get_json()['results']) == 2
+
+
+def test_cached_responses_are_kept_per_result_count(client):
+    first = client.post('/api/search', json={'query': QUERY, 'k_final': 3}).get_json()
+    assert not first['cached']
+    assert client.post('/api/search', json={'query': QUERY, 'k_final': 3}).get_json()['cached']
+
+    other = client.post('/api/search', json={'query': QUERY, 'k_final': 5}).get_json()
+    assert not other['cached']
+    assert len(other['results']) == 5
+
+
+@pytest.mark.parametrize('body', [
+    {},
+    {'query': 3},
+    {'query': QUERY, 'k_final': 0},
+    {'query': QUERY, 'k_final': '3'},
+    {'query': QUERY, 'k_candidates': True},
+    {'query': QUERY, 'nprobe': -1},
+    {'query': QUERY, 'latency_budget_ms': 'fast'},
+    {'query': QUERY, 'fill_exact': 1}
+])
+def test_invalid_search_requests_are_rejected(client, body):
+    response = client.post('/api/search', json=body)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
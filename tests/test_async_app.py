@@ -0,0 +1,104 @@
+import json
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+import pytest
+import uvicorn
+from src.config import Config
+from src.async_app import create_asgi_app
+from src.inference_pool import InferencePool
+
+ADMIN_TOKEN = 'test-token'
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def server(built_artifacts, monkeypatch):
+    """Async app with two inference workers, served by uvicorn on a free port"""
+    monkeypatch.setattr(Config, 'ADMIN_TOKEN', ADMIN_TOKEN)
+    app = create_asgi_app(InferencePool(num_workers=2, threads_per_worker=1))
+    port = _free_port()
+    uvicorn_server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning'))
+    thread = threading.Thread(target=uvicorn_server.run, daemon=True)
+    thread.start()
+
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 120
+    while True:
+        try:
+            status, body = _request(base_url, '/api/health')
+            if status == 200 and all(worker['ready'] for worker in json.loads(body)['workers'].values()):
+                break
+        except OSError:
+            pass
+        assert time.monotonic() < deadline, "inference workers did not start"
+        time.sleep(0.2)
+    yield base_url
+    uvicorn_server.should_exit = True
+    thread.join()
+
+
+def _request(base_url, path, data=None, headers=None):
+    body = None if data is None else json.dumps(data).encode('utf-8')
+    request = urllib.request.Request(base_url + path, data=body, headers={'Content-Type': 'application/json',
+                                                                         **(headers or {})})
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return response.status, response.read().decode('utf-8')
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode('utf-8')
+
+
+def test_pages_and_metrics(server):
+    status, body = _request(server, '/')
+    assert status == 200 and '<html' in body.lower()
+    status, body = _request(server, '/search?query=how+do+i+learn+python')
+    assert status == 200 and 'Rank' in body
+
+    status, body = _request(server, '/api/search', {'query': "what is the best way to learn java", 'k_final': 3})
+    assert status == 200 and len(json.loads(body)['results']) == 3
+
+    status, body = _request(server, '/metrics')
+    assert status == 200
+    assert 'http_requests_total{endpoint="api_search",status="200"} 1.0' in body
+    assert 'search_stage_duration_seconds_count{stage=' in body
+    assert 'cache_lookups_total{cache="embedding",result="miss"}' in body
+    assert 'inference_queue_depth 0.0' in body
+
+
+def test_admin_endpoints_update_every_worker(server):
+    status, _ = _request(server, '/api/admin/reload', {})
+    assert status == 401
+
+    headers = {'X-Admin-Token': ADMIN_TOKEN}
+    status, body = _request(server, '/api/admin/questions',
+                            {'questions': [{'qid': 'new-1', 'question': "How do I sell stock online?!"}]}, headers)
+    assert status == 200
+    added = json.loads(body)
+    assert added['added'] == 1
+
+    # Both workers loaded the version written by the add
+    _, body = _request(server, '/api/health')
+    versions = {worker['artifact_version'] for worker in json.loads(body)['workers'].values()}
+    assert len(versions) == 1
+    for _ in range(4):
+        _, body = _request(server, '/api/search', {'query': "how do i sell stock online?!"})
+        assert json.loads(body)['results'][0]['question_id'] == 'new-1'
+
+    status, body = _request(server, '/api/admin/compact', {}, headers)
+    assert status == 200
+    assert json.loads(body) == {'merged': 1, 'total': added['total']}
+
+    status, body = _request(server, '/api/admin/reload', {}, headers)
+    assert status == 200
+    workers = json.loads(body)['workers']
+    assert len(workers) == 2
+    assert all(artifacts['vectors'] == added['total'] and artifacts['delta_vectors'] == 0
+               for artifacts in workers.values())
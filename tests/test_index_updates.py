@@ -0,0 +1,85 @@
+import pytest
+from src.artifacts import artifact_version_stamp, load_artifact_set, read_artifact_version
+from src.embedding import load_embedding_model
+from src.index_updates import add_questions, compact_index
+from src.reranker import RerankScoreCache
+from src.response_cache import search_response_key
+
+
+@pytest.fixture
+def emb_model(stand_in_models):
+    return load_embedding_model(stand_in_models[0])
+
+
+def test_adds_from_two_processes_are_kept(built_artifacts, emb_model):
+    # Two workers that loaded the same build, each adding its own question
+    first = load_artifact_set()
+    second = load_artifact_set()
+    build_version = first.version
+
+    first, added = add_questions([('new-1', "how do i learn python online?!")], emb_model, first)
+    assert added == 1
+    assert first.version == read_artifact_version() != build_version
+
+    second, added = add_questions([('new-2', "why is java code so bad online?!")], emb_model, second)
+    assert added == 1
+    assert second.index.ntotal == len(second.question_store) == len(built_artifacts) + 2
+
+    # A reload, as triggered by the new manifest version, sees both adds
+    reloaded = load_artifact_set()
+    assert reloaded.version == second.version
+    qids, _ = reloaded.question_store.lookup(range(len(built_artifacts), reloaded.index.ntotal))
+    assert qids == ['new-1', 'new-2']
+    assert reloaded.index.delta.ntotal == 2
+
+
+def test_add_skips_questions_added_by_another_process(built_artifacts, emb_model):
+    first = load_artifact_set()
+    stale = load_artifact_set()
+    add_questions([('new-1', "how do i learn python online?!")], emb_model, first)
+
+    updated, added = add_questions([('new-2', "How do I learn Python online?!")], emb_model, stale)
+    assert added == 0
+    assert updated.index.ntotal == len(built_artifacts) + 1
+    assert updated.version == read_artifact_version()
+
+
+def test_compact_merges_adds_of_other_processes(built_artifacts, emb_model):
+    first = load_artifact_set()
+    stale = load_artifact_set()
+    add_questions([('new-1', "how do i learn python online?!")], emb_model, first)
+
+    compacted = compact_index(stale)
+    assert compacted.index.delta.ntotal == 0
+    assert compacted.index.main.ntotal == len(built_artifacts) + 1
+    assert compacted.version == read_artifact_version()
+
+    reloaded = load_artifact_set()
+    assert reloaded.index.main.ntotal == reloaded.index.ntotal == len(reloaded.question_store)
+
+
+def test_add_after_rebuild_requires_reload(built_artifacts, emb_model):
+    from build_index_offline import setup_search_system
+    loaded = load_artifact_set()
+    setup_search_system(sample_size=50)
+
+    with pytest.raises(ValueError, match="rebuilt"):
+        add_questions([('new-1', "how do i learn python online?!")], emb_model, loaded)
+
+
+def test_cached_results_follow_the_manifest_version(built_artifacts, emb_model):
+    first = load_artifact_set()
+    second = load_artifact_set()
+    assert artifact_version_stamp(first) == artifact_version_stamp(second)
+
+    updated, _ = add_questions([('new-1', "how do i learn python online?!")], emb_model, first)
+    stale_stamp, new_stamp = artifact_version_stamp(second), artifact_version_stamp(updated)
+    assert new_stamp != stale_stamp
+    # Every process that reloads the update shares the keys of the process that made it
+    assert artifact_version_stamp(load_artifact_set()) == new_stamp
+    assert search_response_key("what is python?", stale_stamp) != search_response_key("what is python?", new_stamp)
+
+    rerank_cache = RerankScoreCache(1024 * 1024, version=stale_stamp)
+    rerank_cache.put("what is python?", '1', 0.5)
+    rerank_cache.set_version(new_stamp)
+    assert rerank_cache.get("what is python?", '1') is None
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+from src.config import Config
+from src.question_store import QuestionStore, QuestionStoreWriter, CURRENT_FILE
+from build_index_offline import setup_search_system, setup_search_system_streaming
+import faiss
+
+
+def _store(texts, start=0):
+    return QuestionStore.from_dataframe(
+        pd.DataFrame({'qid': [str(start + i) for i in range(len(texts))], 'clean_question': texts}))
+
+
+def test_save_load_round_trip(tmp_path):
+    store = _store(["what is python?", "how do i learn java?", "what is python?"])
+    store.save(str(tmp_path))
+
+    loaded = QuestionStore.load(str(tmp_path), mmap=True)
+    assert list(loaded.qids) == ['0', '1', '2']
+    assert list(loaded.texts) == list(store.texts)
+    assert loaded.find_exact("how do i learn java?") == 1
+    assert loaded.find_exact("what is python?") == 0
+
+
+def test_save_replaces_previous_generation(tmp_path):
+    _store(["first store?"]).save(str(tmp_path))
+    _store(["second store?", "with two rows?"]).save(str(tmp_path))
+
+    loaded = QuestionStore.load(str(tmp_path))
+    assert list(loaded.texts) == ["second store?", "with two rows?"]
+
+
+def test_writer_switches_current_generation(tmp_path):
+    _store(["saved before the writer?"]).save(str(tmp_path))
+    previous = (tmp_path / CURRENT_FILE).read_text()
+
+    writer = QuestionStoreWriter(str(tmp_path))
+    writer.append(['0', '1'], ["first chunk?", "still first chunk?"])
+    writer.append(['2'], ["second chunk?"])
+    # Readers keep the previous store until the writer is closed
+    assert list(QuestionStore.load(str(tmp_path)).texts) == ["saved before the writer?"]
+    writer.close()
+
+    assert (tmp_path / CURRENT_FILE).read_text() != previous
+    loaded = QuestionStore.load(str(tmp_path))
+    assert list(loaded.qids) == ['0', '1', '2']
+    assert loaded.find_exact("second chunk?") == 2
+    assert not list(tmp_path.rglob('*.raw'))
+
+
+def test_writer_with_no_rows(tmp_path):
+    writer = QuestionStoreWriter(str(tmp_path))
+    writer.close()
+    assert len(QuestionStore.load(str(tmp_path))) == 0
+
+
+def test_streaming_build_after_in_memory_build(dataset):
+    setup_search_system(sample_size=100)
+    assert len(QuestionStore.load()) == 100
+
+    setup_search_system_streaming(chunk_size=64)
+    store = QuestionStore.load()
+    index = faiss.read_index(Config.FAISS_INDEX_PATH)
+    assert len(store) == len(dataset)
+    assert index.ntotal == len(dataset)
+    assert np.load(Config.EMBEDDINGS_PATH, mmap_mode='r').shape[0] == len(dataset)
@@ -0,0 +1,71 @@
+import os
+import numpy as np
+import pytest
+from src.config import Config
+from src.app import create_app, reload_artifacts
+from src.embedding import load_embedding_model
+from src.faiss_index_search import load_faiss_index
+from src.quantization import load_embeddings
+from src.question_matcher import search_similar_questions_batch
+from src.question_store import QuestionStore
+from src.reranker import load_reranker
+from src.sharding import build_sharded_index, load_sharded_index
+
+QUERIES = ["how can i learn python and java online for a new job", "what is the best way to lose weight"]
+
+
+@pytest.fixture
+def sharded_artifacts(built_artifacts, monkeypatch):
+    """Split the embeddings of the flat build into two shard files next to the flat index"""
+    embeddings, _ = load_embeddings()
+    build_sharded_index(np.asarray(embeddings, dtype=np.float32), 2)
+    monkeypatch.setattr(Config, 'NUM_SHARDS', 2)
+    return built_artifacts
+
+
+def test_sharded_search_matches_flat(sharded_artifacts, stand_in_models):
+    flat = load_faiss_index(Config.FAISS_INDEX_PATH)
+    sharded = load_sharded_index()
+    try:
+        embeddings, _ = load_embeddings()
+        queries = np.asarray(embeddings[::37], dtype=np.float32) + 0.01
+        flat_distances, flat_indices = flat.search(queries, 10)
+        sharded_distances, sharded_indices = sharded.search(queries, 10)
+        np.testing.assert_array_equal(sharded_indices, flat_indices)
+        np.testing.assert_allclose(sharded_distances, flat_distances, rtol=1e-5)
+
+        emb_model = load_embedding_model(stand_in_models[0])
+        reranker = load_reranker(stand_in_models[1])
+        question_store = QuestionStore.load(Config.QUESTION_STORE_PATH)
+        assert search_similar_questions_batch(QUERIES, emb_model, sharded, question_store, reranker) == \
+            search_similar_questions_batch(QUERIES, emb_model, flat, question_store, reranker)
+    finally:
+        sharded.main.close()
+
+
+def test_reload_replaces_local_shard_workers(sharded_artifacts):
+    app = create_app()
+    previous = app.artifacts.index.main
+    processes = list(previous.processes)
+    try:
+        assert reload_artifacts(app)
+        assert all(process.poll() is not None for process in processes)
+        assert app.artifacts.index.main is not previous
+        assert app.artifacts.index.main.num_shards == 2
+    finally:
+        app.artifacts.close()
+
+
+def test_forked_worker_rejects_reload(sharded_artifacts, monkeypatch):
+    app = create_app()
+    router = app.artifacts.index.main
+    try:
+        # As in a gunicorn worker forked after the app was loaded in the master
+        monkeypatch.setattr(router, '_owner_pid', os.getpid() + 1)
+        with pytest.raises(RuntimeError, match='preload_app'):
+            reload_artifacts(app)
+        assert app.artifacts.index.main is router
+        assert all(process.poll() is None for process in router.processes)
+    finally:
+        monkeypatch.undo()
+        app.artifacts.close()